@@ -0,0 +1,299 @@
+import argparse
+import contextlib
+import csv
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import DETECTOR_BACKENDS, OCR_BACKENDS, OCR_TIERS, ANPRSystem  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Mô hình phát hiện biển số (file .pt cho backend 'ultralytics', .onnx cho backend 'onnx')
+WEIGHTS_PATH = "runs/yolo_bien_so_xe_detector/weights/best.pt"
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+OUTPUT_FORMATS = ('jsonl', 'csv')
+CSV_FIELDS = ("path", "plate_index", "text", "confidence", "x1", "y1", "x2", "y2", "ocr_tier", "error")
+
+BATCH_SIZE = 16           # Số ảnh mỗi lô YOLO/EasyOCR
+NUM_READERS = 4           # Số luồng đọc và giải mã ảnh
+CHECKPOINT_EVERY = 1      # Ghi checkpoint sau mỗi N lô
+CHECKPOINT_VERSION = 1
+
+# ==============================================================================
+# PHẦN 2: ĐỌC ẢNH, GHI KẾT QUẢ, CHECKPOINT
+# ==============================================================================
+
+
+def iter_image_paths(inputs, recursive=False):
+    """
+    Liệt kê ảnh từ các thư mục, mẫu glob, file ảnh hoặc danh sách file (@danh_sach.txt, '@-' là stdin;
+    mỗi dòng một đường dẫn). Đây là generator: chỉ giữ tên file của một thư mục/mẫu glob tại một thời điểm,
+    và thứ tự luôn như nhau giữa các lần chạy (tên file được sắp xếp) để có thể chạy tiếp từ checkpoint.
+    """
+    for item in inputs:
+        if item.startswith("@"):
+            list_file = sys.stdin if item == "@-" else open(item[1:], encoding="utf-8")
+            try:
+                for line in list_file:
+                    path = line.strip()
+                    if path and not path.startswith("#"):
+                        yield path
+            finally:
+                if list_file is not sys.stdin:
+                    list_file.close()
+        elif os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                if not recursive:
+                    dirs.clear()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(item):
+            for path in sorted(glob.glob(item, recursive=recursive)):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    yield path
+        else:
+            # File ảnh chỉ định trực tiếp: không lọc theo đuôi, lỗi đọc được ghi vào kết quả
+            yield item
+
+
+def load_image(anpr_system, path):
+    """Đọc và giải mã ảnh (chạy trên luồng đọc). Trả về (đường dẫn, bytes, (ảnh, hệ số thu nhỏ), lỗi)."""
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+    except OSError as e:
+        return path, None, None, f"Không thể đọc file: {e.strerror or e}"
+    # cv2.imdecode nhả GIL nên các luồng đọc giải mã song song với luồng suy luận
+    return path, image_bytes, anpr_system._decode_for_detection(image_bytes), None
+
+
+def prefetch(anpr_system, paths, executor, depth):
+    """
+    Đọc và giải mã trước tối đa depth ảnh trên executor, trả kết quả theo đúng thứ tự đầu vào.
+    Số ảnh nằm trong bộ nhớ không phụ thuộc vào tổng số ảnh đầu vào.
+    """
+    pending = deque()
+    for path in paths:
+        pending.append(executor.submit(load_image, anpr_system, path))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def result_records(path, result):
+    """Chuyển kết quả của một ảnh thành bản ghi JSON (bỏ các ảnh NumPy)."""
+    if result.get("error"):
+        return {"path": path, "plates": [], "error": result["error"]}
+    plates = [{
+        "text": plate["text"],
+        "confidence": round(float(plate["confidence"]), 4),
+        "box": [int(v) for v in plate["box"]],
+        "ocr_tier": plate.get("ocr_tier"),
+    } for plate in result["plates"]]
+    return {"path": path, "plates": plates, "error": None}
+
+
+class ResultSink:
+    """Ghi kết quả ra JSON Lines (một dòng mỗi ảnh) hoặc CSV (một dòng mỗi biển số, ảnh không có biển số vẫn có một dòng)."""
+
+    def __init__(self, stream, output_format, write_header, durable=True):
+        self.stream = stream
+        self.durable = durable
+        self.output_format = output_format
+        self.writer = csv.writer(stream) if output_format == "csv" else None
+        if self.writer is not None and write_header:
+            self.writer.writerow(CSV_FIELDS)
+
+    def write(self, record):
+        if self.writer is None:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+        if not record["plates"]:
+            self.writer.writerow([record["path"], "", "", "", "", "", "", "", "", record["error"] or ""])
+        for index, plate in enumerate(record["plates"]):
+            self.writer.writerow([record["path"], index, plate["text"], plate["confidence"], *plate["box"],
+                                  plate["ocr_tier"] or "", ""])
+
+    def flush(self):
+        """Đẩy dữ liệu xuống đĩa; trả về kích thước file đã ghi bền vững (dùng cho checkpoint)."""
+        self.stream.flush()
+        if not self.durable:
+            return None
+        os.fsync(self.stream.fileno())
+        return os.fstat(self.stream.fileno()).st_size
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint {checkpoint_path} không đúng phiên bản {CHECKPOINT_VERSION}")
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """Ghi checkpoint nguyên tử (file tạm + os.replace) để lần dừng đột ngột không để lại file hỏng."""
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def run(args, stdout):
+    """stdout: luồng nhận kết quả khi --output là '-' (mọi thông báo khác đi ra stderr)."""
+    to_stdout = args.output == "-"
+    checkpoint_path = None if to_stdout else (args.checkpoint or f"{args.output}.checkpoint.json")
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    run_config = {"inputs": args.inputs, "recursive": args.recursive, "format": output_format}
+
+    checkpoint = None
+    if args.resume:
+        if to_stdout:
+            print("[LỖI] --resume cần --output là một file", file=sys.stderr)
+            return 1
+        checkpoint = load_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            print(f"[CẢNH BÁO] Không có checkpoint {checkpoint_path}, chạy lại từ đầu", file=sys.stderr)
+        elif checkpoint["config"] != run_config:
+            print(f"[LỖI] Checkpoint {checkpoint_path} thuộc lần chạy với đầu vào/định dạng khác: "
+                  f"{checkpoint['config']}", file=sys.stderr)
+            return 1
+
+    if checkpoint is not None:
+        # Bỏ phần kết quả ghi sau checkpoint cuối (lần chạy trước dừng giữa chừng) rồi ghi tiếp
+        stream = open(args.output, "r+", encoding="utf-8", newline="")
+        stream.truncate(checkpoint["output_bytes"])
+        stream.seek(0, os.SEEK_END)
+        processed, stats = checkpoint["processed"], checkpoint["stats"]
+        print(f"[INFO] Chạy tiếp từ checkpoint: đã xử lý {processed} ảnh (ảnh cuối: {checkpoint['last_path']})",
+              file=sys.stderr)
+    else:
+        stream = stdout if to_stdout else open(args.output, "w", encoding="utf-8", newline="")
+        processed, stats = 0, {"images": 0, "plates": 0, "failed_images": 0}
+    sink = ResultSink(stream, output_format, write_header=checkpoint is None, durable=not to_stdout)
+
+    paths = iter_image_paths(args.inputs, args.recursive)
+    if processed:
+        skipped = list(itertools.islice(paths, processed - 1, processed))
+        if skipped != [checkpoint["last_path"]]:
+            print(f"[LỖI] Danh sách ảnh đầu vào đã thay đổi so với checkpoint (ảnh thứ {processed} không phải "
+                  f"{checkpoint['last_path']}); hãy chạy lại không có --resume", file=sys.stderr)
+            return 1
+
+    anpr_system = ANPRSystem(args.weights, detector_backend=args.backend, ocr_tiers=tuple(args.ocr_tiers.split(",")),
+                             num_threads=args.threads, tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                             ocr_backend=args.ocr_backend, ocr_model_path=args.ocr_model)
+    started = time.perf_counter()
+    batch_count = run_images = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.readers, thread_name_prefix="anpr-read") as executor:
+            loaded = prefetch(anpr_system, paths, executor, depth=args.prefetch or 2 * args.batch_size)
+            for batch in batched(loaded, args.batch_size):
+                readable = [item for item in batch if item[3] is None]
+                results = anpr_system.process_images_in_memory(
+                    [item[1] for item in readable], batch_size=args.batch_size, annotate=False,
+                    decoded=[item[2] for item in readable])
+                results_by_path = iter(results)
+                for path, _, _, read_error in batch:
+                    record = result_records(path, {"error": read_error} if read_error else next(results_by_path))
+                    sink.write(record)
+                    stats["images"] += 1
+                    stats["plates"] += len(record["plates"])
+                    stats["failed_images"] += record["error"] is not None
+                processed += len(batch)
+                run_images += len(batch)
+                batch_count += 1
+
+                output_bytes = sink.flush()
+                if checkpoint_path and batch_count % args.checkpoint_every == 0:
+                    save_checkpoint(checkpoint_path, {
+                        "version": CHECKPOINT_VERSION, "config": run_config, "processed": processed,
+                        "last_path": batch[-1][0], "output_bytes": output_bytes, "stats": stats,
+                        "updated_at": time.time(),
+                    })
+                elapsed = time.perf_counter() - started
+                print(f"[INFO] {processed} ảnh, {stats['plates']} biển số, {stats['failed_images']} ảnh lỗi "
+                      f"({run_images / elapsed:.2f} ảnh/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        print(f"\n[CẢNH BÁO] Đã dừng sau {processed} ảnh; chạy lại với --resume để tiếp tục", file=sys.stderr)
+        return 130
+    finally:
+        if not to_stdout:
+            stream.close()
+
+    if checkpoint_path and os.path.exists(checkpoint_path) and not args.keep_checkpoint:
+        os.remove(checkpoint_path)
+    print(f"[INFO] Hoàn tất: {processed} ảnh, {stats['plates']} biển số, {stats['failed_images']} ảnh lỗi",
+          file=sys.stderr)
+    return 0
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Nhận dạng biển số hàng loạt (offline) và ghi kết quả dần ra JSON Lines hoặc CSV.")
+    parser.add_argument("inputs", nargs="+",
+                        help="Thư mục, mẫu glob, file ảnh hoặc @danh_sach.txt (mỗi dòng một đường dẫn, @- là stdin)")
+    parser.add_argument("-o", "--output", default="-", help="File kết quả ('-' là stdout, mặc định)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None,
+                        help="Định dạng kết quả (mặc định: theo đuôi file --output, còn lại là jsonl)")
+    parser.add_argument("--recursive", action="store_true", help="Duyệt cả thư mục con (và ** trong mẫu glob)")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--backend", default="ultralytics", choices=DETECTOR_BACKENDS)
+    parser.add_argument("--ocr-tiers", default=",".join(OCR_TIERS), help="Các bậc OCR theo thứ tự, phân cách bằng dấu phẩy")
+    parser.add_argument("--ocr-backend", default="easyocr", choices=OCR_BACKENDS,
+                        help="Bộ nhận dạng chữ: EasyOCR hoặc CRNN biển số (train_plate_ocr.py)")
+    parser.add_argument("--ocr-model", default=None, help="File .onnx hoặc .pt của CRNN (với --ocr-backend crnn)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Phát hiện theo tile với kích thước này (ảnh độ phân giải cao, biển số nhỏ)")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Tỉ lệ chồng lấn giữa hai tile liền kề")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Số ảnh mỗi lô YOLO/EasyOCR")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Số luồng tính toán của torch/OpenCV/OpenMP (mặc định: theo thư viện)")
+    parser.add_argument("--readers", type=int, default=NUM_READERS, help="Số luồng đọc và giải mã ảnh")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Số ảnh tối đa đọc trước vào bộ nhớ (mặc định: 2 x batch-size)")
+    parser.add_argument("--checkpoint", default=None, help="File checkpoint (mặc định: <output>.checkpoint.json)")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="Ghi checkpoint sau mỗi N lô")
+    parser.add_argument("--resume", action="store_true", help="Chạy tiếp từ checkpoint của lần chạy trước")
+    parser.add_argument("--keep-checkpoint", action="store_true", help="Giữ file checkpoint khi chạy xong")
+    args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
+    args.readers = max(1, args.readers)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+    if args.prefetch is not None:
+        args.prefetch = max(args.batch_size, args.prefetch)
+
+    # Thông báo của ANPRSystem/ultralytics (print) chuyển sang stderr để stdout chỉ chứa kết quả
+    results_stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        exit_code = run(args, results_stdout)
+    sys.exit(exit_code)
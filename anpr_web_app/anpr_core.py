@@ -1,167 +1,1036 @@
 import cv2
 import numpy as np
 import os
-import re
-from ultralytics import YOLO
-from typing import Optional, Tuple
-import easyocr
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Hashable, List, Optional, Tuple
 import base64
+from metrics import Metrics
+from model_registry import read_model_metadata
+from ocr_cache import OcrCache, PlateKey, plate_key
+from plate_layout import binarize_plate, deskew, order_text_boxes, split_rows
+from plate_normalizer import DIGITS, SERIES_LETTERS, clean_plate_text, match_plate, normalize_plate
+from plate_recognizer import CrnnPlateRecognizer
+from tiling import MERGE_METHODS, merge_boxes, select_tiles, tile_box_truncated, tile_grid
+
+DETECTOR_BACKENDS = ('ultralytics', 'onnx')
+# Backend nhận dạng chữ: 'easyocr' (easyocr.Reader(['vi', 'en']), CRAFT + mạng nhận dạng đa ngôn ngữ) hoặc
+# 'crnn' (CRNN/CTC nhỏ chỉ cho biển số, giải mã theo ngữ pháp biển số; xem plate_recognizer.py và
+# train_plate_ocr.py). Các bậc OCR giữ nguyên; với 'crnn', bậc 'full' cũng không có CRAFT.
+OCR_BACKENDS = ('easyocr', 'crnn')
+
+# Các bậc OCR, chạy lần lượt cho đến khi một bậc cho kết quả hợp lệ (xem ANPRSystem._cascade):
+#   fast:     chỉ mạng nhận dạng của EasyOCR (bỏ qua CRAFT) trên từng dòng của ảnh xám đã chỉnh nghiêng
+#   enhanced: chỉ mạng nhận dạng trên từng dòng của ảnh đã phóng to + CLAHE + lọc bilateral
+#   full:     EasyOCR đầy đủ (CRAFT + nhận dạng) trên ảnh đã tăng cường, như pipeline cũ
+OCR_TIERS = ('fast', 'enhanced', 'full')
+# Ký tự có thể xuất hiện trên biển số; giới hạn bộ giải mã của EasyOCR vào các ký tự này ở bậc nhận dạng trực tiếp
+PLATE_ALLOWLIST = SERIES_LETTERS + DIGITS + "-."
+FAST_PATH_HEIGHT = 64       # Chiều cao mỗi dòng chữ đưa vào mạng nhận dạng (bằng imgH của EasyOCR)
+
+# Cờ giải mã theo hệ số thu nhỏ: với JPEG, libjpeg thu nhỏ ngay trong bước IDCT nên nhanh và tốn ít bộ nhớ
+# hơn nhiều so với giải mã đầy đủ rồi resize
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                        4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Biến môi trường quy định số luồng của OpenMP/BLAS (torch, numpy); chỉ có tác dụng nếu được đặt trước khi
+# thư viện tương ứng được nạp, vì vậy configure_threads được gọi trước khi ANPRSystem import torch
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+# Ngưỡng IoU (hoặc tỉ lệ giao trên box nhỏ hơn) để coi hai box từ các tile khác nhau là cùng một biển số
+TILE_MERGE_IOU = 0.5
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """Đọc (rộng, cao) từ header JPEG/PNG mà không giải mã ảnh. Trả về None nếu không nhận ra định dạng."""
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n" and len(image_bytes) >= 24:
+        return int.from_bytes(image_bytes[16:20], "big"), int.from_bytes(image_bytes[20:24], "big")
+    if image_bytes[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 9 < len(image_bytes):
+        if image_bytes[pos] != 0xFF:
+            return None
+        marker = image_bytes[pos + 1]
+        if marker == 0xFF:  # byte đệm
+            pos += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = int.from_bytes(image_bytes[pos + 5:pos + 7], "big")
+            width = int.from_bytes(image_bytes[pos + 7:pos + 9], "big")
+            return width, height
+        pos += 2 + int.from_bytes(image_bytes[pos + 2:pos + 4], "big")
+    return None
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
+    """Non-maximum suppression (NumPy), boxes dạng (x1, y1, x2, y2). Trả về chỉ số các box được giữ lại."""
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+class UltralyticsPlateDetector:
+    """
+    Backend phát hiện biển số chạy qua ultralytics (PyTorch, hoặc các định dạng ultralytics tự nạp
+    được như thư mục *_openvino_model). Trả về mảng (N, 5) [x1, y1, x2, y2, conf] cho mỗi ảnh.
+    """
+
+    def __init__(self, model_path: str, conf: float = 0.4, iou: float = 0.5, imgsz: Optional[int] = None):
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.conf = conf
+        self.iou = iou
+        # None: dùng imgsz lúc huấn luyện (640)
+        self.imgsz = imgsz
+
+    def __call__(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        options = {"imgsz": self.imgsz} if self.imgsz else {}
+        detection_results = self.model(images, conf=self.conf, iou=self.iou, **options)
+        return [result.boxes.data.cpu().numpy()[:, :5] for result in detection_results]
+
+
+class OnnxPlateDetector:
+    """
+    Backend phát hiện biển số chạy mô hình YOLOv8 đã export sang ONNX (xem export_onnx.py) bằng ONNX Runtime
+    trên CPU, với letterbox và NMS tự cài đặt nên không cần nạp torch/ultralytics.
+    Dùng được cho cả mô hình FP32 lẫn mô hình đã lượng tử hóa INT8.
+    """
+
+    def __init__(self, model_path: str, conf: float = 0.4, iou: float = 0.5, max_det: int = 300,
+                 num_threads: Optional[int] = None, imgsz: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        _, _, height, width = model_input.shape
+        # Kích thước đầu vào cố định khi export; mô hình export với dynamic=True nhận imgsz tùy chọn (mặc định 640)
+        self.input_size = (height if isinstance(height, int) else imgsz or 640, width if isinstance(width, int) else imgsz or 640)
+        # Mô hình export không có dynamic=True chỉ nhận batch = 1
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+    def _letterbox(self, image: np.ndarray) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+        """Resize giữ tỉ lệ và đệm viền xám (114) về input_size, giống LetterBox của ultralytics."""
+        target_h, target_w = self.input_size
+        h, w = image.shape[:2]
+        ratio = min(target_h / h, target_w / w)
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        pad_w, pad_h = (target_w - new_w) / 2, (target_h - new_h) / 2
+        if (new_w, new_h) != (w, h):
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+        left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return image, ratio, (left, top)
+
+    def _postprocess(self, prediction: np.ndarray, ratio: float, pad: Tuple[float, float],
+                     image_shape) -> np.ndarray:
+        """prediction: (4 + số lớp, số anchor) -> mảng (N, 5) trong toạ độ ảnh gốc."""
+        prediction = prediction.T
+        scores = prediction[:, 4:].max(axis=1)
+        mask = scores > self.conf
+        prediction, scores = prediction[mask], scores[mask]
+        if not len(prediction):
+            return np.zeros((0, 5), dtype=np.float32)
+
+        cx, cy, bw, bh = prediction[:, 0], prediction[:, 1], prediction[:, 2], prediction[:, 3]
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        keep = nms(boxes, scores, self.iou)[:self.max_det]
+        boxes, scores = boxes[keep], scores[keep]
+
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+        h, w = image_shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        return np.concatenate([boxes, scores[:, None]], axis=1).astype(np.float32)
+
+    def __call__(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        letterboxed = [self._letterbox(image) for image in images]
+        blob = np.stack([lb[0] for lb in letterboxed])[..., ::-1].transpose(0, 3, 1, 2)
+        blob = np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+
+        if self.dynamic_batch:
+            predictions = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            predictions = np.concatenate([self.session.run(None, {self.input_name: blob[i:i + 1]})[0]
+                                          for i in range(len(images))])
+
+        return [self._postprocess(prediction, ratio, pad, image.shape)
+                for prediction, (_, ratio, pad), image in zip(predictions, letterboxed, images)]
+
+
+def create_plate_detector(model_path: str, backend: str = 'ultralytics', conf: float = 0.4, iou: float = 0.5,
+                          num_threads: Optional[int] = None, imgsz: Optional[int] = None):
+    """Tạo backend phát hiện biển số theo cấu hình ('ultralytics' hoặc 'onnx')."""
+    if backend == 'ultralytics':
+        return UltralyticsPlateDetector(model_path, conf=conf, iou=iou, imgsz=imgsz)
+    if backend == 'onnx':
+        return OnnxPlateDetector(model_path, conf=conf, iou=iou, num_threads=num_threads, imgsz=imgsz)
+    raise ValueError(f"Backend phát hiện không hợp lệ: {backend} (hỗ trợ: {', '.join(DETECTOR_BACKENDS)})")
+
+
+def configure_threads(num_threads: int) -> dict:
+    """
+    Giới hạn số luồng tính toán của tiến trình: OpenMP/MKL/OpenBLAS (biến môi trường), OpenCV
+    (cv2.setNumThreads) và torch (intra-op, inter-op) nếu torch đã được nạp.
+    Mỗi thư viện mặc định tạo một pool luồng bằng số nhân CPU; khi nhiều request chạy song song, các pool này
+    tranh nhau CPU và độ trễ tăng vọt. Đây là thiết lập cho cả tiến trình (gọi trước khi nạp mô hình), nhưng
+    num_threads là số luồng của *một* lần tính toán (một lần chạy YOLO/OCR): k lần gọi mô hình chạy song song
+    từ k luồng dùng tới k * num_threads luồng. Vì vậy khi có k ANPRSystem chạy song song trong tiến trình, truyền
+    ngân sách luồng // k (như ANPRSystemPool); gọi nhiều lần với cùng giá trị không có tác dụng phụ.
+    Trả về các giá trị đã áp dụng.
+    """
+    num_threads = max(1, int(num_threads))
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(num_threads)
+    cv2.setNumThreads(num_threads)
+    applied = {"omp": num_threads, "cv2": cv2.getNumThreads()}
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # torch chỉ cho đặt inter-op một lần, trước khi có tác vụ song song đầu tiên
+            pass
+        applied["torch_intra_op"] = torch.get_num_threads()
+        applied["torch_inter_op"] = torch.get_num_interop_threads()
+    return applied
+
 
 class ANPRSystem:
-    def __init__(self, yolo_model_path: str):
+    """
+    Pipeline phát hiện (YOLO) + nhận dạng (EasyOCR hoặc CRNN, xem OCR_BACKENDS) biển số.
+
+    An toàn luồng: một instance có thể được gọi đồng thời từ nhiều luồng.
+    - process_image_in_memory, process_images_in_memory, detect_plates, _recognize_plate,
+      _ultimate_license_plate_pipeline, _cascade, _read_plates_batched: an toàn khi gọi đồng thời. Mô hình YOLO
+      và EasyOCR không an toàn luồng nên mỗi lần gọi mô hình giữ khóa riêng của mô hình đó (detector/reader):
+      tại một thời điểm chỉ một luồng chạy YOLO và một luồng chạy EasyOCR, còn giải mã ảnh, tiền xử lý và
+      định dạng kết quả chạy song song. Thời gian chờ khóa được ghi trong anpr_model_lock_wait_seconds.
+    - _decode_for_detection, _decode_image, binarize_plate, encode_image*: không dùng mô hình, an toàn và
+      không phải chờ khóa (dùng được trên các luồng đọc ảnh, xem anpr.py).
+    - ocr_cache và metrics có khóa riêng.
+    Để nhiều request suy luận thực sự song song trong một tiến trình, dùng ANPRSystemPool (mỗi luồng một
+    instance, chia ngân sách luồng); server web dùng các tiến trình worker (inference_workers.py).
+    """
+
+    def __init__(self, yolo_model_path: str, ocr_cache_size: int = 4096, detector_backend: str = 'ultralytics',
+                 load_async: bool = False, warmup: bool = False, detection_side: int = 640,
+                 min_plate_crop_width: int = 240, ocr_tiers: Tuple[str, ...] = OCR_TIERS,
+                 num_threads: Optional[int] = None, detector_imgsz: Optional[int] = None,
+                 tile_size: Optional[int] = None, tile_overlap: float = 0.2, tile_merge: str = 'nms',
+                 tile_full_frame: bool = True, ocr_backend: str = 'easyocr', ocr_model_path: Optional[str] = None):
         """
         Khởi tạo hệ thống ANPR, tải các mô hình cần thiết một lần.
+        ocr_cache_size: số kết quả OCR được cache theo nội dung ảnh biển số (0 để tắt).
+        detector_backend: 'ultralytics' (file .pt) hoặc 'onnx' (file .onnx tạo bởi export_onnx.py).
+        load_async: True để trả về ngay và tải mô hình ở luồng nền (xem is_ready/wait_until_ready).
+        warmup: chạy thử một lần suy luận trên ảnh giả sau khi tải để lần gọi thật đầu tiên không bị chậm.
+        detection_side: cạnh dài tối thiểu của ảnh dùng để phát hiện; ảnh lớn được giải mã thu nhỏ
+            (1/2, 1/4, 1/8) miễn là cạnh dài vẫn >= giá trị này (bằng imgsz của YOLO là đủ).
+        min_plate_crop_width: chiều rộng tối thiểu mong muốn của vùng biển số đưa vào OCR; nếu ảnh
+            phát hiện không đủ chi tiết, vùng biển số được cắt từ ảnh giải mã ở độ phân giải cao hơn.
+        ocr_tiers: các bậc OCR theo thứ tự thử (xem OCR_TIERS); bậc cuối luôn được chấp nhận, các bậc trước
+            chỉ được chấp nhận khi kết quả khớp một định dạng biển số hợp lệ.
+        num_threads: số luồng tính toán (torch, OpenCV, OpenMP) của mỗi lần chạy mô hình, áp dụng cho cả
+            tiến trình, xem configure_threads.
+            None để giữ mặc định của các thư viện (bằng số nhân CPU).
+        detector_imgsz: kích thước đầu vào của YOLO (None: lấy "imgsz" trong file .json đi kèm mô hình do
+            model_sweep.py ghi, nếu không có thì 640 như lúc huấn luyện). detection_side được nâng lên
+            ít nhất bằng giá trị này để ảnh không bị giải mã nhỏ hơn đầu vào của mô hình.
+        tile_size: bật chế độ phát hiện theo tile (xem detect_plates_tiled) cho camera độ phân giải cao: ảnh được
+            giải mã đầy đủ và chia thành các tile tile_size x tile_size chồng lấn nhau tỉ lệ tile_overlap,
+            YOLO chạy trên các tile theo lô rồi gộp box bằng tile_merge ('nms' hoặc 'wbf').
+            tile_full_frame: chạy thêm YOLO trên cả khung hình (thu nhỏ) trong cùng lô để bắt biển số lớn hơn một tile.
+            None (mặc định) để chạy YOLO một lần trên cả ảnh như trước.
+        ocr_backend: 'easyocr' (mặc định) hoặc 'crnn'; ocr_model_path: file .onnx hoặc .pt của CRNN (bắt buộc
+            với 'crnn'), tạo bởi train_plate_ocr.py.
+
+        YOLO và mô hình OCR được tải song song; torch/ultralytics/easyocr/onnxruntime chỉ được import khi tải mô hình.
+        Thời gian từng giai đoạn khởi động được ghi trong startup_timings (giây).
+        Thời gian từng bước xử lý và các bộ đếm được ghi trong metrics (xem metrics.py).
         """
-        print("Đang tải mô hình YOLOv8...")
+        unknown = [tier for tier in ocr_tiers if tier not in OCR_TIERS]
+        if not ocr_tiers or unknown:
+            raise ValueError(f"Bậc OCR không hợp lệ: {unknown} (hỗ trợ: {', '.join(OCR_TIERS)})")
+        self.ocr_tiers = tuple(ocr_tiers)
+        if ocr_backend not in OCR_BACKENDS:
+            raise ValueError(f"Backend OCR không hợp lệ: {ocr_backend} (hỗ trợ: {', '.join(OCR_BACKENDS)})")
+        if ocr_backend == 'crnn' and not ocr_model_path:
+            raise ValueError("Backend OCR 'crnn' cần ocr_model_path (file .onnx hoặc .pt từ train_plate_ocr.py)")
+        self.ocr_backend = ocr_backend
+        self.ocr_model_path = ocr_model_path
+        self.num_threads = num_threads
+        # Số luồng thực tế đã áp dụng cho từng thư viện (rỗng nếu giữ mặc định)
+        self.thread_settings = configure_threads(num_threads) if num_threads else {}
+        self.metrics = Metrics()
+        self._model_locks = {"detector": threading.Lock(), "reader": threading.Lock()}
+        self.ocr_cache = OcrCache(max_entries=ocr_cache_size) if ocr_cache_size > 0 else None
+        if tile_merge not in MERGE_METHODS:
+            raise ValueError(f"Cách gộp box không hợp lệ: {tile_merge} (hỗ trợ: {', '.join(MERGE_METHODS)})")
+        self.detector_imgsz = detector_imgsz or read_model_metadata(yolo_model_path).get("imgsz")
+        self.detection_side = max(detection_side, self.detector_imgsz or 0)
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_merge = tile_merge
+        self.tile_full_frame = tile_full_frame
+        self.min_plate_crop_width = min_plate_crop_width
+        self.yolo_model_path = yolo_model_path
+        self.detector_backend = detector_backend
+        self.detector = None
+        self.reader = None
+        self.startup_timings = {}
+        self.load_error: Optional[Exception] = None
+        self._ready = threading.Event()
+
+        if load_async:
+            threading.Thread(target=self._load_models, args=(warmup,), name="anpr-model-loader", daemon=True).start()
+        else:
+            self._load_models(warmup)
+            if self.load_error is not None:
+                raise self.load_error
+
+    def _load_detector(self) -> None:
+        print(f"Đang tải mô hình YOLOv8 (backend: {self.detector_backend})...")
+        started = time.perf_counter()
         try:
-            self.yolo_model = YOLO(yolo_model_path)
+            self.detector = create_plate_detector(self.yolo_model_path, backend=self.detector_backend,
+                                                  num_threads=self.num_threads, imgsz=self.detector_imgsz)
             print("Tải mô hình YOLOv8 thành công.")
         except Exception as e:
             print(f"[LỖI NGHIÊM TRỌNG] Không thể tải mô hình YOLO: {e}")
             raise e
+        finally:
+            self.startup_timings["load_detector"] = time.perf_counter() - started
 
+    def _load_reader(self) -> None:
+        if self.ocr_backend == 'crnn':
+            self._load_crnn_reader()
+            return
         print("Đang tải mô hình EasyOCR...")
+        started = time.perf_counter()
         try:
+            import easyocr
+            self.startup_timings["import_easyocr"] = time.perf_counter() - started
             self.reader = easyocr.Reader(['vi', 'en'])
             print("Tải mô hình EasyOCR thành công.")
         except Exception as e:
             print(f"[LỖI NGHIÊM TRỌNG] Không thể tải mô hình EasyOCR: {e}")
             raise e
-            
-        print("Hệ thống ANPR đã sẵn sàng.")
+        finally:
+            self.startup_timings["load_reader"] = time.perf_counter() - started
 
-    def _format_vietnam_plate(self, text: str) -> str:
-        """Định dạng văn bản biển số Việt Nam: tất cả là số trừ vị trí thứ 3 là chữ."""
-        text = re.sub(r'[^A-Z0-9]', '', text.upper())
-        if len(text) < 4:
-            return "N/A"
+    def _load_crnn_reader(self) -> None:
+        print(f"Đang tải mô hình OCR biển số (CRNN): {self.ocr_model_path}...")
+        started = time.perf_counter()
+        try:
+            self.reader = CrnnPlateRecognizer(self.ocr_model_path, num_threads=self.num_threads)
+            print("Tải mô hình OCR biển số thành công.")
+        except Exception as e:
+            print(f"[LỖI NGHIÊM TRỌNG] Không thể tải mô hình OCR biển số: {e}")
+            raise e
+        finally:
+            self.startup_timings["load_reader"] = time.perf_counter() - started
 
-        num_to_char = {'8': 'B', '4': 'A', '0': 'O', '1': 'I', '5': 'S', '6': 'G', '7': 'H'}
-        char_to_num = {'B': '8', 'O': '0', 'I': '1', 'S': '5', 'A': '4', 'X': '8', 'J': '3', 'G': '6'}
-
-        if len(text) >= 7:
-            # Tiền tố: 2 số đầu
-            prefix = text[:2]
-            # Ký tự thứ 3 (mã quận/huyện)
-            area_code = text[2]
-            # Hậu tố: các số còn lại
-            suffix = text[3:]
-
-            # Chuẩn hóa tiền tố
-            new_prefix = ''.join([char_to_num.get(c, c) for c in prefix if c.isalnum()])
-            # Chuẩn hóa hậu tố
-            new_suffix = ''.join([char_to_num.get(c, c) for c in suffix if c.isalnum()])
-            # Chuẩn hóa mã quận
-            if area_code.isdigit():
-                area_code = num_to_char.get(area_code, area_code)
-
-            # Chỉ ghép lại nếu hợp lệ
-            if new_prefix.isdigit() and area_code.isalpha() and new_suffix.isdigit():
-                if len(new_suffix) == 4:
-                    return f"{new_prefix}{area_code}-{new_suffix[:1]}.{new_suffix[1:]}"
-                elif len(new_suffix) == 5:
-                    return f"{new_prefix}{area_code}-{new_suffix[:2]}.{new_suffix[2:]}"
-                else:
-                    return f"{new_prefix}{area_code}-{new_suffix}"
+    def _warmup(self) -> None:
+        """Chạy thử YOLO và OCR trên ảnh giả để khởi tạo bộ nhớ đệm/kernel trước request thật đầu tiên."""
+        started = time.perf_counter()
+        dummy = np.full((640, 640, 3), 114, dtype=np.uint8)
+        with self._use_model("detector"):
+            self.detector([dummy])
+        with self._use_model("reader"):
+            self.reader.readtext(np.full((64, 256), 255, dtype=np.uint8), detail=1, paragraph=False)
+        self.startup_timings["warmup"] = time.perf_counter() - started
+
+    def _load_models(self, warmup: bool) -> None:
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="anpr-load") as executor:
+                futures = [executor.submit(self._load_detector), executor.submit(self._load_reader)]
+                for future in futures:
+                    future.result()
+            if self.num_threads:
+                # torch vừa được nạp cùng mô hình: áp dụng lại để giới hạn cả luồng của torch
+                self.thread_settings = configure_threads(self.num_threads)
+            if warmup:
+                self._warmup()
+        except Exception as e:
+            self.load_error = e
+            return
+        finally:
+            self.startup_timings["total"] = time.perf_counter() - started
 
-        # Nếu không khớp định dạng trên, trả về dạng đã làm sạch
-        return text if text else "N/A"
+        phases = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.startup_timings.items())
+        print(f"Hệ thống ANPR đã sẵn sàng. Thời gian khởi động: {phases}")
+        self._ready.set()
 
-    def _ultimate_license_plate_pipeline(self, image: np.ndarray) -> Tuple[str, np.ndarray, np.ndarray]:
-        """Xử lý ảnh biển số đã cắt: tiền xử lý, và OCR."""
-        if image is None or image.size == 0:
-            return "N/A", None, None
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Chờ mô hình tải xong. Ném lại lỗi nếu việc tải thất bại; trả về False nếu hết thời gian chờ."""
+        if self.load_error is not None:
+            raise self.load_error
+        ready = self._ready.wait(timeout)
+        if self.load_error is not None:
+            raise self.load_error
+        return ready
 
+    def _ensure_ready(self) -> None:
+        if not self._ready.is_set():
+            self.wait_until_ready()
+
+    @contextmanager
+    def _use_model(self, model: str):
+        """Giữ khóa của một mô hình ('detector' hoặc 'reader') trong lúc gọi nó, ghi lại thời gian chờ khóa."""
+        started = time.perf_counter()
+        with self._model_locks[model]:
+            self.metrics.observe("anpr_model_lock_wait_seconds", time.perf_counter() - started, model=model)
+            yield
+
+    def _stage(self, stage: str):
+        """Đo thời gian một bước của pipeline: with self._stage('ocr'): ..."""
+        return self.metrics.time("anpr_stage_seconds", stage=stage)
+
+    def _count_plate(self, plate_text: Optional[str]) -> None:
+        result = "rejected" if plate_text is None else "na" if plate_text == "N/A" else "ok"
+        self.metrics.inc("anpr_plates_total", result=result)
+
+    @staticmethod
+    def _upscale_plate(image: np.ndarray) -> np.ndarray:
+        """Phóng to ảnh biển số nếu quá nhỏ (luôn trả về một bản sao)."""
         height, width = image.shape[:2]
         if height < 32 or width < 80:
             scale = max(2.0, 32 / height, 80 / width)
-            image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_LANCZOS4)
-        
-        plate_roi = image.copy()
+            return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_LANCZOS4)
+        return image.copy()
+
+    def _preprocess_plate(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Phóng to ảnh biển số nếu quá nhỏ, tăng tương phản (CLAHE) và lọc bilateral: (plate_roi, bfilter)."""
+        plate_roi = self._upscale_plate(image)
         
         # Tiền xử lý với CLAHE và bilateral filter
         gray = cv2.cvtColor(plate_roi, cv2.COLOR_BGR2GRAY)
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         enhanced = clahe.apply(gray)
         bfilter = cv2.bilateralFilter(enhanced, 9, 75, 75)
+        return plate_roi, bfilter
 
-        # Nhị phân hóa
-        thresh = cv2.adaptiveThreshold(bfilter, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                               cv2.THRESH_BINARY, 11, 2)
-        
-        plate_text = "N/A"
-        try:
-            result = self.reader.readtext(bfilter, detail=1, paragraph=False)
-            if result:
-                # Sắp xếp các box theo thứ tự từ trái sang phải, trên xuống dưới
-                result.sort(key=lambda x: (x[0][0][1], x[0][0][0])) 
-                raw_text = ''.join([item[1] for item in result])
-                cleaned_text = re.sub(r'[^A-Z0-9]', '', raw_text.upper())
-                # Kiểm tra số chữ cái
-                letter_count = sum(1 for c in cleaned_text if c.isalpha())
-                if letter_count >= 5:
-                    return "N/A", None, None
-                plate_text = self._format_vietnam_plate(raw_text)
-        except Exception as e:
-            print(f"Lỗi OCR: {e}")
+    # Giữ tên cũ; hàm nằm trong plate_layout để result_writer dùng được mà không import anpr_core
+    binarize_plate = staticmethod(binarize_plate)
 
-        return plate_text, plate_roi, thresh
+    @staticmethod
+    def _fast_plate_image(image: np.ndarray) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+        """
+        Ảnh cho bậc 'fast': xám, đã chỉnh nghiêng, co giãn để mỗi dòng chữ cao FAST_PATH_HEIGHT (giữ tỉ lệ).
+        Trả về (ảnh, các dòng (y_bắt_đầu, y_kết_thúc) theo ảnh đã co giãn).
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        gray = deskew(gray)
+        rows = split_rows(gray)
+        height, width = gray.shape[:2]
+        scale = FAST_PATH_HEIGHT / max(y1 - y0 for y0, y1 in rows)
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        resized = cv2.resize(gray, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                             interpolation=interpolation)
+        rows = [(int(y0 * scale), min(resized.shape[0], int(round(y1 * scale)))) for y0, y1 in rows]
+        return resized, rows
 
-    def process_image_in_memory(self, image_bytes: bytes) -> dict:
+    def _recognize_rows(self, gray: np.ndarray, rows: List[Tuple[int, int]]) -> list:
         """
-        Phát hiện và nhận dạng biển số từ dữ liệu byte của ảnh.
-        Trả về một dictionary chứa dữ liệu ảnh (NumPy array) và văn bản.
+        Đưa thẳng từng dòng chữ vào mạng nhận dạng (EasyOCR: bỏ qua bộ phát hiện chữ CRAFT, vì YOLO đã
+        khoanh vùng biển số; CRNN: cả biển số một lần). Kết quả cùng dạng readtext (detail=1), box của mỗi
+        đoạn là cả dòng.
+        """
+        width = gray.shape[1]
+        horizontal_list = [[0, width, y0, y1] for y0, y1 in rows]
+        with self._use_model("reader"), self._stage("ocr"):
+            return self.reader.recognize(gray, horizontal_list=horizontal_list, free_list=[], detail=1,
+                                         paragraph=False, allowlist=PLATE_ALLOWLIST)
+
+    def _run_tier(self, tier: str, image: np.ndarray, prepared: dict) -> list:
+        """
+        Chạy một bậc OCR trên ảnh biển số gốc, trả về kết quả thô dạng readtext (detail=1).
+        prepared giữ ảnh đã tiền xử lý để các bậc sau dùng lại (plate_roi, bfilter).
+        """
+        if tier == 'fast':
+            with self._stage("layout"):
+                fast_image, rows = self._fast_plate_image(image)
+            return self._recognize_rows(fast_image, rows)
+
+        if 'bfilter' not in prepared:
+            with self._stage("preprocessing"):
+                prepared['plate_roi'], prepared['bfilter'] = self._preprocess_plate(image)
+        if tier == 'enhanced':
+            with self._stage("layout"):
+                rows = split_rows(prepared['bfilter'])
+            return self._recognize_rows(prepared['bfilter'], rows)
+        with self._use_model("reader"), self._stage("ocr"):
+            return self.reader.readtext(prepared['bfilter'], detail=1, paragraph=False)
+
+    def _cascade(self, image: np.ndarray, tiers: Tuple[str, ...], prepared: dict,
+                 accept_last: bool = True) -> Optional[Tuple[Optional[str], Optional[float], str]]:
+        """
+        Thử lần lượt các bậc OCR, dừng ở bậc đầu tiên đọc ra biển số hợp lệ theo plate_normalizer.
+        Bậc cuối (khi accept_last=True) được chấp nhận như pipeline cũ, kể cả khi không khớp định dạng.
+        Trả về (text, ocr_conf, bậc); text là None nếu vùng ảnh không được coi là biển số,
+        ocr_conf là None nếu bậc cuối bị lỗi.
+        Trả về None nếu không bậc nào được chấp nhận (chỉ xảy ra khi accept_last=False).
+        """
+        self._ensure_ready()
+        for index, tier in enumerate(tiers):
+            final = accept_last and index == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                result = self._run_tier(tier, image, prepared)
+            except Exception as e:
+                print(f"Lỗi OCR ({tier}): {e}")
+                self.metrics.inc("anpr_ocr_errors_total")
+                if final:
+                    return "N/A", None, tier
+                continue
+            finally:
+                self.metrics.observe("anpr_ocr_tier_seconds", time.perf_counter() - started, tier=tier)
+
+            with self._stage("formatting"):
+                if final:
+                    plate_text = self._parse_ocr_result(result)
+                else:
+                    ordered, num_lines = order_text_boxes(result)
+                    plate_text = match_plate(''.join(item[1] for item in ordered), two_line=num_lines > 1)
+            if final or plate_text is not None:
+                self.metrics.inc("anpr_ocr_tier_total", tier=tier)
+                return plate_text, self._ocr_confidence(result), tier
+        return None
+
+    def _parse_ocr_result(self, result: list) -> Optional[str]:
+        """
+        Ghép kết quả OCR (detail=1) thành chuỗi biển số đã định dạng.
+        Trả về None nếu vùng ảnh không được coi là biển số hợp lệ.
+        """
+        if not result:
+            return "N/A"
+        # Sắp xếp các box theo dòng (trên xuống dưới), trong mỗi dòng từ trái sang phải
+        ordered, num_lines = order_text_boxes(result)
+        raw_text = ''.join([item[1] for item in ordered])
+        cleaned_text = clean_plate_text(raw_text)
+        # Kiểm tra số chữ cái
+        letter_count = sum(1 for c in cleaned_text if c.isalpha())
+        if letter_count >= 5:
+            return None
+        return normalize_plate(cleaned_text, two_line=num_lines > 1)
+
+    @staticmethod
+    def _ocr_confidence(result: list) -> float:
+        """Độ tin cậy trung bình của các đoạn văn bản EasyOCR đọc được."""
+        if not result:
+            return 0.0
+        return float(sum(item[2] for item in result) / len(result))
+
+    def _lookup_ocr_cache(self, image: np.ndarray, scope: Optional[Hashable] = None
+                          ) -> Tuple[Optional[PlateKey], bool, Optional[Tuple[str, float]]]:
+        """
+        Tra cache OCR theo ảnh biển số gốc: trả về (khóa, tìm thấy, (text, conf) hoặc None).
+        Ảnh gần giống (không trùng khớp) chỉ dùng lại kết quả của cùng scope (xem OcrCache).
+        """
+        if self.ocr_cache is None:
+            return None, False, None
+        cache_key = plate_key(image)
+        found, cached = self.ocr_cache.get(cache_key, scope)
+        self.metrics.inc("anpr_ocr_cache_lookups_total", result="hit" if found else "miss")
+        return cache_key, found, cached
+
+    def _recognize_plate(self, image: np.ndarray, scope: Optional[Hashable] = None
+                         ) -> Tuple[str, float, np.ndarray, Optional[str]]:
         """
+        Như _ultimate_license_plate_pipeline nhưng trả thêm độ tin cậy OCR: (text, ocr_conf, plate_roi, bậc OCR).
+        Ảnh biển số trùng khớp một ảnh đã đọc trước đó, hoặc gần giống một lần đọc trước trong cùng scope
+        (ví dụ cùng track của stream_pipeline), dùng lại kết quả trong cache, bỏ qua tiền xử lý và OCR (bậc 'cache').
+        """
+        if image is None or image.size == 0:
+            return "N/A", 0.0, None, None
+
+        cache_key, found, cached = self._lookup_ocr_cache(image, scope)
+        if found:
+            if cached is None:
+                return "N/A", 0.0, None, None
+            return cached[0], cached[1], self._upscale_plate(image), "cache"
+
+        prepared = {}
+        plate_text, ocr_conf, tier = self._cascade(image, self.ocr_tiers, prepared)
+        self._count_plate(plate_text)
+        if cache_key is not None and ocr_conf is not None:
+            self.ocr_cache.put(cache_key, None if plate_text is None else (plate_text, ocr_conf), scope)
+        if plate_text is None:
+            return "N/A", 0.0, None, None
+        plate_roi = prepared.get('plate_roi')
+        return plate_text, ocr_conf or 0.0, plate_roi if plate_roi is not None else self._upscale_plate(image), tier
+
+    def _ultimate_license_plate_pipeline(self, image: np.ndarray) -> Tuple[str, np.ndarray, Optional[str]]:
+        """Xử lý ảnh biển số đã cắt: OCR theo bậc (xem _cascade). Trả về (text, plate_roi, bậc OCR)."""
+        plate_text, _, plate_roi, tier = self._recognize_plate(image)
+        return plate_text, plate_roi, tier
+
+    def _readtext_batched(self, images: List[np.ndarray], batch_size: int = 16) -> List[Optional[list]]:
+        """
+        OCR nhiều ảnh biển số (đã tiền xử lý, ảnh xám) theo lô với readtext_batched của reader.
+        EasyOCR yêu cầu các ảnh trong một lô có cùng kích thước, nên ảnh được sắp xếp theo kích thước
+        rồi đệm (padding) tới kích thước lớn nhất của lô, không co giãn để giữ nguyên tỉ lệ ký tự.
+        Reader có needs_uniform_batch = False (CrnnPlateRecognizer) nhận nguyên ảnh, theo thứ tự đầu vào.
+        Trả về kết quả thô (detail=1) của từng ảnh, None nếu OCR bị lỗi.
+        """
+        results: List[Optional[list]] = [None] * len(images)
+        if images:
+            self._ensure_ready()
+        uniform = getattr(self.reader, "needs_uniform_batch", True)
+        order = sorted(range(len(images)), key=lambda i: images[i].shape[:2]) if uniform else list(range(len(images)))
+
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            if uniform:
+                max_h = max(images[i].shape[0] for i in chunk)
+                max_w = max(images[i].shape[1] for i in chunk)
+                batch = [
+                    cv2.copyMakeBorder(images[i], 0, max_h - images[i].shape[0], 0, max_w - images[i].shape[1],
+                                       cv2.BORDER_REPLICATE)
+                    for i in chunk
+                ]
+            else:
+                batch = [images[i] for i in chunk]
+            try:
+                with self._use_model("reader"), self._stage("ocr"):
+                    chunk_results = self.reader.readtext_batched(batch, detail=1, paragraph=False,
+                                                                 batch_size=len(chunk))
+            except Exception as e:
+                print(f"Lỗi OCR: {e}")
+                self.metrics.inc("anpr_ocr_errors_total")
+                continue
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        return results
+
+    def _read_plates_batched(self, images: List[np.ndarray], batch_size: int = 16) -> List[Tuple[Optional[str], float]]:
+        """
+        OCR theo lô (xem _readtext_batched) rồi định dạng biển số.
+        Trả về danh sách (text, ocr_conf); text là None nếu vùng ảnh không được coi là biển số,
+        ocr_conf là None nếu OCR bị lỗi.
+        """
+        texts: List[Tuple[Optional[str], float]] = []
+        for result in self._readtext_batched(images, batch_size):
+            if result is None:
+                texts.append(("N/A", None))
+                continue
+            with self._stage("formatting"):
+                plate_text = self._parse_ocr_result(result)
+            self._count_plate(plate_text)
+            texts.append((plate_text, self._ocr_confidence(result)))
+        return texts
+
+    @staticmethod
+    def _decode_image(image_bytes: bytes, factor: int = 1) -> Optional[np.ndarray]:
+        """Giải mã dữ liệu byte thành ảnh BGR (thu nhỏ factor lần), trả về None nếu không đọc được."""
         nparr = np.frombuffer(image_bytes, np.uint8)
-        original_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return cv2.imdecode(nparr, REDUCED_DECODE_FLAGS[factor])
 
-        if original_image is None:
-            return {"error": "Không thể đọc ảnh."}
-        
-        detection_results = self.yolo_model(original_image, conf=0.4, iou=0.5)
-        
-        detected_plates = []
-        image_with_boxes = original_image.copy()
+    def _decode_for_detection(self, image_bytes: bytes) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Giải mã ảnh ở độ phân giải thấp nhất vẫn đủ cho YOLO (cạnh dài >= detection_side).
+        Ở chế độ tile, ảnh luôn được giải mã đầy đủ vì mục đích là giữ chi tiết của biển số nhỏ ở xa.
+        Trả về (ảnh, hệ số thu nhỏ so với ảnh gốc).
+        """
+        size = read_image_size(image_bytes)
+        factor = 1
+        if size is not None and not self.tile_size:
+            long_side = max(size)
+            for candidate in (8, 4, 2):
+                if long_side // candidate >= self.detection_side:
+                    factor = candidate
+                    break
+        image = self._decode_image(image_bytes, factor)
+        if image is None and factor > 1:
+            # Header đọc được nhưng bộ giải mã thu nhỏ thất bại: thử giải mã đầy đủ
+            factor = 1
+            image = self._decode_image(image_bytes)
+        return image, factor
 
-        for i, result in enumerate(detection_results[0].boxes.data):
-            box_data = result.tolist()
+    def _crop_source(self, image_bytes: bytes, detection_image: np.ndarray, factor: int,
+                     boxes: List[Tuple[int, int, int, int, float]]) -> Tuple[np.ndarray, float, float]:
+        """
+        Chọn ảnh để cắt vùng biển số: dùng luôn ảnh phát hiện nếu biển số nhỏ nhất đã đủ rộng
+        (>= min_plate_crop_width), nếu không thì giải mã lại ở hệ số nhỏ hơn (tối đa là ảnh gốc).
+        Trả về (ảnh, tỉ lệ x, tỉ lệ y) để đổi tọa độ từ ảnh phát hiện sang ảnh này.
+        """
+        if factor == 1 or not boxes:
+            return detection_image, 1.0, 1.0
+        narrowest = min(x2 - x1 for x1, _, x2, _, _ in boxes)
+        crop_factor = factor
+        while crop_factor > 1 and narrowest * factor / crop_factor < self.min_plate_crop_width:
+            crop_factor //= 2
+        if crop_factor == factor:
+            return detection_image, 1.0, 1.0
+        source = self._decode_image(image_bytes, crop_factor)
+        if source is None:
+            return detection_image, 1.0, 1.0
+        return (source, source.shape[1] / detection_image.shape[1], source.shape[0] / detection_image.shape[0])
+
+    @staticmethod
+    def _map_box(box: Tuple[int, int, int, int], scale_x: float, scale_y: float,
+                 shape) -> Tuple[int, int, int, int]:
+        """Đổi box sang ảnh có tỉ lệ (scale_x, scale_y) so với ảnh gốc của box, cắt theo biên ảnh đích."""
+        h, w = shape[:2]
+        x1, y1, x2, y2 = box
+        return (max(0, int(x1 * scale_x)), max(0, int(y1 * scale_y)),
+                min(w, int(round(x2 * scale_x))), min(h, int(round(y2 * scale_y))))
+
+    @staticmethod
+    def _clip_boxes(raw_boxes: np.ndarray, image_shape) -> List[Tuple[int, int, int, int, float]]:
+        """Chuyển mảng (N, 5) của detector thành các box (x1, y1, x2, y2, conf) nguyên, đã cắt theo biên ảnh."""
+        h, w = image_shape[:2]
+        boxes = []
+        for box_data in raw_boxes.tolist():
             x1, y1, x2, y2 = map(int, box_data[:4])
             conf = float(box_data[4])
 
-            h, w, _ = original_image.shape
             x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
             if x1 >= x2 or y1 >= y2:
                 continue
-            
-            plate_crop = original_image[y1:y2, x1:x2]
-            plate_text, processed_plate_img, binary_plate_img = self._ultimate_license_plate_pipeline(plate_crop)
+            boxes.append((x1, y1, x2, y2, conf))
+        return boxes
+
+    @staticmethod
+    def _draw_plate(image: np.ndarray, box: Tuple[int, int, int, int], label: str) -> None:
+        """Vẽ khung và nhãn biển số lên ảnh kết quả."""
+        x1, y1, x2, y2 = box
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+
+        (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+        cv2.rectangle(image, (x1, y1 - text_height - 15), (x1 + text_width, y1 - 10), (0, 255, 0), -1)
+        cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+
+    def detect_plates(self, images: List[np.ndarray], batch_size: int = 16) -> List[List[Tuple[int, int, int, int, float]]]:
+        """
+        Chạy YOLO theo lô, trả về danh sách box (x1, y1, x2, y2, conf) cho từng ảnh đầu vào.
+        Ở chế độ tile (tile_size), mỗi ảnh được phát hiện theo tile (xem detect_plates_tiled).
+        """
+        if self.tile_size:
+            return [self.detect_plates_tiled(image, batch_size=batch_size) for image in images]
+        self._ensure_ready()
+        boxes_per_image = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            with self._use_model("detector"), self._stage("detection"):
+                raw_boxes_per_image = self.detector(chunk)
+            for image, raw_boxes in zip(chunk, raw_boxes_per_image):
+                boxes_per_image.append(self._clip_boxes(raw_boxes, image.shape))
+        return boxes_per_image
+
+    def detect_plates_tiled(self, image: np.ndarray, batch_size: int = 16, motion_mask: Optional[np.ndarray] = None,
+                            prior_boxes: Optional[List[Tuple[int, int, int, int]]] = None
+                            ) -> List[Tuple[int, int, int, int, float]]:
+        """
+        Phát hiện biển số theo tile: các tile chồng lấn (và cả khung hình nếu tile_full_frame) được đưa vào YOLO
+        thành một lô, box của từng tile được đổi về toạ độ ảnh rồi gộp (box bị đường cắt tile làm cụt nhường
+        cho box đầy đủ ở tile bên cạnh, xem tiling.merge_boxes).
+        motion_mask (ảnh nhị phân các điểm thay đổi, có thể nhỏ hơn ảnh) và prior_boxes (box đã phát hiện ở
+        khung hình trước): nếu có, chỉ chạy các tile có chuyển động hoặc chứa box cũ (xem tiling.select_tiles).
+        """
+        self._ensure_ready()
+        height, width = image.shape[:2]
+        tiles = tile_grid(width, height, self.tile_size, self.tile_overlap)
+        if len(tiles) == 1:
+            # Ảnh không lớn hơn một tile: phát hiện trên cả ảnh như bình thường
+            tiles, active = [], []
+        else:
+            active = select_tiles(tiles, image.shape, motion_mask=motion_mask, prior_boxes=prior_boxes)
+            self.metrics.inc("anpr_tiles_total", len(active), result="run")
+            self.metrics.inc("anpr_tiles_total", len(tiles) - len(active), result="skipped")
+        inputs = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in (tiles[i] for i in active)]
+        run_full_frame = not tiles or self.tile_full_frame
+        if run_full_frame:
+            inputs.append(image)
+        if not inputs:
+            return []
+
+        raw_boxes_per_input = []
+        for start in range(0, len(inputs), batch_size):
+            with self._use_model("detector"), self._stage("detection"):
+                raw_boxes_per_input.extend(self.detector(inputs[start:start + batch_size]))
+
+        merged_input, truncated = [], []
+        for index, raw_boxes in zip(active, raw_boxes_per_input):
+            tile = tiles[index]
+            for box in raw_boxes:
+                truncated.append(tile_box_truncated(box, tile, image.shape))
+                merged_input.append([box[0] + tile[0], box[1] + tile[1], box[2] + tile[0], box[3] + tile[1], box[4]])
+        if run_full_frame:
+            for box in raw_boxes_per_input[-1]:
+                truncated.append(False)
+                merged_input.append(list(box[:5]))
+        if not merged_input:
+            return []
+        merged = merge_boxes(np.asarray(merged_input, dtype=np.float32), TILE_MERGE_IOU, self.tile_merge,
+                             truncated=np.asarray(truncated))
+        return self._clip_boxes(merged, image.shape)
+
+    def process_image_in_memory(self, image_bytes: bytes, annotate: bool = True) -> dict:
+        """
+        Phát hiện và nhận dạng biển số từ dữ liệu byte của ảnh.
+        Trả về một dictionary chứa dữ liệu ảnh (NumPy array) và văn bản.
+
+        YOLO chạy trên ảnh giải mã thu nhỏ (xem _decode_for_detection); vùng biển số được cắt từ ảnh
+        có độ phân giải vừa đủ cho OCR. Toạ độ "box" luôn theo ảnh gốc. result_image_np là ảnh phát hiện
+        (đã thu nhỏ) có vẽ box, hoặc None nếu annotate=False.
+        """
+        with self._stage("decode"):
+            detection_image, factor = self._decode_for_detection(image_bytes)
+
+        if detection_image is None:
+            self.metrics.inc("anpr_images_total", result="decode_error")
+            return {"error": "Không thể đọc ảnh."}
+        self.metrics.inc("anpr_images_total", result="ok")
+        
+        boxes = self.detect_plates([detection_image])[0]
+        self.metrics.observe("anpr_plates_per_image", len(boxes))
+        with self._stage("decode"):
+            crop_image, scale_x, scale_y = self._crop_source(image_bytes, detection_image, factor, boxes)
+        
+        detected_plates = []
+
+        for x1, y1, x2, y2, conf in boxes:
+            cx1, cy1, cx2, cy2 = self._map_box((x1, y1, x2, y2), scale_x, scale_y, crop_image.shape)
+            plate_crop = crop_image[cy1:cy2, cx1:cx2]
+            plate_text, processed_plate_img, ocr_tier = self._ultimate_license_plate_pipeline(plate_crop)
             
             # Chỉ thêm vào detected_plates nếu vùng được coi là biển số hợp lệ
             if processed_plate_img is not None:
                 detected_plates.append({
                     "text": plate_text,
                     "confidence": conf,
+                    "box": [x1 * factor, y1 * factor, x2 * factor, y2 * factor],
                     "cropped_plate_np": processed_plate_img,
-                    "binary_plate_np": binary_plate_img,
+                    "ocr_tier": ocr_tier,
                 })
-                
-                label = f"{plate_text} ({conf:.2f})"
-                cv2.rectangle(image_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-                (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-                cv2.rectangle(image_with_boxes, (x1, y1 - text_height - 15), (x1 + text_width, y1 - 10), (0, 255, 0), -1)
-                cv2.putText(image_with_boxes, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+                if annotate:
+                    # Ảnh phát hiện là bản giải mã riêng của request này nên vẽ trực tiếp, không cần sao chép
+                    self._draw_plate(detection_image, (x1, y1, x2, y2), f"{plate_text} ({conf:.2f})")
 
         return {
-            "result_image_np": image_with_boxes,
+            "result_image_np": detection_image if annotate else None,
             "plates": detected_plates
         }
 
+    def process_images_in_memory(self, images_bytes: List[bytes], batch_size: int = 16,
+                                 annotate: bool = True,
+                                 decoded: Optional[List[Tuple[Optional[np.ndarray], int]]] = None) -> List[dict]:
+        """
+        Phiên bản theo lô của process_image_in_memory.
+        Giải mã tất cả ảnh, chạy YOLO một lần cho mỗi lô ảnh, sau đó OCR toàn bộ biển số
+        của mọi ảnh theo lô. Trả về danh sách kết quả (cùng định dạng dictionary) theo đúng thứ tự đầu vào.
+        decoded: kết quả _decode_for_detection đã tính sẵn cho từng ảnh (ví dụ giải mã trước trên các luồng
+            khác), để không phải giải mã lại ở đây.
+        """
+        images = []
+        factors = []
+        for index, image_bytes in enumerate(images_bytes):
+            if decoded is not None:
+                image, factor = decoded[index]
+            else:
+                with self._stage("decode"):
+                    image, factor = self._decode_for_detection(image_bytes)
+            images.append(image)
+            factors.append(factor)
+            self.metrics.inc("anpr_images_total", result="ok" if image is not None else "decode_error")
+        outputs: List[dict] = [{"error": "Không thể đọc ảnh."} if img is None else None for img in images]
+        valid_indices = [i for i, img in enumerate(images) if img is not None]
+
+        # Bước 1: Phát hiện biển số theo lô
+        detected = self.detect_plates([images[i] for i in valid_indices], batch_size=batch_size)
+        boxes_per_image = dict(zip(valid_indices, detected))
+        for boxes in detected:
+            self.metrics.observe("anpr_plates_per_image", len(boxes))
+
+        # Bước 2: Với mỗi vùng biển số (trừ các biển số đã có trong cache OCR), thử các bậc OCR rẻ
+        # (chỉ mạng nhận dạng) ngay; bậc 'full' (nếu là bậc cuối) được gom lại để chạy theo lô ở bước 3
+        run_full = self.ocr_tiers[-1] == 'full'
+        cheap_tiers = self.ocr_tiers[:-1] if run_full else self.ocr_tiers
+        crops = []  # (chỉ số ảnh, box, plate_roi, bậc OCR, text hoặc None nếu chưa OCR)
+        pending = []  # [danh sách vị trí trong crops, khóa cache, ảnh đã lọc] cần OCR đầy đủ
+        pending_by_key = {}  # các ảnh biển số trùng khớp trong cùng lô chỉ OCR một lần
+        for i in valid_indices:
+            with self._stage("decode"):
+                crop_image, scale_x, scale_y = self._crop_source(images_bytes[i], images[i], factors[i],
+                                                                 boxes_per_image[i])
+            for x1, y1, x2, y2, conf in boxes_per_image[i]:
+                cx1, cy1, cx2, cy2 = self._map_box((x1, y1, x2, y2), scale_x, scale_y, crop_image.shape)
+                plate_crop = crop_image[cy1:cy2, cx1:cx2]
+                if plate_crop.size == 0:
+                    continue
+                cache_key, found, cached = self._lookup_ocr_cache(plate_crop)
+                if found:
+                    if cached is not None:
+                        crops.append((i, (x1, y1, x2, y2, conf), self._upscale_plate(plate_crop), "cache", cached[0]))
+                    continue
+                if cache_key is not None and cache_key in pending_by_key:
+                    pending[pending_by_key[cache_key]][0].append(len(crops))
+                    crops.append((i, (x1, y1, x2, y2, conf), self._upscale_plate(plate_crop), "full", None))
+                    continue
+
+                prepared = {}
+                accepted = (self._cascade(plate_crop, cheap_tiers, prepared, accept_last=not run_full)
+                            if cheap_tiers else None)
+                if accepted is not None:
+                    plate_text, ocr_conf, tier = accepted
+                    self._count_plate(plate_text)
+                    if cache_key is not None and ocr_conf is not None:
+                        self.ocr_cache.put(cache_key, None if plate_text is None else (plate_text, ocr_conf))
+                    if plate_text is not None:
+                        plate_roi = prepared.get('plate_roi')
+                        crops.append((i, (x1, y1, x2, y2, conf),
+                                      plate_roi if plate_roi is not None else self._upscale_plate(plate_crop),
+                                      tier, plate_text))
+                    continue
+
+                if 'bfilter' not in prepared:
+                    with self._stage("preprocessing"):
+                        prepared['plate_roi'], prepared['bfilter'] = self._preprocess_plate(plate_crop)
+                if cache_key is not None:
+                    pending_by_key[cache_key] = len(pending)
+                pending.append(([len(crops)], cache_key, prepared['bfilter']))
+                crops.append((i, (x1, y1, x2, y2, conf), prepared['plate_roi'], "full", None))
+
+        # Bước 3: OCR đầy đủ theo lô cho các biển số các bậc rẻ không đọc được
+        started = time.perf_counter()
+        ocr_results = self._read_plates_batched([item[2] for item in pending], batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        for _ in pending:
+            # Thời gian bậc 'full' của mỗi biển số tính bằng thời gian trung bình trong lô
+            self.metrics.observe("anpr_ocr_tier_seconds", elapsed / len(pending), tier="full")
+            self.metrics.inc("anpr_ocr_tier_total", tier="full")
+        rejected = set()
+        for (positions, cache_key, _), (plate_text, ocr_conf) in zip(pending, ocr_results):
+            if cache_key is not None and ocr_conf is not None:
+                self.ocr_cache.put(cache_key, None if plate_text is None else (plate_text, ocr_conf))
+            for position in positions:
+                if plate_text is None:
+                    rejected.add(position)
+                else:
+                    crops[position] = crops[position][:4] + (plate_text,)
+
+        # Bước 4: Ghép kết quả về từng ảnh (ảnh phát hiện là bản giải mã riêng nên vẽ trực tiếp)
+        for i in valid_indices:
+            outputs[i] = {"result_image_np": images[i] if annotate else None, "plates": []}
+
+        for position, (i, (x1, y1, x2, y2, conf), plate_roi, ocr_tier, plate_text) in enumerate(crops):
+            # Bỏ qua vùng không được coi là biển số hợp lệ
+            if position in rejected:
+                continue
+            factor = factors[i]
+            outputs[i]["plates"].append({
+                "text": plate_text,
+                "confidence": conf,
+                "box": [x1 * factor, y1 * factor, x2 * factor, y2 * factor],
+                "cropped_plate_np": plate_roi,
+                "ocr_tier": ocr_tier,
+            })
+            if annotate:
+                self._draw_plate(outputs[i]["result_image_np"], (x1, y1, x2, y2), f"{plate_text} ({conf:.2f})")
+
+        return outputs
+
+    def process_frames(self, frames: List[np.ndarray], batch_size: int = 16, annotate: bool = True) -> List[dict]:
+        """
+        Như process_images_in_memory nhưng nhận ảnh BGR đã giải mã (ví dụ khung hình video, hoặc view vào slot của
+        frame_ring.FrameRing). Ảnh không bị sao chép: YOLO và việc cắt biển số đọc thẳng từ mảng được truyền vào,
+        box được vẽ trực tiếp lên mảng đó (result_image_np chính là mảng đầu vào nếu annotate). Ảnh biển số trả về
+        (cropped_plate_np) luôn là bản sao riêng, không trỏ vào ảnh đầu vào.
+        """
+        return self.process_images_in_memory([None] * len(frames), batch_size, annotate,
+                                             decoded=[(frame if frame is not None and frame.size else None, 1)
+                                                      for frame in frames])
+
+    def process_frame(self, frame: np.ndarray, annotate: bool = True) -> dict:
+        """process_frames cho một ảnh."""
+        return self.process_frames([frame], annotate=annotate)[0]
+
+    @staticmethod
+    def encode_image(image_np: np.ndarray, format: str = ".jpg") -> Optional[bytes]:
+        """Mã hóa ảnh NumPy array thành bytes (mặc định JPEG)."""
+        if image_np is None:
+            return None
+        _, buffer = cv2.imencode(format, image_np)
+        return buffer.tobytes()
+
     @staticmethod
     def encode_image_to_base64(image_np: np.ndarray, format: str = ".jpg") -> str:
         """Chuyển đổi ảnh NumPy array sang chuỗi Base64 Data URL."""
         if image_np is None:
             return None
-        _, buffer = cv2.imencode(format, image_np)
-        encoded_string = base64.b64encode(buffer).decode("utf-8")
-        return f"data:image/{format[1:]};base64,{encoded_string}"
\ No newline at end of file
+        encoded_string = base64.b64encode(ANPRSystem.encode_image(image_np, format)).decode("utf-8")
+        return f"data:image/{format[1:]};base64,{encoded_string}"
+
+
+class ANPRSystemPool:
+    """
+    Nhiều ANPRSystem độc lập trong cùng một tiến trình để các luồng suy luận thực sự song song
+    (mỗi instance có YOLO + EasyOCR riêng, không phải chờ khóa mô hình của nhau).
+
+    Ngân sách luồng num_threads (mặc định: số nhân CPU) được chia đều: configure_threads(num_threads // size)
+    (thiết lập chung của tiến trình, mọi instance áp dụng cùng một giá trị) giới hạn mỗi lần chạy mô hình ở
+    num_threads // size luồng, nên khi cả size instance cùng chạy, tổng số luồng tính toán không vượt quá
+    ngân sách. acquire() lấy một instance rảnh (chờ nếu tất cả đang bận); instance chỉ được dùng bởi
+    một luồng tại một thời điểm.
+    """
+
+    def __init__(self, yolo_model_path: str, size: int = 2, num_threads: Optional[int] = None, **anpr_kwargs):
+        self.size = max(1, size)
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.threads_per_system = max(1, self.num_threads // self.size)
+        self.systems = [ANPRSystem(yolo_model_path, num_threads=self.threads_per_system, **anpr_kwargs)
+                        for _ in range(self.size)]
+        self._free: "queue.Queue[ANPRSystem]" = queue.Queue()
+        for anpr_system in self.systems:
+            self._free.put(anpr_system)
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        """with pool.acquire() as anpr_system: ... Ném queue.Empty nếu hết thời gian chờ."""
+        anpr_system = self._free.get(timeout=timeout)
+        try:
+            yield anpr_system
+        finally:
+            self._free.put(anpr_system)
+
+    def run(self, method_name: str, *args, **kwargs):
+        """Gọi một phương thức của ANPRSystem trên instance rảnh đầu tiên."""
+        with self.acquire() as anpr_system:
+            return getattr(anpr_system, method_name)(*args, **kwargs)
+
@@ -1,14 +1,70 @@
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+
+import atexit
+import json
 import os
-import re
 import uuid
-import cv2
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, abort, g, render_template, request, jsonify, session, url_for
 from anpr_core import ANPRSystem
+from inference_workers import (InferenceWorkerPool, JobTimeoutError, QueueFullError, WorkerCrashedError,
+                               WorkerPoolClosedError)
+from metrics import Metrics
+from model_registry import ModelRegistry, list_model_versions, publish_model, select_sweep_candidate
+from plate_layout import binarize_plate
+from plate_log import SEARCH_MODES, PlateEventLog
+from result_store import ResultStore
+from result_writer import ResultWriter, WriterClosedError, WriterQueueFullError
 
 # --- Cấu hình ---
-YOLO_MODEL_PATH = r"E:\XLA\XuLyAnh\runs\yolo_bien_so_xe_detector\weights\best.pt" 
+# Thư mục mô hình: server nạp phiên bản mới nhất trong thư mục này khi khởi động, và tự nạp phiên bản mới
+# (ví dụ best.pt do train_yolo.py đưa vào) khi đang chạy mà không cần khởi động lại. Xem /admin/models.
+MODELS_DIR = os.environ.get('ANPR_MODELS_DIR', 'models')
+# Dùng khi MODELS_DIR chưa có mô hình nào
+YOLO_MODEL_PATH = os.environ.get('ANPR_YOLO_MODEL_PATH',
+                                 os.path.join('..', 'runs', 'yolo_bien_so_xe_detector', 'weights', 'best.pt'))
+# Khi MODELS_DIR chưa có mô hình nào và LATENCY_BUDGET_MS được đặt (ms/ảnh, p95 của YOLO trên CPU), mô hình
+# chính xác nhất đủ nhanh trong file tổng kết của model_sweep.py được đưa vào MODELS_DIR (kèm imgsz) thay cho YOLO_MODEL_PATH
+MODEL_SWEEP_SUMMARY = os.environ.get('ANPR_MODEL_SWEEP_SUMMARY', os.path.join('..', 'runs', 'model_sweep.json'))
+LATENCY_BUDGET_MS = None
+DETECTOR_BACKEND = 'ultralytics'  # 'onnx' để chạy file .onnx (export_onnx.py) bằng ONNX Runtime; khi đó thư mục mô hình chứa file .onnx
+OCR_BACKEND = 'easyocr'       # 'crnn' để dùng bộ nhận dạng biển số nhỏ (train_plate_ocr.py) thay EasyOCR
+OCR_MODEL_PATH = os.environ.get('ANPR_OCR_MODEL_PATH', os.path.join('..', 'runs', 'plate_ocr', 'plate_ocr.onnx'))
+MODEL_POLL_SECONDS = 5         # Chu kỳ quét MODELS_DIR để tìm phiên bản mới
+ADMIN_TOKEN = os.environ.get('ANPR_ADMIN_TOKEN')  # Nếu đặt, các API /admin yêu cầu header X-Admin-Token
 RESULT_FOLDER = 'results' 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Các kiểu phản hồi của /process-image(s), chọn bằng ?response=... hoặc header Accept: multipart/mixed
+#   base64:    JSON kèm ảnh dạng Base64 Data URL (mặc định, tương thích client cũ)
+#   json:      chỉ văn bản, độ tin cậy và toạ độ box, không mã hóa ảnh nào
+#   urls:      JSON kèm URL ảnh, ảnh chỉ được mã hóa khi client tải URL đó
+#   multipart: multipart/mixed gồm một phần JSON và các ảnh JPEG thô
+RESPONSE_MODES = ('base64', 'json', 'urls', 'multipart')
+RESULT_STORE_MAX_BYTES = 512 * 1024 * 1024   # Dung lượng RAM tối đa cho kết quả tạm
+RESULT_STORE_TTL_SECONDS = 30 * 60           # Kết quả tạm hết hạn sau 30 phút
+RESULT_STORE_SPILL_DIR = 'result_store_spill' # Đặt None để tắt việc ghi tạm ra đĩa
+NUM_INFERENCE_WORKERS = 2      # Số tiến trình suy luận, mỗi tiến trình tải riêng YOLO + EasyOCR
+# Số luồng tính toán (torch/OpenCV/OpenMP) mỗi worker; chia đều số nhân CPU để các worker không tranh nhau CPU
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // NUM_INFERENCE_WORKERS)
+INFERENCE_QUEUE_SIZE = 32      # Số công việc tối đa được xếp hàng, vượt quá sẽ trả về HTTP 503
+JOB_TIMEOUT_SECONDS = 60       # Thời gian chờ tối đa cho mỗi công việc suy luận
+INFERENCE_BATCH_SIZE = 16      # Số ảnh/biển số mỗi lô YOLO/EasyOCR của /process-images
+WARMUP_ON_START = True         # Mỗi worker chạy thử một lần suy luận trước khi báo sẵn sàng
+PROFILE_SAMPLE_RATE = 0.0      # Tỉ lệ công việc chạy dưới cProfile (0 để tắt, ví dụ 0.01 = 1%)
+PROFILE_SLOW_SECONDS = 2.0     # Chỉ ghi file profile cho công việc chậm hơn ngưỡng này
+PROFILE_DIR = 'profiles'
+SAVE_STORAGE = 'files'         # /save-results: 'files' (thư mục mỗi phiên), 'zip' (một file .zip) hoặc 'segment'
+SAVE_WORKERS = 2               # Số luồng ghi kết quả ở nền
+SAVE_QUEUE_SIZE = 64           # Số yêu cầu lưu tối đa đang chờ ghi
+SAVE_WAIT_SECONDS = 30         # Thời gian chờ tối đa khi client gọi /save-results?wait=1
+PLATE_LOG_PATH = 'plate_log.sqlite3'  # Nhật ký mọi lần đọc biển số (SQLite, chế độ WAL), tra cứu qua /search
+PLATE_LOG_FUZZY_DISTANCE = 2   # Khoảng cách sửa tối đa /search hỗ trợ; chỉ có tác dụng khi tạo file mới
+SEARCH_MAX_LIMIT = 500         # Số lần đọc tối đa một lần /search trả về
+# Chế độ debug của Flask (trình gỡ lỗi tương tác của Werkzeug cho phép chạy mã tùy ý): chỉ bật khi phát triển trên máy
+# cá nhân, bằng ANPR_DEBUG=1. Các biến ANPR_HOST/ANPR_PORT chỉ dùng cho server phát triển (python app.py)
+DEBUG = os.environ.get('ANPR_DEBUG', '0').lower() in ('1', 'true', 'yes')
+HOST = os.environ.get('ANPR_HOST', '0.0.0.0')
+PORT = int(os.environ.get('ANPR_PORT', '5000'))
 
 # --- Khởi tạo ứng dụng Flask ---
 app = Flask(__name__)
@@ -16,22 +72,253 @@ app.config['RESULT_FOLDER'] = RESULT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.secret_key = 'super-secret-key-for-session-and-temp-storage'
 
-# --- Tải mô hình ANPR (CHỈ MỘT LẦN KHI START SERVER) ---
-try:
-    anpr_system = ANPRSystem(yolo_model_path=YOLO_MODEL_PATH)
-except Exception as e:
-    print(f"Không thể khởi tạo ANPR System. Ứng dụng sẽ thoát. Lỗi: {e}")
-    exit()
+# --- Metrics (xem /metrics) ---
+METRICS = Metrics()
+
+# --- Pool worker suy luận ---
+# Mỗi worker là một tiến trình riêng tải mô hình MỘT LẦN khi khởi động; Flask chỉ nhận ảnh
+# và chờ kết quả. Pool được khởi động trong __main__ hoặc ở request đầu tiên (khi chạy qua WSGI),
+# không khởi động lúc import để các tiến trình con (spawn) import lại module này không tạo pool mới.
+_available_models = list_model_versions(MODELS_DIR, DETECTOR_BACKEND)
+if not _available_models and LATENCY_BUDGET_MS:
+    _sweep_candidate = select_sweep_candidate(MODEL_SWEEP_SUMMARY, LATENCY_BUDGET_MS, DETECTOR_BACKEND)
+    if _sweep_candidate:
+        publish_model(_sweep_candidate['weights'], MODELS_DIR, version=f"sweep-{_sweep_candidate['name']}",
+                      metadata={'imgsz': _sweep_candidate['imgsz'], 'sweep_candidate': _sweep_candidate['name']})
+        _available_models = list_model_versions(MODELS_DIR, DETECTOR_BACKEND)
+_initial_model = _available_models[-1] if _available_models else {'path': YOLO_MODEL_PATH, 'version': 'default'}
+WORKER_POOL = InferenceWorkerPool(yolo_model_path=_initial_model['path'],
+                                  model_version=_initial_model['version'],
+                                  num_workers=NUM_INFERENCE_WORKERS,
+                                  max_queue_size=INFERENCE_QUEUE_SIZE,
+                                  job_timeout=JOB_TIMEOUT_SECONDS,
+                                  anpr_kwargs={'detector_backend': DETECTOR_BACKEND, 'warmup': WARMUP_ON_START,
+                                               'num_threads': THREADS_PER_WORKER, 'ocr_backend': OCR_BACKEND,
+                                               'ocr_model_path': OCR_MODEL_PATH if OCR_BACKEND == 'crnn' else None},
+                                  metrics=METRICS,
+                                  profile_sample_rate=PROFILE_SAMPLE_RATE,
+                                  profile_slow_seconds=PROFILE_SLOW_SECONDS,
+                                  profile_dir=PROFILE_DIR)
+atexit.register(WORKER_POOL.shutdown)
+
+# --- Theo dõi thư mục mô hình, nạp phiên bản mới không gián đoạn ---
+MODEL_REGISTRY = ModelRegistry(WORKER_POOL, MODELS_DIR, backend=DETECTOR_BACKEND, poll_interval=MODEL_POLL_SECONDS)
+atexit.register(MODEL_REGISTRY.shutdown)
 
 
 # --- Nơi lưu trữ tạm thời kết quả xử lý (trong bộ nhớ server) ---
-# Dùng dictionary để lưu, key là session_id, value là kết quả xử lý
-TEMP_RESULTS_STORAGE = {}
+# Key là session_id, value là kết quả xử lý. Bộ nhớ có giới hạn dung lượng và thời gian sống,
+# kết quả bị đẩy khỏi RAM (nhưng chưa hết hạn) được nén tạm ra đĩa.
+RESULT_STORE = ResultStore(max_bytes=RESULT_STORE_MAX_BYTES,
+                           ttl_seconds=RESULT_STORE_TTL_SECONDS,
+                           spill_dir=RESULT_STORE_SPILL_DIR)
+atexit.register(RESULT_STORE.close)
+
+# --- Bộ ghi kết quả chạy nền cho /save-results ---
+RESULT_WRITER = ResultWriter(RESULT_FOLDER, storage=SAVE_STORAGE, num_workers=SAVE_WORKERS,
+                             max_pending=SAVE_QUEUE_SIZE)
+atexit.register(RESULT_WRITER.shutdown)
+
+# --- Nhật ký các lần đọc biển số (ghi ở nền theo lô, tra cứu qua /search) ---
+PLATE_LOG = PlateEventLog(PLATE_LOG_PATH, index_distance=PLATE_LOG_FUZZY_DISTANCE, metrics=METRICS)
+atexit.register(PLATE_LOG.shutdown)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_response_mode():
+    """Xác định kiểu phản hồi client yêu cầu, trả về None nếu không hợp lệ."""
+    mode = request.args.get('response') or request.form.get('response')
+    if not mode:
+        best = request.accept_mimetypes.best_match(['application/json', 'multipart/mixed'])
+        mode = 'multipart' if best == 'multipart/mixed' else 'base64'
+    return mode if mode in RESPONSE_MODES else None
+
+def wants_annotation(mode):
+    """Có cần vẽ box lên ảnh kết quả không: theo ?annotate=0/1, mặc định là có trừ chế độ 'json'."""
+    value = request.args.get('annotate') or request.form.get('annotate')
+    if value is None:
+        return mode != 'json'
+    return value.lower() not in ('0', 'false', 'no')
+
+def result_image_np(results_data, name):
+    """
+    Ảnh theo tên (dùng trong URL và trong phần multipart) của một kết quả, None nếu không có.
+    Ảnh nhị phân không nằm trong kết quả suy luận mà chỉ được tính ở đây, khi client cần đến.
+    """
+    if name == 'result':
+        return results_data['result_image_np']
+    prefix, _, kind = name.rpartition('_')
+    if not prefix.startswith('plate_') or not prefix[len('plate_'):].isdigit():
+        return None
+    index = int(prefix[len('plate_'):])
+    if index >= len(results_data['plates']):
+        return None
+    plate = results_data['plates'][index]
+    if kind == 'cropped':
+        return plate['cropped_plate_np']
+    if kind == 'binary':
+        return binarize_plate(plate['cropped_plate_np'])
+    return None
+
+def build_response(results_data, mode='base64', part_prefix=''):
+    """
+    Lưu kết quả vào bộ nhớ tạm và chuẩn bị dữ liệu JSON để gửi về client theo kiểu phản hồi mode.
+    Trả về (dữ liệu JSON, danh sách (tên, ảnh) cần gửi kèm ở chế độ multipart).
+    """
+    # Tạo một session ID duy nhất cho lần xử lý này
+    session_id = str(uuid.uuid4())
+    
+    # Lưu kết quả (dạng NumPy array) vào bộ nhớ tạm
+    RESULT_STORE.put(session_id, results_data.copy())
+
+    response_data = {'session_id': session_id, 'plates': []}
+    parts = []
+
+    def attach(data, key, name, available):
+        # Ảnh chỉ được tạo và mã hóa ở chế độ base64 (ngay bây giờ), multipart (khi ghi phản hồi)
+        # hoặc urls (khi client tải URL); chế độ json không tạo ảnh nào
+        if mode == 'base64':
+            data[f'{key}_base64'] = ANPRSystem.encode_image_to_base64(result_image_np(results_data, name))
+        elif mode == 'urls':
+            data[f'{key}_url'] = url_for('result_image', session_id=session_id, name=name) if available else None
+        elif mode == 'multipart' and available:
+            data[f'{key}_part'] = part_prefix + name
+            parts.append((part_prefix + name, result_image_np(results_data, name)))
+
+    attach(response_data, 'result_image', 'result', results_data['result_image_np'] is not None)
+    for i, plate in enumerate(results_data['plates']):
+        plate_data = {
+            'text': plate['text'],
+            'confidence': plate['confidence'],
+            'box': plate.get('box'),
+            'ocr_tier': plate.get('ocr_tier'),
+        }
+        has_crop = plate['cropped_plate_np'] is not None
+        attach(plate_data, 'cropped_plate', f'plate_{i}_cropped', has_crop)
+        attach(plate_data, 'binary_plate', f'plate_{i}_binary', has_crop)
+        response_data['plates'].append(plate_data)
+    return response_data, parts
+
+def record_reads(session_id, results_data, source):
+    """Ghi các biển số đọc được (bỏ qua N/A) vào nhật ký; ảnh tham chiếu qua session_id + plate_index."""
+    PLATE_LOG.record({'plate': plate['text'], 'confidence': plate['confidence'], 'box': plate.get('box'),
+                      'session_id': session_id, 'plate_index': i, 'source': source}
+                     for i, plate in enumerate(results_data['plates']) if plate['text'] != 'N/A')
+
+def multipart_response(response_data, parts):
+    """Phản hồi multipart/mixed: phần đầu là JSON, các phần sau là ảnh JPEG (Content-ID là tên ảnh)."""
+    boundary = uuid.uuid4().hex
+
+    def generate():
+        yield (f'--{boundary}\r\nContent-Type: application/json; charset=utf-8\r\n\r\n').encode('utf-8')
+        yield json.dumps(response_data, ensure_ascii=False).encode('utf-8')
+        for name, image_np in parts:
+            jpeg_bytes = ANPRSystem.encode_image(image_np)
+            yield (f'\r\n--{boundary}\r\nContent-Type: image/jpeg\r\nContent-ID: <{name}>\r\n'
+                   f'Content-Disposition: inline; name="{name}"\r\nContent-Length: {len(jpeg_bytes)}\r\n\r\n').encode('utf-8')
+            yield jpeg_bytes
+        yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+    return Response(generate(), mimetype=f'multipart/mixed; boundary={boundary}')
+
+@app.before_request
+def ensure_worker_pool_started():
+    WORKER_POOL.start()
+    MODEL_REGISTRY.start()
+    RESULT_WRITER.start()
+    PLATE_LOG.start()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if 'request_started' in g:
+        METRICS.observe('anpr_http_request_seconds', time.perf_counter() - g.request_started, endpoint=endpoint)
+    METRICS.inc('anpr_http_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.errorhandler(QueueFullError)
+def handle_queue_full(e):
+    return jsonify({'error': 'Hệ thống đang quá tải, vui lòng thử lại sau.'}), 503, {'Retry-After': '1'}
+
+@app.errorhandler(JobTimeoutError)
+def handle_job_timeout(e):
+    return jsonify({'error': f'Xử lý ảnh quá thời gian cho phép: {e}'}), 504
+
+@app.errorhandler(WorkerPoolClosedError)
+def handle_pool_closed(e):
+    return jsonify({'error': f'Hệ thống nhận dạng không khả dụng: {e}'}), 503
+
+@app.errorhandler(WorkerCrashedError)
+def handle_worker_crashed(e):
+    return jsonify({'error': f'Xử lý ảnh thất bại: {e}'}), 500
+
+@app.errorhandler(WriterQueueFullError)
+def handle_writer_queue_full(e):
+    return jsonify({'error': 'Đang có quá nhiều yêu cầu lưu kết quả, vui lòng thử lại sau.'}), 503, {'Retry-After': '1'}
+
+@app.errorhandler(WriterClosedError)
+def handle_writer_closed(e):
+    return jsonify({'error': f'Không thể lưu kết quả: {e}'}), 503
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: tiến trình web còn sống và phản hồi được."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: chỉ sẵn sàng nhận ảnh khi có ít nhất một worker đã tải xong mô hình."""
+    status = WORKER_POOL.status()
+    code = 200 if status['ready_workers'] > 0 and status['accepting'] else 503
+    return jsonify({'status': 'ready' if code == 200 else 'loading', **status}), code
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics định dạng Prometheus: thời gian từng bước (đo trong worker), số biển số, tỉ lệ N/A, hàng đợi, bộ nhớ tạm."""
+    gauges = {
+        'anpr_queue_depth': WORKER_POOL.queue_depth,
+        'anpr_ready_workers': WORKER_POOL.ready_workers,
+        'anpr_result_store_entries': lambda: len(RESULT_STORE),
+        'anpr_result_store_resident_bytes': lambda: RESULT_STORE.stats()['resident_bytes'],
+        'anpr_result_store_spilled_bytes': lambda: RESULT_STORE.stats()['spilled_bytes'],
+        'anpr_save_queue_depth': RESULT_WRITER.queue_depth,
+        'anpr_plate_log_queue_depth': PLATE_LOG.queue_depth,
+    }
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def check_admin_token():
+    """Trả về phản hồi lỗi nếu ADMIN_TOKEN được đặt mà request không gửi đúng token, ngược lại None."""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Không có quyền truy cập.'}), 403
+    return None
+
+@app.route('/admin/models', methods=['GET'])
+def admin_models():
+    """Các phiên bản mô hình: đang hoạt động, đang nạp, đang xử lý nốt, kèm bộ nhớ (RSS) của từng worker."""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    return jsonify(MODEL_REGISTRY.status())
+
+@app.route('/admin/models/reload', methods=['POST'])
+def admin_models_reload():
+    """Nạp ngay phiên bản mới nhất, hoặc phiên bản chỉ định bằng {"version": ...} (ví dụ để quay lại bản cũ)."""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    version = (request.get_json(silent=True) or {}).get('version')
+    try:
+        started = MODEL_REGISTRY.reload(version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    if started is None:
+        return jsonify({'error': 'Đang nạp một phiên bản khác, vui lòng thử lại sau.'}), 409
+    return jsonify({'status': 'loading', 'version': started,
+                    'status_url': url_for('admin_models')}), 202
+
 @app.route('/', methods=['GET'])
 def index():
     """Chỉ hiển thị trang chính."""
@@ -47,85 +334,168 @@ def process_image():
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({'error': 'File không hợp lệ hoặc không được cho phép.'}), 400
 
+    mode = get_response_mode()
+    if mode is None:
+        return jsonify({'error': f'Kiểu phản hồi không hợp lệ, hỗ trợ: {", ".join(RESPONSE_MODES)}'}), 400
+
     try:
-        image_bytes = file.read()
-        results_data = anpr_system.process_image_in_memory(image_bytes)
+        results_data = WORKER_POOL.run('process_image_in_memory', file.read(), wants_annotation(mode))
 
         if "error" in results_data:
             return jsonify({'error': results_data['error']}), 500
 
-        # Tạo một session ID duy nhất cho lần xử lý này
-        session_id = str(uuid.uuid4())
-        
-        # Lưu kết quả (dạng NumPy array) vào bộ nhớ tạm
-        TEMP_RESULTS_STORAGE[session_id] = results_data.copy()
-
-        # Chuẩn bị dữ liệu để gửi về client (chuyển ảnh sang Base64)
-        response_data = {
-            'session_id': session_id,
-            'result_image_base64': ANPRSystem.encode_image_to_base64(results_data['result_image_np']),
-            'plates': []
-        }
-
-        for plate in results_data['plates']:
-            response_data['plates'].append({
-                'text': plate['text'],
-                'confidence': plate['confidence'],
-                'cropped_plate_base64': ANPRSystem.encode_image_to_base64(plate['cropped_plate_np']),
-                'binary_plate_base64': ANPRSystem.encode_image_to_base64(plate['binary_plate_np'])
-            })
-        
+        response_data, parts = build_response(results_data, mode)
+        record_reads(response_data['session_id'], results_data, file.filename)
+        if mode == 'multipart':
+            return multipart_response(response_data, parts)
         return jsonify(response_data)
 
+    except (QueueFullError, JobTimeoutError, WorkerPoolClosedError, WorkerCrashedError):
+        # Được các errorhandler ở trên chuyển thành HTTP 503/504
+        raise
+    except Exception as e:
+        print(f"Đã xảy ra lỗi không xác định: {e}")
+        return jsonify({'error': f'Xảy ra lỗi trong quá trình xử lý ảnh: {e}'}), 500
+
+@app.route('/process-images', methods=['POST'])
+def process_images():
+    """API xử lý nhiều ảnh trong một request (YOLO và OCR chạy theo lô)."""
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'Không có file ảnh nào được gửi lên.'}), 400
+
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            return jsonify({'error': f'File không hợp lệ hoặc không được cho phép: {file.filename}'}), 400
+
+    mode = get_response_mode()
+    if mode is None:
+        return jsonify({'error': f'Kiểu phản hồi không hợp lệ, hỗ trợ: {", ".join(RESPONSE_MODES)}'}), 400
+
+    try:
+        results_list = WORKER_POOL.run('process_images_in_memory', [file.read() for file in files],
+                                       INFERENCE_BATCH_SIZE, wants_annotation(mode))
+
+        response_list = []
+        all_parts = []
+        for index, (file, results_data) in enumerate(zip(files, results_list)):
+            if "error" in results_data:
+                response_list.append({'filename': file.filename, 'error': results_data['error']})
+                continue
+            response_data, parts = build_response(results_data, mode, part_prefix=f'{index}_')
+            record_reads(response_data['session_id'], results_data, file.filename)
+            response_data['filename'] = file.filename
+            response_list.append(response_data)
+            all_parts.extend(parts)
+
+        if mode == 'multipart':
+            return multipart_response({'results': response_list}, all_parts)
+        return jsonify({'results': response_list})
+
+    except (QueueFullError, JobTimeoutError, WorkerPoolClosedError, WorkerCrashedError):
+        raise
     except Exception as e:
         print(f"Đã xảy ra lỗi không xác định: {e}")
         return jsonify({'error': f'Xảy ra lỗi trong quá trình xử lý ảnh: {e}'}), 500
 
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Tra cứu nhật ký biển số. Tham số: q (biển số, có thể thiếu dấu hoặc đọc nhầm), mode (exact, prefix,
+    fuzzy; mặc định fuzzy), max_distance (1-2, mặc định 1), since/until (Unix timestamp), limit.
+    Các cặp ký tự OCR hay nhầm (8/B, 0/O/D, ...) luôn được coi là giống nhau.
+    """
+    mode = request.args.get('mode', 'fuzzy')
+    if mode not in SEARCH_MODES:
+        return jsonify({'error': f'Kiểu tìm kiếm không hợp lệ, hỗ trợ: {", ".join(SEARCH_MODES)}'}), 400
+    try:
+        max_distance = request.args.get('max_distance', 1, type=int)
+        limit = min(max(1, request.args.get('limit', 50, type=int)), SEARCH_MAX_LIMIT)
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        started = time.perf_counter()
+        results = PLATE_LOG.search(request.args.get('q', ''), mode=mode, max_distance=max_distance,
+                                   since=since, until=until, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'query': request.args.get('q', ''), 'mode': mode,
+                    'took_ms': (time.perf_counter() - started) * 1000, **results})
+
+@app.route('/results/<session_id>/<name>.jpg', methods=['GET'])
+def result_image(session_id, name):
+    """Trả về một ảnh của kết quả trong bộ nhớ tạm, chỉ mã hóa JPEG khi được yêu cầu."""
+    results_data = RESULT_STORE.get(session_id)
+    if results_data is None:
+        abort(404)
+    image_np = result_image_np(results_data, name)
+    if image_np is None:
+        abort(404)
+    response = Response(ANPRSystem.encode_image(image_np), mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 @app.route('/save-results', methods=['POST'])
 def save_results():
-    """API để lưu kết quả từ bộ nhớ tạm ra file."""
+    """
+    API để lưu kết quả từ bộ nhớ tạm ra đĩa. Việc mã hóa và ghi file chạy ở nền (RESULT_WRITER):
+    trả về ngay job_id (HTTP 202), trạng thái xem tại /save-results/<job_id>.
+    Gửi kèm wait=1 để chờ đến khi dữ liệu đã được ghi bền vững.
+    """
     data = request.get_json()
     session_id = data.get('session_id')
     
-    if not session_id or session_id not in TEMP_RESULTS_STORAGE:
+    results_to_save = RESULT_STORE.get(session_id) if session_id else None
+    if results_to_save is None:
         return jsonify({'status': 'error', 'message': 'Không tìm thấy dữ liệu để lưu hoặc phiên đã hết hạn.'}), 404
 
-    try:
-        results_to_save = TEMP_RESULTS_STORAGE[session_id]
-        
-        # Tạo thư mục con trong 'results' với tên là session_id
-        session_output_dir = os.path.join(app.config['RESULT_FOLDER'], session_id)
-        os.makedirs(session_output_dir, exist_ok=True)
-
-        # Lưu ảnh kết quả chính
-        result_image_filename = "result_image_with_box.jpg"
-        result_image_path = os.path.join(session_output_dir, result_image_filename)
-        cv2.imwrite(result_image_path, results_to_save['result_image_np'])
-
-        # Lưu các ảnh biển số đã xử lý
-        for i, plate in enumerate(results_to_save['plates']):
-            text_for_filename = re.sub(r'[^A-Z0-9]', '_', plate['text'])
-            
-            cropped_filename = f"plate_{i}_{text_for_filename}_cropped.jpg"
-            cropped_path = os.path.join(session_output_dir, cropped_filename)
-            cv2.imwrite(cropped_path, plate['cropped_plate_np'])
-            
-            if plate.get('binary_plate_np') is not None:
-                binary_filename = f"plate_{i}_{text_for_filename}_binary.jpg"
-                binary_path = os.path.join(session_output_dir, binary_filename)
-                cv2.imwrite(binary_path, plate['binary_plate_np'])
-        
-        # Xóa dữ liệu khỏi bộ nhớ tạm để giải phóng tài nguyên
-        del TEMP_RESULTS_STORAGE[session_id]
-
-        return jsonify({'status': 'success', 'message': f'Kết quả đã được lưu thành công vào thư mục: results/{session_id}'})
+    # Chỉ xóa dữ liệu khỏi bộ nhớ tạm khi đã ghi xong, để client có thể thử lại nếu việc ghi thất bại
+    job_id = RESULT_WRITER.submit(session_id, results_to_save,
+                                  on_complete=lambda job: RESULT_STORE.pop(job['session_id']))
 
-    except Exception as e:
-        print(f"Lỗi khi lưu file: {e}")
-        return jsonify({'status': 'error', 'message': f'Đã xảy ra lỗi trong quá trình lưu file: {e}'}), 500
+    wait = request.args.get('wait') or data.get('wait')
+    if wait and str(wait).lower() not in ('0', 'false', 'no'):
+        return save_job_response(RESULT_WRITER.wait(job_id, timeout=SAVE_WAIT_SECONDS))
+    return jsonify({'status': 'accepted', 'job_id': job_id,
+                    'status_url': url_for('save_results_status', job_id=job_id)}), 202
+
+@app.route('/save-results/<job_id>', methods=['GET'])
+def save_results_status(job_id):
+    """Trạng thái một yêu cầu lưu: queued, encoding, writing, done (đã ghi bền vững) hoặc failed."""
+    job = RESULT_WRITER.status(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Không tìm thấy yêu cầu lưu.'}), 404
+    return save_job_response(job)
+
+def save_job_response(job):
+    if job['status'] == 'done':
+        message = f'Kết quả đã được lưu thành công vào: {job["location"]}'
+        return jsonify({**job, 'job_status': job['status'], 'status': 'success', 'message': message})
+    if job['status'] == 'failed':
+        message = f'Đã xảy ra lỗi trong quá trình lưu file: {job["error"]}'
+        return jsonify({**job, 'job_status': job['status'], 'status': 'error', 'message': message}), 500
+    return jsonify({**job, 'job_status': job['status'], 'status': 'pending'}), 202
+
+# --- Triển khai ---
+# python app.py chạy server phát triển của Flask, chỉ dùng khi phát triển. Khi triển khai, chạy app:app qua một
+# WSGI server từ thư mục anpr_web_app, ví dụ:
+#   gunicorn --workers 1 --threads 16 --timeout 120 --bind 0.0.0.0:5000 app:app     (Linux)
+#   waitress-serve --threads=16 --listen=0.0.0.0:5000 app:app                         (Windows)
+# Chỉ dùng MỘT tiến trình WSGI: việc suy luận đã chạy trong các tiến trình của WORKER_POOL (NUM_INFERENCE_WORKERS),
+# mỗi tiến trình WSGI sẽ tạo pool và tải mô hình riêng. Các luồng WSGI chỉ nhận ảnh upload và chờ kết quả, nên số
+# luồng quyết định số request chờ đồng thời (đặt lớn hơn INFERENCE_QUEUE_SIZE là không cần thiết); timeout của WSGI
+# server phải lớn hơn JOB_TIMEOUT_SECONDS. Pool và các luồng nền được khởi động ở request đầu tiên.
 
 if __name__ == '__main__':
     # Tạo thư mục results nếu chưa có
     if not os.path.exists(RESULT_FOLDER):
         os.makedirs(RESULT_FOLDER)
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    # Các worker tải mô hình ở nền (song song) trong lúc Flask bắt đầu nhận kết nối; theo dõi qua /readyz
+    pool_started = time.perf_counter()
+    WORKER_POOL.start()
+    MODEL_REGISTRY.start()
+    RESULT_WRITER.start()
+    PLATE_LOG.start()
+    print(f"[INFO] Khởi động: import app {pool_started - APP_IMPORT_STARTED:.2f}s, "
+          f"khởi động pool worker {time.perf_counter() - pool_started:.2f}s")
+    # Tắt reloader: reloader chạy module này trong một tiến trình khác và sẽ tạo thêm một pool worker
+    app.run(debug=DEBUG, host=HOST, port=PORT, use_reloader=False, threaded=True)
\ No newline at end of file
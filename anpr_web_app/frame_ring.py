@@ -0,0 +1,231 @@
+import queue
+import sys
+import threading
+import uuid
+from multiprocessing import shared_memory
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Vị trí trong slot được căn theo 64 byte (một cache line) để các mảng không dùng chung cache line
+SLOT_ALIGNMENT = 64
+
+
+class RingFullError(Exception):
+    """Mọi slot của vòng đệm đang được dùng, client nên thử lại sau."""
+
+
+class SlotDescriptor(NamedTuple):
+    """Vị trí một mảng NumPy trong vòng đệm dùng chung: chỉ vài chục byte được gửi qua pipe thay cho cả ảnh."""
+    ring: str
+    slot: int
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def _align(offset: int) -> int:
+    return (offset + SLOT_ALIGNMENT - 1) // SLOT_ALIGNMENT * SLOT_ALIGNMENT
+
+
+class FrameRing:
+    """
+    Vòng đệm ảnh trong bộ nhớ dùng chung (multiprocessing.shared_memory) giữa tiến trình nhận ảnh và các worker suy luận.
+
+    Vùng nhớ gồm num_slots slot, mỗi slot slot_bytes byte: ảnh đã giải mã nằm ở đầu slot, các ảnh biển số cắt ra
+    được worker chép vào phần còn trống phía sau. Tiến trình tạo vòng đệm (chủ sở hữu) cấp phát slot bằng acquire(),
+    ghi ảnh vào slot (hoặc giải mã thẳng vào frame_view, ví dụ cv2.VideoCapture.read(frame)), gửi SlotDescriptor
+    cho worker rồi release() khi đã dùng xong kết quả. Trong lúc đó slot thuộc về đúng một công việc, nên không cần
+    khóa giữa các tiến trình. Worker mở vòng đệm bằng attach() và đọc ảnh bằng view() không sao chép.
+
+    Mảng trả về bởi view()/frame_view() trỏ thẳng vào vùng nhớ dùng chung: chỉ hợp lệ đến khi slot được release(),
+    dùng import_result(copy=True) nếu cần giữ lâu hơn.
+    """
+
+    def __init__(self, num_slots: int = 8, slot_bytes: int = 3840 * 2160 * 3 + 4 * 1024 * 1024,
+                 name: Optional[str] = None, create: bool = True):
+        self.num_slots = num_slots
+        self.slot_bytes = _align(slot_bytes)
+        self.owner = create
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name or f"anpr_ring_{uuid.uuid4().hex[:12]}", create=True,
+                                                   size=self.num_slots * self.slot_bytes)
+        else:
+            self._shm = _attach_untracked(name)
+        self.name = self._shm.name
+        self._base_address = np.frombuffer(self._shm.buf, np.uint8, count=1).ctypes.data
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.num_slots if create else 0):
+            self._free.put(slot)
+        self._stats_lock = threading.Lock()
+        self.stats = {"writes": 0, "bytes_written": 0, "acquired": 0, "ring_full": 0}
+
+    @classmethod
+    def attach(cls, name: str, num_slots: int, slot_bytes: int) -> "FrameRing":
+        """Mở vòng đệm đã được tạo ở tiến trình khác (trong worker); dùng lại nếu tiến trình này đã mở."""
+        ring = _attached.get(name)
+        if ring is None:
+            ring = _attached[name] = cls(num_slots, slot_bytes, name=name, create=False)
+        return ring
+
+    def handle(self) -> Tuple[str, int, int]:
+        """Tham số của attach() để truyền cho tiến trình con."""
+        return self.name, self.num_slots, self.slot_bytes
+
+    # ------------------------------------------------------------------
+    # Cấp phát slot (chỉ ở tiến trình chủ sở hữu)
+    # ------------------------------------------------------------------
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """Lấy một slot rảnh, chờ tối đa timeout giây (None: không chờ); ném RingFullError nếu không có."""
+        try:
+            slot = self._free.get(block=timeout is not None, timeout=timeout)
+        except queue.Empty:
+            with self._stats_lock:
+                self.stats["ring_full"] += 1
+            raise RingFullError(f"Vòng đệm {self.name} đã hết slot ({self.num_slots}).")
+        with self._stats_lock:
+            self.stats["acquired"] += 1
+        return slot
+
+    def release(self, slot: int) -> None:
+        self._free.put(slot)
+
+    def free_slots(self) -> int:
+        return self._free.qsize()
+
+    # ------------------------------------------------------------------
+    # Đọc/ghi mảng trong slot
+    # ------------------------------------------------------------------
+    def descriptor(self, slot: int, shape: Tuple[int, ...], dtype=np.uint8, offset: int = 0) -> SlotDescriptor:
+        descriptor = SlotDescriptor(self.name, slot, offset, tuple(int(n) for n in shape), np.dtype(dtype).str)
+        if not 0 <= slot < self.num_slots or offset + descriptor.nbytes > self.slot_bytes:
+            raise ValueError(f"Mảng {shape} ({descriptor.nbytes} byte) không vừa slot {slot} "
+                             f"tại vị trí {offset} (slot {self.slot_bytes} byte)")
+        return descriptor
+
+    def view(self, descriptor: SlotDescriptor) -> np.ndarray:
+        """Mảng NumPy trỏ thẳng vào slot (không sao chép)."""
+        return np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=self._shm.buf,
+                          offset=descriptor.slot * self.slot_bytes + descriptor.offset)
+
+    def frame_view(self, slot: int, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Mảng ở đầu slot để giải mã thẳng vào (ví dụ capture.read(view)), không qua bộ nhớ trung gian."""
+        return self.view(self.descriptor(slot, shape, dtype))
+
+    def write(self, slot: int, array: np.ndarray, offset: int = 0) -> SlotDescriptor:
+        """Chép array vào slot tại offset (một lần sao chép), trả về descriptor của nó."""
+        descriptor = self.descriptor(slot, array.shape, array.dtype, offset)
+        np.copyto(self.view(descriptor), array)
+        with self._stats_lock:
+            self.stats["writes"] += 1
+            self.stats["bytes_written"] += array.nbytes
+        return descriptor
+
+    def put(self, array: np.ndarray, timeout: Optional[float] = None) -> SlotDescriptor:
+        """acquire() + write() ở đầu slot."""
+        slot = self.acquire(timeout)
+        try:
+            return self.write(slot, array)
+        except Exception:
+            self.release(slot)
+            raise
+
+    def _is_view_of(self, array: np.ndarray, descriptor: SlotDescriptor) -> bool:
+        address = self._base_address + descriptor.slot * self.slot_bytes + descriptor.offset
+        return (array.__array_interface__["data"][0] == address and array.shape == descriptor.shape
+                and array.dtype.str == descriptor.dtype)
+
+    # ------------------------------------------------------------------
+    # Chuyển kết quả của ANPRSystem
+    # ------------------------------------------------------------------
+    def export_result(self, result: dict, frame: SlotDescriptor) -> dict:
+        """
+        Trong worker: thay các mảng của một kết quả process_frames bằng descriptor. Ảnh kết quả (chính là ảnh trong
+        slot, được vẽ box tại chỗ) thành descriptor của ảnh; các ảnh biển số được chép vào phần trống sau ảnh trong
+        cùng slot. Ảnh biển số không còn chỗ được giữ nguyên và gửi qua pipe như bình thường.
+        """
+        exported = dict(result)
+        image = result.get("result_image_np")
+        if image is not None and self._is_view_of(image, frame):
+            exported["result_image_np"] = frame
+        offset = _align(frame.offset + frame.nbytes)
+        plates = []
+        for plate in result.get("plates", []):
+            crop = plate.get("cropped_plate_np")
+            if isinstance(crop, np.ndarray) and offset + crop.nbytes <= self.slot_bytes:
+                plate = {**plate, "cropped_plate_np": self.write(frame.slot, np.ascontiguousarray(crop), offset)}
+                offset = _align(offset + crop.nbytes)
+            plates.append(plate)
+        exported["plates"] = plates
+        return exported
+
+    def import_result(self, result: dict, copy: bool = False) -> dict:
+        """Ở tiến trình chủ sở hữu: thay các descriptor trong kết quả bằng mảng (view, hoặc bản sao nếu copy)."""
+        def resolve(value):
+            if isinstance(value, SlotDescriptor):
+                array = self.view(value)
+                return array.copy() if copy else array
+            return value
+
+        imported = {key: resolve(value) for key, value in result.items()}
+        if "plates" in result:
+            imported["plates"] = [{key: resolve(value) for key, value in plate.items()} for plate in result["plates"]]
+        return imported
+
+    def close(self) -> None:
+        """Đóng vùng nhớ của tiến trình này; chủ sở hữu đồng thời xóa vùng nhớ khỏi hệ thống."""
+        _attached.pop(self.name, None)
+        try:
+            self._shm.close()
+        except BufferError:
+            # Vẫn còn view trỏ vào vùng nhớ; hệ điều hành giải phóng khi tiến trình kết thúc
+            pass
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# Các vòng đệm đã mở trong tiến trình hiện tại (worker mở một lần, dùng cho mọi công việc)
+_attached: Dict[str, FrameRing] = {}
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    Mở vùng nhớ dùng chung đã có mà không để resource_tracker xóa nó khi tiến trình này dừng. Từ Python 3.13 dùng
+    track=False; trước đó, tiến trình con tạo bằng multiprocessing dùng chung resource_tracker với tiến trình cha
+    nên việc đăng ký lại không có tác dụng (không được hủy đăng ký, vì như thế là hủy luôn đăng ký của chủ sở hữu).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def resolve_frame_args(ring: FrameRing, args: tuple) -> Tuple[tuple, list]:
+    """
+    Trong worker: thay SlotDescriptor (hoặc danh sách SlotDescriptor) trong tham số của công việc bằng view vào slot.
+    Trả về (tham số mới, các descriptor theo thứ tự) để export_frame_results biết slot của từng kết quả.
+    """
+    resolved, frames = [], []
+    for arg in args:
+        if isinstance(arg, SlotDescriptor):
+            frames.append(arg)
+            resolved.append(ring.view(arg))
+        elif isinstance(arg, list) and arg and all(isinstance(item, SlotDescriptor) for item in arg):
+            frames.extend(arg)
+            resolved.append([ring.view(item) for item in arg])
+        else:
+            resolved.append(arg)
+    return tuple(resolved), frames
+
+
+def export_frame_results(ring: FrameRing, payload, frames: list):
+    """Kết quả process_frame (dict) hoặc process_frames (list) -> cùng dạng, mảng được thay bằng descriptor."""
+    if isinstance(payload, dict):
+        return ring.export_result(payload, frames[0])
+    return [ring.export_result(result, frame) for result, frame in zip(payload, frames)]
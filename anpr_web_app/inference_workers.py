@@ -0,0 +1,555 @@
+import cProfile
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class QueueFullError(Exception):
+    """Hàng đợi suy luận đã đầy, client nên thử lại sau."""
+
+
+class JobTimeoutError(Exception):
+    """Công việc không hoàn thành trong thời gian cho phép."""
+
+
+class WorkerPoolClosedError(Exception):
+    """Pool đã dừng (hoặc không còn worker nào hoạt động) nên không nhận thêm công việc."""
+
+
+class WorkerCrashedError(Exception):
+    """Worker đang xử lý công việc đã dừng bất thường (ví dụ do hết bộ nhớ)."""
+
+
+def _worker_main(worker_id: int, yolo_model_path: str, anpr_kwargs: dict, profile_options: dict,
+                 job_queue, result_queue, ring_handle: Optional[tuple] = None) -> None:
+    """
+    Vòng lặp của một tiến trình worker: tải mô hình MỘT LẦN, sau đó lần lượt lấy công việc từ hàng đợi.
+    Mỗi công việc là (job_id, thời điểm gửi, deadline, tên phương thức của ANPRSystem, tham số).
+    Khi nhận một công việc, worker báo ("started", worker_id, job_id) để pool biết công việc nào mất theo nếu
+    worker chết. Kết quả được gửi kèm phần thay đổi của metrics kể từ công việc trước.
+
+    profile_options: một tỉ lệ sample_rate công việc được chạy dưới cProfile; công việc nào chạy lâu hơn
+    slow_seconds thì ghi file .prof vào thư mục profile_dir (xem bằng snakeviz hoặc pstats).
+
+    ring_handle: vòng đệm dùng chung (frame_ring.FrameRing.handle()) của pool; tham số là SlotDescriptor được
+    thay bằng view vào slot, và các ảnh trong kết quả được ghi lại vào slot thay vì gửi qua pipe.
+    """
+    # Import bên trong tiến trình con để tiến trình Flask không phải nạp torch/easyocr
+    from anpr_core import ANPRSystem
+    from frame_ring import FrameRing, export_frame_results, resolve_frame_args
+
+    try:
+        anpr_system = ANPRSystem(yolo_model_path=yolo_model_path, **anpr_kwargs)
+        ring = FrameRing.attach(*ring_handle) if ring_handle else None
+    except Exception as e:
+        result_queue.put(("failed", worker_id, str(e)))
+        return
+    result_queue.put(("ready", worker_id, dict(anpr_system.startup_timings)))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            # Tín hiệu dừng: các công việc đứng trước đã được xử lý hết
+            break
+
+        job_id, enqueued_at, deadline, method_name, args = job
+        result_queue.put(("started", worker_id, job_id))
+        metrics = anpr_system.metrics
+        metrics.observe("anpr_queue_wait_seconds", max(0.0, time.time() - enqueued_at))
+        if deadline is not None and time.time() > deadline:
+            # Client đã hết thời gian chờ, bỏ qua để không tốn tài nguyên
+            result_queue.put(("result", job_id, "timeout", None, metrics.drain()))
+            continue
+
+        profiler = None
+        if profile_options.get("sample_rate", 0.0) > 0 and random.random() < profile_options["sample_rate"]:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            frames = []
+            if ring is not None:
+                args, frames = resolve_frame_args(ring, args)
+            status, payload = "ok", getattr(anpr_system, method_name)(*args)
+            if frames:
+                payload = export_frame_results(ring, payload, frames)
+        except Exception as e:
+            status, payload = "error", str(e)
+        elapsed = time.perf_counter() - started
+        metrics.observe("anpr_job_seconds", elapsed, method=method_name)
+
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= profile_options.get("slow_seconds", 0.0):
+                _dump_profile(profiler, profile_options.get("profile_dir", "profiles"), worker_id, method_name, elapsed)
+                metrics.inc("anpr_profiles_dumped_total")
+
+        result_queue.put(("result", job_id, status, payload, metrics.drain()))
+
+
+def _dump_profile(profiler: cProfile.Profile, profile_dir: str, worker_id: int, method_name: str,
+                  elapsed: float) -> None:
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{method_name}_{elapsed * 1000:.0f}ms_w{worker_id}.prof"
+        profiler.dump_stats(os.path.join(profile_dir, filename))
+    except OSError as e:
+        print(f"[CẢNH BÁO] Không thể ghi file profile: {e}")
+
+
+class _Generation:
+    """Một nhóm worker cùng dùng một phiên bản mô hình, có hàng đợi công việc riêng."""
+
+    def __init__(self, version: str, model_path: str, anpr_kwargs: dict, job_queue):
+        self.version = version
+        self.model_path = model_path
+        self.anpr_kwargs = anpr_kwargs
+        self.job_queue = job_queue
+        self.processes: Dict[int, Any] = {}
+        self.ready_workers = set()
+        self.failed_workers: Dict[int, str] = {}
+        self.startup_timings: Dict[int, dict] = {}
+        # loading -> active -> draining -> stopped; hoặc loading -> failed
+        self.state = "loading"
+        self.created_at = time.time()
+        self.activated_at: Optional[float] = None
+
+
+class InferenceWorkerPool:
+    """
+    Pool gồm N tiến trình worker, mỗi worker giữ một ANPRSystem riêng (YOLO + EasyOCR).
+
+    - Công việc được đưa vào một hàng đợi có giới hạn; khi đầy, submit() ném QueueFullError
+      để tầng web trả về HTTP 503 thay vì để request xếp hàng vô hạn.
+    - Mỗi công việc có thời hạn; worker bỏ qua công việc đã quá hạn.
+    - Cứ check_interval giây (dù có hay không có kết quả đang về), worker chết bất thường được khởi động lại;
+      các công việc nó đang xử lý kết thúc ngay bằng WorkerCrashedError thay vì để client chờ hết thời hạn.
+    - shutdown() ngừng nhận việc mới, chờ các worker xử lý hết hàng đợi rồi mới dừng.
+    - Nếu có metrics, thời gian từng bước và các bộ đếm đo trong worker được gộp vào đó.
+    - deploy() nạp phiên bản mô hình mới không gián đoạn: một nhóm worker mới (generation) được khởi động
+      và chạy thử ở nền; khi mọi worker mới đã sẵn sàng, công việc mới được chuyển sang nhóm mới trong
+      một thao tác, nhóm cũ xử lý nốt các công việc đã nhận rồi dừng (giải phóng bộ nhớ).
+      Nếu nhóm mới không tải được mô hình, nhóm cũ tiếp tục phục vụ.
+    - Nếu có frame_ring (frame_ring.FrameRing), frame_job() gửi ảnh đã giải mã cho worker qua bộ nhớ dùng chung:
+      chỉ descriptor của slot đi qua pipe, worker đọc ảnh và ghi ảnh kết quả ngay trong slot.
+
+    Các tiến trình được tạo bằng 'spawn' nên hoạt động giống nhau trên Windows và Linux,
+    và không kế thừa các luồng của Flask.
+    """
+
+    def __init__(self, yolo_model_path: str, num_workers: int = 2, max_queue_size: int = 32,
+                 job_timeout: float = 60.0, anpr_kwargs: Optional[dict] = None, metrics=None,
+                 profile_sample_rate: float = 0.0, profile_slow_seconds: float = 1.0,
+                 profile_dir: str = "profiles", model_version: Optional[str] = None, frame_ring=None,
+                 check_interval: float = 1.0):
+        self.yolo_model_path = yolo_model_path
+        self.frame_ring = frame_ring
+        self.model_version = model_version or os.path.basename(yolo_model_path)
+        self.anpr_kwargs = anpr_kwargs or {}
+        self.metrics = metrics
+        self.profile_options = {
+            "sample_rate": profile_sample_rate,
+            "slow_seconds": profile_slow_seconds,
+            "profile_dir": profile_dir,
+        }
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.job_timeout = job_timeout
+        self.check_interval = check_interval
+
+        self._ctx = mp.get_context("spawn")
+        self._result_queue = None
+        self._active: Optional[_Generation] = None
+        self._loading: Optional[_Generation] = None
+        self._generations: Dict[int, _Generation] = {}  # worker_id -> nhóm của worker đó
+        self._worker_ids = itertools.count()
+        self._started_at: Optional[float] = None
+        self._futures: Dict[int, Future] = {}
+        # Công việc client đã bỏ cuộc (timeout) nhưng worker có thể vẫn đang xử lý: không tính vào queue_depth,
+        # vẫn được hoàn tất khi có kết quả (để các callback như giải phóng slot của frame_job chạy)
+        self._abandoned: Dict[int, Future] = {}
+        self._running: Dict[int, int] = {}  # job_id -> worker_id đã nhận công việc
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector: Optional[threading.Thread] = None
+        self._started = False
+        self._accepting = False
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # Vòng đời
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        """Khởi động các worker (gọi nhiều lần cũng chỉ khởi động một lần)."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._started_at = time.time()
+            self._accepting = True
+            self._result_queue = self._ctx.Queue()
+            # Nhóm đầu tiên nhận công việc ngay (công việc chờ trong hàng đợi cho đến khi worker tải xong)
+            self._active = self._spawn_generation(self.model_version, self.yolo_model_path, self.anpr_kwargs)
+            self._active.state = "active"
+            self._active.activated_at = time.time()
+
+        self._collector = threading.Thread(target=self._collect_results, name="inference-collector", daemon=True)
+        self._collector.start()
+        print(f"[INFO] Đã khởi động {self.num_workers} worker suy luận (mô hình {self.model_version}).")
+
+    def shutdown(self, drain_timeout: float = 30.0) -> None:
+        """Ngừng nhận việc, chờ các worker xử lý hết công việc đang có rồi dừng."""
+        with self._lock:
+            if not self._started or self._stopping:
+                return
+            self._accepting = False
+            self._stopping = True
+            generations = {id(g): g for g in self._generations.values()}.values()
+            stops = [(g.job_queue, process) for g in generations for process in g.processes.values()]
+
+        print("[INFO] Đang dừng các worker suy luận (xử lý nốt hàng đợi)...")
+        deadline = time.time() + drain_timeout
+        for job_queue, _ in stops:
+            try:
+                job_queue.put(None, timeout=max(0.0, deadline - time.time()))
+            except queue.Full:
+                break
+
+        processes = [process for _, process in stops]
+        for process in processes:
+            process.join(timeout=max(0.0, deadline - time.time()))
+        for process in processes:
+            if process.is_alive():
+                print(f"[CẢNH BÁO] Worker {process.name} không dừng kịp, buộc kết thúc.")
+                process.terminate()
+                process.join(timeout=5)
+
+        if self._collector is not None:
+            self._collector.join(timeout=5)
+        self._fail_pending(WorkerPoolClosedError("Pool suy luận đã dừng."))
+        print("[INFO] Các worker suy luận đã dừng.")
+
+    def deploy(self, model_path: str, version: str) -> bool:
+        """
+        Bắt đầu nạp phiên bản mô hình mới ở nền (xem mô tả lớp). Trả về False nếu pool chưa chạy
+        hoặc đang có một phiên bản khác được nạp.
+        """
+        with self._lock:
+            if not self._started or self._stopping or self._loading is not None:
+                return False
+            # Luôn chạy thử mô hình mới trước khi chuyển công việc sang, để request đầu tiên không bị chậm
+            anpr_kwargs = {**self.anpr_kwargs, "warmup": True}
+            self._loading = self._spawn_generation(version, model_path, anpr_kwargs)
+        print(f"[INFO] Đang nạp mô hình {version} ({model_path}) trên {self.num_workers} worker mới...")
+        return True
+
+    # ------------------------------------------------------------------
+    # Gửi công việc
+    # ------------------------------------------------------------------
+    def submit(self, method_name: str, *args, timeout: Optional[float] = None) -> Future:
+        """
+        Đưa một công việc (gọi phương thức method_name của ANPRSystem) vào hàng đợi của nhóm worker
+        đang hoạt động. Không chặn: ném QueueFullError nếu hàng đợi đã đầy.
+        """
+        if not self._accepting:
+            raise WorkerPoolClosedError("Pool suy luận không nhận thêm công việc.")
+
+        timeout = self.job_timeout if timeout is None else timeout
+        future = Future()
+        with self._lock:
+            generation = self._active
+            if generation.failed_workers and len(generation.failed_workers) == self.num_workers:
+                raise WorkerPoolClosedError("Không có worker suy luận nào hoạt động.")
+            job_id = next(self._job_ids)
+            try:
+                # Gửi trong khóa để không công việc nào lọt vào hàng đợi của nhóm cũ sau khi đã chuyển nhóm
+                now = time.time()
+                generation.job_queue.put_nowait((job_id, now, now + timeout, method_name, args))
+            except queue.Full:
+                raise QueueFullError("Hàng đợi suy luận đã đầy.")
+            self._futures[job_id] = future
+        future.job_id = job_id
+        return future
+
+    def run(self, method_name: str, *args, timeout: Optional[float] = None) -> Any:
+        """Gửi công việc và chờ kết quả, ném JobTimeoutError nếu quá thời gian."""
+        timeout = self.job_timeout if timeout is None else timeout
+        future = self.submit(method_name, *args, timeout=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._give_up(future)
+            raise JobTimeoutError(f"Công việc không hoàn thành sau {timeout:.0f} giây.")
+
+    @contextmanager
+    def frame_job(self, frames: list, batch_size: int = 16, annotate: bool = True, timeout: Optional[float] = None):
+        """
+        Chạy ANPRSystem.process_frames trên worker qua frame_ring, không sao chép ảnh qua pipe.
+        frames: ảnh BGR (được chép một lần vào slot) hoặc SlotDescriptor của ảnh đã được ghi sẵn vào slot
+        (ví dụ giải mã thẳng vào FrameRing.frame_view; slot đó vẫn do bên gọi giải phóng).
+        Trả về (qua with) danh sách kết quả như process_frames, mảng là view vào slot: chỉ hợp lệ trong khối with,
+        slot được giải phóng khi ra khỏi khối. Ném RingFullError nếu hết slot, như QueueFullError khi hàng đợi đầy.
+        """
+        from frame_ring import SlotDescriptor
+
+        if self.frame_ring is None:
+            raise RuntimeError("Pool không có frame_ring.")
+        ring = self.frame_ring
+        timeout = self.job_timeout if timeout is None else timeout
+        acquired = []
+        future = None
+
+        def release(_=None):
+            for slot in acquired:
+                ring.release(slot)
+
+        try:
+            descriptors = []
+            for frame in frames:
+                if isinstance(frame, SlotDescriptor):
+                    descriptors.append(frame)
+                    continue
+                slot = ring.acquire()
+                acquired.append(slot)
+                descriptors.append(ring.write(slot, frame))
+            future = self.submit('process_frames', descriptors, batch_size, annotate, timeout=timeout)
+            try:
+                results = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                self._give_up(future)
+                raise JobTimeoutError(f"Công việc không hoàn thành sau {timeout:.0f} giây.")
+            yield [ring.import_result(result) for result in results]
+        finally:
+            if future is not None and not future.done():
+                # Worker có thể vẫn đang ghi vào slot: chỉ giải phóng khi công việc kết thúc, bị bỏ qua vì quá hạn,
+                # hoặc worker nhận nó đã chết (_check_workers)
+                future.add_done_callback(release)
+            else:
+                release()
+
+    # ------------------------------------------------------------------
+    # Trạng thái
+    # ------------------------------------------------------------------
+    def queue_depth(self) -> int:
+        """Số công việc đã gửi nhưng chưa có kết quả (đang chờ hoặc đang xử lý)."""
+        with self._lock:
+            return len(self._futures)
+
+    def ready_workers(self) -> int:
+        with self._lock:
+            return len(self._active.ready_workers) if self._active is not None else 0
+
+    def active_version(self) -> Optional[str]:
+        with self._lock:
+            return self._active.version if self._active is not None else None
+
+    def status(self) -> dict:
+        with self._lock:
+            active = self._active
+            return {
+                "workers": self.num_workers,
+                "model_version": active.version if active else None,
+                "ready_workers": len(active.ready_workers) if active else 0,
+                "failed_workers": dict(active.failed_workers) if active else {},
+                "startup_timings": dict(active.startup_timings) if active else {},
+                "loading_version": self._loading.version if self._loading else None,
+                "queue_depth": len(self._futures),
+                "max_queue_size": self.max_queue_size,
+                "accepting": self._accepting,
+            }
+
+    def generations(self) -> List[dict]:
+        """Các phiên bản mô hình đang nạp, đang hoạt động hoặc đang xử lý nốt, kèm PID của từng worker."""
+        with self._lock:
+            generations = list({id(g): g for g in self._generations.values()}.values())
+            return [{
+                "version": g.version,
+                "model_path": g.model_path,
+                "state": g.state,
+                "created_at": g.created_at,
+                "activated_at": g.activated_at,
+                "workers": [{"worker_id": worker_id, "pid": process.pid, "alive": process.is_alive(),
+                             "ready": worker_id in g.ready_workers, "error": g.failed_workers.get(worker_id)}
+                            for worker_id, process in g.processes.items()],
+            } for g in generations]
+
+    # ------------------------------------------------------------------
+    # Nội bộ
+    # ------------------------------------------------------------------
+    def _spawn_generation(self, version: str, model_path: str, anpr_kwargs: dict) -> _Generation:
+        """Tạo một nhóm worker mới (gọi khi đang giữ khóa)."""
+        generation = _Generation(version, model_path, anpr_kwargs, self._ctx.Queue(maxsize=self.max_queue_size))
+        for _ in range(self.num_workers):
+            self._spawn_worker(generation, next(self._worker_ids))
+        return generation
+
+    def _spawn_worker(self, generation: _Generation, worker_id: int) -> None:
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, generation.model_path, generation.anpr_kwargs, self.profile_options,
+                  generation.job_queue, self._result_queue,
+                  self.frame_ring.handle() if self.frame_ring is not None else None),
+            name=f"anpr-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        generation.processes[worker_id] = process
+        self._generations[worker_id] = generation
+
+    def _activate(self, generation: _Generation) -> None:
+        """Chuyển công việc mới sang nhóm vừa nạp xong, cho nhóm cũ xử lý nốt rồi dừng."""
+        with self._lock:
+            old, self._active, self._loading = self._active, generation, None
+            generation.state = "active"
+            generation.activated_at = time.time()
+            old.state = "draining"
+            stops = len(old.processes)
+        print(f"[INFO] Đã chuyển sang mô hình {generation.version}; mô hình {old.version} xử lý nốt hàng đợi rồi dừng.")
+        threading.Thread(target=self._drain, args=(old, stops), name="inference-drain", daemon=True).start()
+
+    def _drain(self, generation: _Generation, stops: int) -> None:
+        # Tín hiệu dừng nằm sau mọi công việc đã gửi vào hàng đợi cũ, nên các công việc đó vẫn được xử lý
+        for _ in range(stops):
+            generation.job_queue.put(None)
+        for process in list(generation.processes.values()):
+            process.join()
+        with self._lock:
+            generation.state = "stopped"
+            for worker_id in generation.processes:
+                self._generations.pop(worker_id, None)
+        print(f"[INFO] Mô hình {generation.version} đã được giải phóng.")
+
+    def _abandon(self, generation: _Generation) -> None:
+        """Hủy nhóm đang nạp bị lỗi, nhóm đang hoạt động tiếp tục phục vụ."""
+        with self._lock:
+            generation.state = "failed"
+            if self._loading is generation:
+                self._loading = None
+            processes = list(generation.processes.items())
+            for worker_id, _ in processes:
+                self._generations.pop(worker_id, None)
+        for _, process in processes:
+            if process.is_alive():
+                process.terminate()
+        print(f"[LỖI] Không thể nạp mô hình {generation.version}, tiếp tục dùng mô hình hiện tại.")
+
+    def _collect_results(self) -> None:
+        """
+        Luồng nền: nhận kết quả từ các worker và hoàn tất Future tương ứng. Việc kiểm tra worker còn sống chạy
+        theo chu kỳ check_interval, kể cả khi các worker khác liên tục gửi kết quả về.
+        """
+        next_check = time.monotonic() + self.check_interval
+        while True:
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + self.check_interval
+            try:
+                message = self._result_queue.get(timeout=max(0.0, next_check - time.monotonic()))
+            except queue.Empty:
+                if self._stopping and not any(p.is_alive() for g in list(self._generations.values())
+                                              for p in g.processes.values()):
+                    return
+                continue
+
+            kind = message[0]
+            if kind == "started":
+                with self._lock:
+                    if message[2] in self._futures or message[2] in self._abandoned:
+                        self._running[message[2]] = message[1]
+                continue
+            if kind in ("ready", "failed"):
+                with self._lock:
+                    generation = self._generations.get(message[1])
+                if generation is None:
+                    continue
+            if kind == "ready":
+                timings = dict(message[2] or {})
+                timings["since_pool_start"] = time.time() - self._started_at
+                with self._lock:
+                    generation.ready_workers.add(message[1])
+                    generation.startup_timings[message[1]] = timings
+                    activate = (generation is self._loading
+                                and len(generation.ready_workers) == len(generation.processes))
+                phases = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
+                print(f"[INFO] Worker {message[1]} ({generation.version}) đã sẵn sàng ({phases}).")
+                if activate:
+                    self._activate(generation)
+            elif kind == "failed":
+                with self._lock:
+                    generation.failed_workers[message[1]] = message[2]
+                    all_failed = len(generation.failed_workers) == self.num_workers
+                    loading = generation is self._loading
+                print(f"[LỖI NGHIÊM TRỌNG] Worker {message[1]} không thể tải mô hình {generation.version}: {message[2]}")
+                if loading:
+                    self._abandon(generation)
+                elif all_failed:
+                    self._fail_pending(WorkerPoolClosedError("Không có worker suy luận nào hoạt động."))
+            elif kind == "result":
+                _, job_id, status, payload, metrics_delta = message
+                if self.metrics is not None:
+                    self.metrics.merge(metrics_delta)
+                with self._lock:
+                    self._running.pop(job_id, None)
+                    future = self._futures.pop(job_id, None) or self._abandoned.pop(job_id, None)
+                if future is None or future.done():
+                    continue
+                if status == "ok":
+                    future.set_result(payload)
+                elif status == "timeout":
+                    future.set_exception(JobTimeoutError("Công việc đã quá hạn trước khi được xử lý."))
+                else:
+                    future.set_exception(RuntimeError(payload))
+
+    def _give_up(self, future: Future) -> None:
+        """Client thôi chờ công việc: không tính vào queue_depth nữa, nhưng Future vẫn được hoàn tất sau đó."""
+        with self._lock:
+            if self._futures.pop(future.job_id, None) is not None and not future.done():
+                self._abandoned[future.job_id] = future
+
+    def _check_workers(self) -> None:
+        """
+        Khởi động lại worker bị chết bất thường (ví dụ do hết bộ nhớ) của nhóm đang hoạt động hoặc đang nạp,
+        và kết thúc các công việc worker đó đang xử lý bằng WorkerCrashedError.
+        """
+        orphaned = []
+        with self._lock:
+            if self._stopping:
+                return
+            for generation in (self._active, self._loading):
+                if generation is None:
+                    continue
+                for worker_id, process in list(generation.processes.items()):
+                    if process.is_alive() or worker_id in generation.failed_workers:
+                        continue
+                    print(f"[CẢNH BÁO] Worker {worker_id} đã dừng bất thường (exit code {process.exitcode}), "
+                          f"khởi động lại.")
+                    generation.ready_workers.discard(worker_id)
+                    del generation.processes[worker_id]
+                    self._generations.pop(worker_id, None)
+                    self._spawn_worker(generation, next(self._worker_ids))
+                    for job_id in [j for j, w in self._running.items() if w == worker_id]:
+                        del self._running[job_id]
+                        future = self._futures.pop(job_id, None) or self._abandoned.pop(job_id, None)
+                        if future is not None:
+                            orphaned.append((worker_id, process.exitcode, future))
+        for worker_id, exitcode, future in orphaned:
+            if not future.done():
+                future.set_exception(WorkerCrashedError(
+                    f"Worker {worker_id} đã dừng bất thường (exit code {exitcode}) khi đang xử lý công việc."))
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            futures = list(self._futures.values()) + list(self._abandoned.values())
+            self._futures.clear()
+            self._abandoned.clear()
+            self._running.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
@@ -0,0 +1,185 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# Ngưỡng (giây) của histogram độ trễ, đủ chi tiết cho cả bước rẻ (định dạng) lẫn bước đắt (OCR)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Histogram không đo thời gian dùng ngưỡng riêng
+HISTOGRAM_BUCKETS = {
+    "anpr_plates_per_image": (0, 1, 2, 3, 5, 10, 20),
+}
+
+METRIC_HELP = {
+    "anpr_stage_seconds": "Thời gian từng bước của pipeline (decode, detection, layout, preprocessing, ocr, formatting).",
+    "anpr_plates_per_image": "Số biển số phát hiện được trên mỗi ảnh.",
+    "anpr_images_total": "Số ảnh đã xử lý, theo kết quả giải mã.",
+    "anpr_plates_total": "Số vùng biển số đã OCR, theo kết quả (ok, na, rejected).",
+    "anpr_ocr_cache_lookups_total": "Số lần tra cache OCR, theo kết quả (hit, miss).",
+    "anpr_ocr_errors_total": "Số lần EasyOCR ném lỗi.",
+    "anpr_ocr_tier_total": "Số biển số được đọc ở từng bậc OCR (fast, enhanced, full).",
+    "anpr_ocr_tier_seconds": "Thời gian chạy một bậc OCR cho một biển số (kể cả khi bậc đó không được chấp nhận).",
+    "anpr_model_lock_wait_seconds": "Thời gian chờ khóa mô hình (detector, reader) khi nhiều luồng dùng chung một ANPRSystem.",
+    "anpr_tiles_total": "Số tile của chế độ phát hiện theo tile, theo kết quả (run, skipped).",
+    "anpr_job_seconds": "Thời gian xử lý một công việc trong worker, theo phương thức.",
+    "anpr_queue_wait_seconds": "Thời gian công việc chờ trong hàng đợi trước khi worker nhận.",
+    "anpr_profiles_dumped_total": "Số file cProfile đã ghi cho các công việc chậm.",
+    "anpr_http_request_seconds": "Thời gian xử lý request HTTP, theo endpoint.",
+    "anpr_http_requests_total": "Số request HTTP, theo endpoint và mã trạng thái.",
+    "anpr_queue_depth": "Số công việc đang chờ hoặc đang xử lý trong pool suy luận.",
+    "anpr_ready_workers": "Số worker suy luận đã tải xong mô hình.",
+    "anpr_result_store_entries": "Số kết quả trong bộ nhớ tạm (RAM và đĩa).",
+    "anpr_result_store_resident_bytes": "Dung lượng RAM của bộ nhớ tạm kết quả.",
+    "anpr_result_store_spilled_bytes": "Dung lượng đĩa của bộ nhớ tạm kết quả.",
+    "anpr_save_queue_depth": "Số yêu cầu /save-results đang chờ ghi.",
+    "anpr_plate_log_queue_depth": "Số lần đọc biển số đang chờ ghi vào nhật ký.",
+    "anpr_plate_log_dropped_total": "Số lần đọc biển số bị bỏ vì hàng đợi nhật ký đầy.",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, LabelKey]
+
+
+def _labels_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    escaped = []
+    for k, v in items:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Bộ đếm và histogram kiểu Prometheus, chi phí thấp (một lần khóa cho mỗi lần ghi).
+
+    Trong tiến trình worker, drain() lấy phần thay đổi kể từ lần gọi trước để gửi kèm kết quả công việc;
+    tiến trình web merge() các phần thay đổi đó và render() ra định dạng text của Prometheus.
+
+    keep_samples=True giữ thêm từng giá trị của histogram (ví dụ cho benchmark_anpr.py cần phân vị chính xác);
+    mặc định tắt để bộ nhớ không tăng theo số lần ghi. render() không dùng các giá trị này.
+    """
+
+    def __init__(self, keep_samples: bool = False):
+        self._lock = threading.Lock()
+        self.keep_samples = keep_samples
+        self._counters: Dict[MetricKey, float] = {}
+        # key -> [số đếm theo từng ngưỡng, tổng, số lần]
+        self._histograms: Dict[MetricKey, list] = {}
+        # key -> các giá trị đã ghi (chỉ khi keep_samples)
+        self._samples: Dict[MetricKey, List[float]] = {}
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+            if self.keep_samples:
+                self._samples.setdefault(key, []).append(value)
+
+    @contextmanager
+    def time(self, name: str, **labels) -> Iterator[None]:
+        """Đo thời gian một khối lệnh vào histogram name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # ------------------------------------------------------------------
+    # Chuyển giữa các tiến trình
+    # ------------------------------------------------------------------
+    def drain(self) -> dict:
+        """Trả về và xóa toàn bộ giá trị hiện có (dạng dict picklable, gửi được qua multiprocessing.Queue)."""
+        with self._lock:
+            delta = {"counters": self._counters, "histograms": self._histograms, "samples": self._samples}
+            self._counters, self._histograms, self._samples = {}, {}, {}
+        return delta
+
+    def merge(self, delta: dict) -> None:
+        with self._lock:
+            for key, value in delta.get("counters", {}).items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (bucket_counts, total, count) in delta.get("histograms", {}).items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    self._histograms[key] = [list(bucket_counts), total, count]
+                    continue
+                histogram[0] = [a + b for a, b in zip(histogram[0], bucket_counts)]
+                histogram[1] += total
+                histogram[2] += count
+            if self.keep_samples:
+                for key, values in delta.get("samples", {}).items():
+                    self._samples.setdefault(key, []).extend(values)
+
+    # ------------------------------------------------------------------
+    # Xuất
+    # ------------------------------------------------------------------
+    def render(self, gauges: Dict[str, Callable[[], float]] = None) -> str:
+        """Định dạng text của Prometheus. gauges: tên -> hàm trả về giá trị hiện tại."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: [list(h[0]), h[1], h[2]] for key, h in self._histograms.items()}
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {count}')
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name, read_value in (gauges or {}).items():
+            try:
+                value = read_value()
+            except Exception:
+                continue
+            declare(name, "gauge")
+            lines.append(f"{name} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,241 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# Đuôi file mô hình theo backend phát hiện (xem anpr_core.DETECTOR_BACKENDS)
+MODEL_EXTENSIONS = {'ultralytics': ('.pt',), 'onnx': ('.onnx',)}
+# Thông tin đi kèm một file mô hình (ví dụ imgsz mà mô hình được chọn để chạy): file .json cùng tên,
+# không bị quét như một phiên bản mô hình
+METADATA_EXTENSION = '.json'
+
+
+def list_model_versions(models_dir: str, backend: str = 'ultralytics') -> List[dict]:
+    """
+    Các phiên bản mô hình trong models_dir, cũ trước mới sau (theo thời điểm sửa file).
+    Một phiên bản là một file mô hình nằm ngay trong models_dir (models/<phiên bản>.pt) hoặc trong thư mục
+    con (models/<phiên bản>/best.pt); tên phiên bản là đường dẫn tương đối, bỏ đuôi file.
+    """
+    extensions = MODEL_EXTENSIONS[backend]
+    versions = []
+    if not os.path.isdir(models_dir):
+        return versions
+    for entry in os.scandir(models_dir):
+        if entry.name.startswith('.'):
+            continue
+        candidates = [entry] if entry.is_file() else (
+            [e for e in os.scandir(entry.path) if e.is_file()] if entry.is_dir() else [])
+        for candidate in candidates:
+            if candidate.name.startswith('.') or not candidate.name.endswith(extensions):
+                continue
+            stat = candidate.stat()
+            relative = os.path.relpath(candidate.path, models_dir)
+            versions.append({
+                "version": os.path.splitext(relative)[0].replace(os.sep, '/'),
+                "path": candidate.path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            })
+    versions.sort(key=lambda v: (v["mtime"], v["version"]))
+    return versions
+
+
+def metadata_path_for(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + METADATA_EXTENSION
+
+
+def read_model_metadata(model_path: str) -> dict:
+    """Thông tin đi kèm file mô hình (rỗng nếu không có hoặc không đọc được)."""
+    try:
+        with open(metadata_path_for(model_path), encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def write_model_metadata(model_path: str, metadata: dict) -> str:
+    path = metadata_path_for(model_path)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def publish_model(source_path: str, models_dir: str, version: Optional[str] = None,
+                  metadata: Optional[dict] = None) -> str:
+    """
+    Đưa một file mô hình (ví dụ best.pt vừa huấn luyện) vào models_dir để server nạp tự động.
+    File được sao chép vào file tạm (tên bắt đầu bằng '.', bị bỏ qua khi quét) rồi đổi tên một lần,
+    nên server không bao giờ thấy file chép dở. metadata (ví dụ {"imgsz": 480}) được ghi trước file mô hình,
+    nên khi server thấy mô hình thì thông tin đi kèm đã có. Trả về đường dẫn file đã đưa vào.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    extension = os.path.splitext(source_path)[1]
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    final_path = os.path.join(models_dir, f"{version}{extension}")
+    if metadata:
+        write_model_metadata(final_path, metadata)
+    tmp_path = os.path.join(models_dir, f".{version}.{uuid.uuid4().hex}{extension}.tmp")
+    try:
+        shutil.copyfile(source_path, tmp_path)
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return final_path
+
+
+def select_sweep_candidate(summary_path: str, latency_budget_ms: float, backend: str = 'ultralytics',
+                           latency_key: str = 'p95_ms') -> Optional[dict]:
+    """
+    Chọn mô hình từ file tổng kết của model_sweep.py: trong các ứng viên trên biên Pareto (độ chính xác theo
+    độ trễ) của backend, ứng viên chính xác nhất có độ trễ latency_key <= latency_budget_ms; nếu không ứng viên
+    nào đủ nhanh thì chọn ứng viên nhanh nhất. Trả về mục của ứng viên (weights, imgsz, ...) hoặc None.
+    """
+    try:
+        with open(summary_path, encoding="utf-8") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    metric = summary.get("metric", "map50_95")
+    frontier = [c for c in summary.get("candidates", [])
+                if c.get("pareto") and c.get("backend") == backend and os.path.exists(c.get("weights", ""))]
+    if not frontier:
+        return None
+    within = [c for c in frontier if c["latency"][latency_key] <= latency_budget_ms]
+    if within:
+        return max(within, key=lambda c: c[metric])
+    return min(frontier, key=lambda c: c["latency"][latency_key])
+
+
+def process_memory_bytes(pid: Optional[int]) -> Optional[int]:
+    """RSS (byte) của một tiến trình: dùng psutil nếu có, nếu không đọc /proc (Linux); None nếu không xác định được."""
+    if pid is None:
+        return None
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Theo dõi thư mục mô hình và nạp phiên bản mới nhất vào pool worker mà không dừng server.
+
+    Một luồng nền quét models_dir mỗi poll_interval giây. Khi có file mô hình mới hơn phiên bản đang chạy
+    và file đã đứng yên (kích thước, thời điểm sửa không đổi) ít nhất settle_seconds, pool.deploy() được gọi:
+    worker mới tải và chạy thử mô hình ở nền, rồi công việc mới được chuyển sang (xem InferenceWorkerPool).
+    Phiên bản nạp lỗi không được thử lại cho đến khi file thay đổi.
+    """
+
+    def __init__(self, pool, models_dir: str, backend: str = 'ultralytics', poll_interval: float = 5.0,
+                 settle_seconds: float = 2.0):
+        self.pool = pool
+        self.models_dir = models_dir
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._seen: Dict[str, tuple] = {}  # phiên bản -> (kích thước, mtime, lần đầu thấy)
+        self._attempted: Dict[str, tuple] = {}  # phiên bản -> (kích thước, mtime) đã gửi cho pool
+        self.history: List[dict] = []
+
+    def latest_version(self) -> Optional[dict]:
+        versions = list_model_versions(self.models_dir, self.backend)
+        return versions[-1] if versions else None
+
+    # ------------------------------------------------------------------
+    # Vòng đời
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=self.poll_interval + 1)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[CẢNH BÁO] Lỗi khi quét thư mục mô hình {self.models_dir}: {e}")
+
+    # ------------------------------------------------------------------
+    # Nạp phiên bản
+    # ------------------------------------------------------------------
+    def poll(self) -> Optional[str]:
+        """Quét một lần; nạp phiên bản mới nhất nếu cần. Trả về tên phiên bản bắt đầu nạp (nếu có)."""
+        latest = self.latest_version()
+        if latest is None or latest["version"] == self.pool.active_version():
+            return None
+        signature = (latest["size"], latest["mtime"])
+        if self._attempted.get(latest["version"]) == signature:
+            return None
+        seen = self._seen.get(latest["version"])
+        now = time.time()
+        if seen is None or seen[:2] != signature:
+            self._seen[latest["version"]] = signature + (now,)
+            return None
+        if now - seen[2] < self.settle_seconds:
+            return None
+        return self._deploy(latest)
+
+    def reload(self, version: Optional[str] = None) -> Optional[str]:
+        """Nạp ngay một phiên bản cụ thể (ví dụ để quay lại bản cũ) hoặc phiên bản mới nhất."""
+        versions = list_model_versions(self.models_dir, self.backend)
+        if version is not None:
+            versions = [v for v in versions if v["version"] == version]
+        if not versions:
+            raise ValueError(f"Không tìm thấy phiên bản mô hình: {version or '(thư mục trống)'}")
+        return self._deploy(versions[-1])
+
+    def _deploy(self, entry: dict) -> Optional[str]:
+        if not self.pool.deploy(entry["path"], entry["version"]):
+            return None
+        self._attempted[entry["version"]] = (entry["size"], entry["mtime"])
+        self.history.append({"version": entry["version"], "path": entry["path"], "requested_at": time.time()})
+        del self.history[:-20]
+        return entry["version"]
+
+    # ------------------------------------------------------------------
+    # Trạng thái
+    # ------------------------------------------------------------------
+    def status(self) -> dict:
+        generations = self.pool.generations()
+        for generation in generations:
+            for worker in generation["workers"]:
+                worker["memory_bytes"] = process_memory_bytes(worker["pid"]) if worker["alive"] else None
+            generation["memory_bytes"] = sum(w["memory_bytes"] or 0 for w in generation["workers"])
+        return {
+            "models_dir": os.path.abspath(self.models_dir),
+            "active_version": self.pool.active_version(),
+            "generations": generations,
+            "available": list_model_versions(self.models_dir, self.backend),
+            "history": list(self.history),
+        }
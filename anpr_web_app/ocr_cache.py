@@ -0,0 +1,217 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+HASH_WIDTH = 16
+HASH_HEIGHT = 8
+HASH_BITS = HASH_WIDTH * HASH_HEIGHT
+
+
+def plate_hash(image: np.ndarray) -> int:
+    """
+    Perceptual hash (dHash, 128 bit) của ảnh biển số: so sánh độ sáng giữa các điểm ảnh kề nhau
+    trên ảnh xám thu nhỏ 17x8. Hai ảnh gần giống nhau (khác độ sáng, nhiễu, xê dịch nhẹ) cho hash gần nhau.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_WIDTH + 1, HASH_HEIGHT), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PlateKey(NamedTuple):
+    """Khóa cache của một ảnh biển số: digest chính xác của điểm ảnh và perceptual hash (chỉ dùng trong một track)."""
+    digest: bytes
+    phash: int
+
+
+def plate_key(image: np.ndarray) -> PlateKey:
+    digest = hashlib.blake2b(repr((image.shape, image.dtype.str)).encode("ascii"), digest_size=16)
+    digest.update(np.ascontiguousarray(image).data)
+    return PlateKey(digest.digest(), plate_hash(image))
+
+
+class OcrCache:
+    """
+    Cache kết quả OCR của ảnh biển số.
+
+    - Giữa các ảnh không liên quan (các lần upload khác nhau), kết quả chỉ được dùng lại khi ảnh biển số trùng
+      khớp từng điểm ảnh (theo digest). Perceptual hash không đủ để phân biệt: hai biển số chỉ khác một chữ số
+      (51F-123.45 và 51F-123.46) có hash chỉ cách nhau 1-3 bit.
+    - Trong cùng một phạm vi (scope, ví dụ track id của stream_pipeline, tức chắc chắn là cùng một xe), ảnh có
+      hash cách một lần đọc trước của phạm vi đó không quá max_distance bit được coi là cùng biển số.
+      Mỗi phạm vi chỉ giữ max_per_scope lần đọc gần nhất nên việc so sánh tuyến tính là đủ nhanh.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_distance: int = 5, max_scopes: int = 256,
+                 max_per_scope: int = 8):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.max_scopes = max_scopes
+        self.max_per_scope = max_per_scope
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()
+        # scope -> các (perceptual hash, giá trị) gần nhất của phạm vi đó
+        self._scopes: "OrderedDict[Hashable, List[Tuple[int, Any]]]" = OrderedDict()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: PlateKey, scope: Optional[Hashable] = None) -> Tuple[bool, Any]:
+        """Trả về (tìm thấy, giá trị). Giá trị có thể là None (vùng ảnh đã bị loại vì không phải biển số)."""
+        with self._lock:
+            if key.digest in self._entries:
+                self._entries.move_to_end(key.digest)
+                self.hits += 1
+                return True, self._entries[key.digest]
+
+            reads = self._scopes.get(scope) if scope is not None else None
+            if reads:
+                distance, value = min(((hamming_distance(key.phash, phash), value) for phash, value in reads),
+                                      key=lambda item: item[0])
+                if distance <= self.max_distance:
+                    self._scopes.move_to_end(scope)
+                    self.hits += 1
+                    self.near_hits += 1
+                    return True, value
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key: PlateKey, value: Any, scope: Optional[Hashable] = None) -> None:
+        with self._lock:
+            self._entries[key.digest] = value
+            self._entries.move_to_end(key.digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            if scope is None:
+                return
+            reads = self._scopes.setdefault(scope, [])
+            self._scopes.move_to_end(scope)
+            reads.append((key.phash, value))
+            del reads[:-self.max_per_scope]
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def drop_scope(self, scope: Hashable) -> None:
+        """Xóa các lần đọc của một phạm vi (ví dụ khi track kết thúc)."""
+        with self._lock:
+            self._scopes.pop(scope, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "scopes": len(self._scopes),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class PlateVoter:
+    """
+    Bỏ phiếu theo từng ký tự, có trọng số là độ tin cậy OCR, cho nhiều lần đọc của cùng một biển số
+    (ví dụ các khung hình của cùng một track). Chỉ các lần đọc có độ dài phổ biến nhất (theo tổng trọng số)
+    được dùng để bỏ phiếu, tránh lệch vị trí ký tự khi OCR thừa/thiếu ký tự.
+    """
+
+    def __init__(self):
+        self.reads: List[Tuple[str, float]] = []
+
+    def add(self, text: Optional[str], confidence: float) -> None:
+        if text and text != "N/A":
+            self.reads.append((text, max(confidence, 1e-3)))
+
+    def __len__(self) -> int:
+        return len(self.reads)
+
+    def result(self) -> Tuple[Optional[str], float]:
+        """Trả về (chuỗi sau bỏ phiếu, mức đồng thuận 0..1)."""
+        if not self.reads:
+            return None, 0.0
+
+        weight_by_length: Dict[int, float] = {}
+        for text, weight in self.reads:
+            weight_by_length[len(text)] = weight_by_length.get(len(text), 0.0) + weight
+        length = max(weight_by_length, key=weight_by_length.get)
+        reads = [(text, weight) for text, weight in self.reads if len(text) == length]
+        total = sum(weight for _, weight in reads)
+
+        chars = []
+        agreement = 0.0
+        for position in range(length):
+            votes: Dict[str, float] = {}
+            for text, weight in reads:
+                votes[text[position]] = votes.get(text[position], 0.0) + weight
+            best = max(votes, key=votes.get)
+            chars.append(best)
+            agreement += votes[best] / total
+        return "".join(chars), agreement / length
+
+
+# ==============================================================================
+# Kiểm tra hồi quy: python ocr_cache.py
+# Hai biển số chỉ khác một ký tự không bao giờ được dùng chung kết quả cache (giữa các lần upload, giữa các track).
+# ==============================================================================
+
+if __name__ == "__main__":
+    import sys
+
+    def render_plate(text: str) -> np.ndarray:
+        image = np.full((60, 240, 3), 235, np.uint8)
+        cv2.rectangle(image, (2, 2), (237, 57), (20, 20, 20), 2)
+        cv2.putText(image, text, (12, 42), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (20, 20, 20), 2, cv2.LINE_AA)
+        return image
+
+    def reencode(image: np.ndarray) -> np.ndarray:
+        return cv2.imdecode(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_COLOR)
+
+    pairs = [("51F-123.45", "51F-123.46"), ("30A-999.99", "30A-999.98"), ("51F-123.45", "59F-123.45"),
+             ("29C-111.11", "29C-111.17"), ("43A-808.08", "43A-806.08")]
+    failures = []
+    for first, second in pairs:
+        a, b = plate_key(render_plate(first)), plate_key(render_plate(second))
+        distance = hamming_distance(a.phash, b.phash)
+        cases = {"upload": (None, None), "track khác nhau": ("track-1", "track-2")}
+        for name, (scope_a, scope_b) in cases.items():
+            cache = OcrCache()
+            cache.put(a, (first, 0.9), scope_a)
+            found, value = cache.get(b, scope_b)
+            if found:
+                failures.append(f"{second} dùng lại kết quả {value} của {first} ({name}, hash cách {distance} bit)")
+        print(f"[INFO] {first} / {second}: hash cách {distance} bit")
+
+    # Cùng ảnh thì luôn dùng lại; cùng biển số được nén lại (khung hình sau của cùng track) dùng lại trong track
+    cache = OcrCache()
+    image = render_plate("51F-123.45")
+    cache.put(plate_key(image), ("51F-123.45", 0.9), "track-1")
+    if not cache.get(plate_key(image.copy()))[0]:
+        failures.append("Ảnh trùng khớp không dùng lại được kết quả cache")
+    near = plate_key(reencode(image))
+    print(f"[INFO] Cùng biển số sau khi nén JPEG, cùng track: tìm thấy = {cache.get(near, 'track-1')[0]}; "
+          f"upload khác: tìm thấy = {cache.get(near)[0]}")
+
+    for failure in failures:
+        print(f"[LỖI] {failure}")
+    print("[INFO] Kiểm tra cache OCR: " + ("THẤT BẠI" if failures else "ĐẠT"))
+    sys.exit(1 if failures else 0)
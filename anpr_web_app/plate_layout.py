@@ -0,0 +1,112 @@
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Biển một dòng (ô tô 520x110) rất dài so với chiều cao; biển hai dòng (xe máy 190x140, ô tô biển vuông
+# 280x200) gần vuông. Vùng cắt có tỉ lệ rộng/cao lớn hơn ngưỡng này được coi là một dòng, không cần xét tiếp.
+SINGLE_LINE_MIN_ASPECT = 3.0
+# Chỉ tìm khe giữa hai dòng trong khoảng 30%-70% chiều cao biển số
+VALLEY_SEARCH_BAND = (0.3, 0.7)
+# Khe giữa hai dòng: mật độ điểm chữ của hàng thấp nhất nhỏ hơn tỉ lệ này so với mật độ trung bình của hai dòng
+VALLEY_MAX_RATIO = 0.35
+# Bỏ viền khung biển số (tỉ lệ mỗi cạnh) khi tính lược đồ chiếu
+BORDER_MARGIN = 0.05
+MAX_DESKEW_DEGREES = 15     # Chỉ chỉnh nghiêng khi góc ước lượng nằm trong khoảng 1-15 độ
+
+
+def text_mask(gray: np.ndarray) -> np.ndarray:
+    """Ảnh nhị phân (255 = điểm chữ): nhị phân Otsu, lấy lớp điểm ảnh ít hơn làm chữ (chữ tối trên nền sáng hoặc ngược lại)."""
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if cv2.countNonZero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    """
+    Chỉnh nghiêng ảnh biển số (xám): ước lượng góc bằng hình chữ nhật bao nhỏ nhất của các điểm chữ,
+    chỉ xoay khi góc trong khoảng 1-MAX_DESKEW_DEGREES độ.
+    """
+    points = cv2.findNonZero(text_mask(gray))
+    if points is None or len(points) < 10:
+        return gray
+    angle = cv2.minAreaRect(points)[2]
+    # minAreaRect trả về góc trong [-90, 0) hoặc (0, 90] tùy phiên bản OpenCV: đưa về (-45, 45]
+    if angle > 45:
+        angle -= 90
+    elif angle <= -45:
+        angle += 90
+    if not 1.0 <= abs(angle) <= MAX_DESKEW_DEGREES:
+        return gray
+    height, width = gray.shape[:2]
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(gray, rotation, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def split_rows(gray: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Phân loại biển một dòng/hai dòng và tách dòng bằng lược đồ chiếu ngang của các điểm chữ.
+    Trả về danh sách (y_bắt_đầu, y_kết_thúc) của từng dòng, từ trên xuống.
+    """
+    height, width = gray.shape[:2]
+    if height < 16 or width / height > SINGLE_LINE_MIN_ASPECT:
+        return [(0, height)]
+
+    mask = text_mask(gray)
+    margin_x = int(width * BORDER_MARGIN)
+    profile = mask[:, margin_x:width - margin_x].mean(axis=1) / 255.0
+    # Làm mượt để nét ngang mảnh hoặc nhiễu không tạo ra khe giả
+    profile = np.convolve(profile, np.ones(3) / 3, mode="same")
+
+    top, bottom = int(height * VALLEY_SEARCH_BAND[0]), int(height * VALLEY_SEARCH_BAND[1])
+    valley = top + int(np.argmin(profile[top:bottom]))
+    margin_y = int(height * BORDER_MARGIN)
+    upper = profile[margin_y:valley]
+    lower = profile[valley:height - margin_y]
+    if upper.size == 0 or lower.size == 0:
+        return [(0, height)]
+    # Cả hai nửa phải có chữ, và hàng ở khe phải thưa hơn hẳn mật độ trung bình của hai dòng
+    line_density = (upper.mean() + lower.mean()) / 2
+    if min(upper.max(), lower.max()) < 0.05 or profile[valley] > VALLEY_MAX_RATIO * line_density:
+        return [(0, height)]
+    return [(0, valley), (valley, height)]
+
+
+def binarize_plate(plate_roi: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Ảnh nhị phân của biển số, chỉ dùng để hiển thị/lưu. Không nằm trong pipeline OCR nên chỉ được tính
+    khi client thực sự cần ảnh này (từ cropped_plate_np của kết quả).
+    """
+    if plate_roi is None or plate_roi.size == 0:
+        return None
+    gray = cv2.cvtColor(plate_roi, cv2.COLOR_BGR2GRAY) if plate_roi.ndim == 3 else plate_roi
+    enhanced = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    bfilter = cv2.bilateralFilter(enhanced, 9, 75, 75)
+    return cv2.adaptiveThreshold(bfilter, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+
+def order_text_boxes(result: list) -> Tuple[list, int]:
+    """
+    Sắp xếp các đoạn văn bản OCR (detail=1) theo dòng: gom các box có tâm dọc gần nhau (lệch không quá
+    nửa chiều cao box trung vị) vào một dòng, các dòng từ trên xuống, trong dòng từ trái sang phải.
+    Sắp xếp theo góc trên-trái như trước dễ xen kẽ hai dòng khi box của dòng dưới bắt đầu cao hơn một chút.
+    Trả về (danh sách đã sắp xếp, số dòng).
+    """
+    if not result:
+        return [], 0
+    boxes = []
+    for item in result:
+        ys = [point[1] for point in item[0]]
+        xs = [point[0] for point in item[0]]
+        boxes.append(((min(ys) + max(ys)) / 2, min(xs), max(ys) - min(ys), item))
+    tolerance = 0.5 * float(np.median([box[2] for box in boxes]))
+
+    lines: List[list] = []
+    for center, left, _, item in sorted(boxes, key=lambda box: box[0]):
+        if lines and center - lines[-1][-1][0] <= tolerance:
+            lines[-1].append((center, left, item))
+        else:
+            lines.append([(center, left, item)])
+    ordered = [item for line in lines for _, _, item in sorted(line, key=lambda box: box[1])]
+    return ordered, len(lines)
@@ -0,0 +1,392 @@
+import argparse
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from plate_normalizer import clean_plate_text, confusion_key
+
+SEARCH_MODES = ('exact', 'prefix', 'fuzzy')
+MAX_FUZZY_DISTANCE = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plates (
+    id INTEGER PRIMARY KEY,
+    plate_key TEXT NOT NULL UNIQUE,     -- biển số đã làm sạch (chỉ A-Z0-9)
+    fuzzy_key TEXT NOT NULL,            -- confusion_key(plate_key): B/8, O/0, ... được đưa về cùng một ký tự
+    plate TEXT NOT NULL,                -- biển số đã định dạng của lần đọc gần nhất
+    read_count INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plates_fuzzy_key ON plates(fuzzy_key);
+
+-- Chỉ mục xóa ký tự (kiểu SymSpell): mỗi fuzzy_key cùng mọi chuỗi có được khi xóa tối đa
+-- index_distance ký tự. Hai khóa cách nhau <= d phép sửa luôn có chung ít nhất một chuỗi như vậy.
+CREATE TABLE IF NOT EXISTS plate_variants (
+    variant TEXT NOT NULL,
+    plate_id INTEGER NOT NULL,
+    PRIMARY KEY (variant, plate_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS reads (
+    id INTEGER PRIMARY KEY,
+    plate_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    plate TEXT NOT NULL,
+    confidence REAL,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    session_id TEXT,                    -- ảnh: /results/<session_id>/plate_<plate_index>_cropped.jpg hoặc thư mục đã lưu
+    plate_index INTEGER,
+    source TEXT                         -- tên file ảnh gốc client gửi lên
+);
+CREATE INDEX IF NOT EXISTS reads_plate_ts ON reads(plate_id, ts);
+CREATE INDEX IF NOT EXISTS reads_ts ON reads(ts);
+
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_READ_COLUMNS = "r.id, r.ts, r.plate, r.confidence, r.x1, r.y1, r.x2, r.y2, r.session_id, r.plate_index, r.source"
+
+
+def deletion_variants(key: str, max_deletes: int) -> Set[str]:
+    """key cùng mọi chuỗi có được khi xóa tối đa max_deletes ký tự."""
+    variants = {key}
+    frontier = {key}
+    for _ in range(max_deletes):
+        frontier = {word[:i] + word[i + 1:] for word in frontier if len(word) > 1 for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Khoảng cách Levenshtein giữa a và b, dừng sớm và trả về limit + 1 khi vượt quá limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class PlateEventLog:
+    """
+    Nhật ký mọi lần đọc biển số, lưu trong một file SQLite ở chế độ WAL.
+
+    - record() chỉ đưa sự kiện vào hàng đợi; một luồng nền gom nhiều sự kiện vào một transaction
+      (ghi nối tiếp, không chặn request). Khi hàng đợi đầy, sự kiện bị bỏ và được đếm trong dropped.
+    - Mỗi biển số khác nhau có một dòng trong bảng plates; bảng reads giữ từng lần đọc (thời điểm, độ tin cậy,
+      box, ảnh). Chỉ mục: fuzzy_key, plate_id + ts, ts.
+    - search() hỗ trợ khớp chính xác, theo tiền tố và gần đúng (khoảng cách sửa 1-2); cả ba so sánh trên
+      fuzzy_key nên các cặp OCR hay nhầm (8/B, 0/O/D, ...) được coi là giống nhau và không tốn lượt sửa.
+      Tìm gần đúng dùng chỉ mục xóa ký tự (plate_variants), nên chỉ tra vài chục khóa thay vì quét toàn bảng.
+    - Đọc và ghi dùng kết nối riêng cho từng luồng; WAL cho phép đọc song song trong lúc ghi.
+    """
+
+    def __init__(self, db_path: str, index_distance: int = MAX_FUZZY_DISTANCE, batch_size: int = 256,
+                 flush_interval: float = 0.2, max_pending: int = 10000, metrics=None):
+        if not 0 <= index_distance <= MAX_FUZZY_DISTANCE:
+            raise ValueError(f"index_distance phải nằm trong khoảng 0-{MAX_FUZZY_DISTANCE}")
+        self.db_path = db_path
+        self.index_distance = index_distance
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.dropped = 0
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._opened = False
+
+    def _open(self) -> None:
+        """Tạo file và bảng nếu chưa có (gọi trong start(), không chạy lúc import app)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        # Độ sâu của chỉ mục xóa ký tự được cố định khi tạo file; file cũ giữ giá trị đã dùng lúc tạo
+        conn.execute("INSERT OR IGNORE INTO settings (name, value) VALUES ('index_distance', ?)",
+                     (str(self.index_distance),))
+        conn.commit()
+        self.index_distance = int(conn.execute(
+            "SELECT value FROM settings WHERE name = 'index_distance'").fetchone()[0])
+        self._opened = True
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # NORMAL: ở chế độ WAL vẫn không hỏng dữ liệu khi mất điện, chỉ có thể mất vài transaction cuối
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Vòng đời
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            if not self._opened:
+                self._open()
+            self._thread = threading.Thread(target=self._run, name="plate-log-writer", daemon=True)
+            self._thread.start()
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Ghi nốt các sự kiện đang chờ rồi dừng luồng ghi."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout=timeout)
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    def record(self, events: Iterable[dict]) -> int:
+        """
+        Đưa các lần đọc vào hàng đợi ghi. Mỗi sự kiện: plate (bắt buộc), confidence, box, session_id,
+        plate_index, source, ts (mặc định là thời điểm hiện tại). Trả về số sự kiện đã nhận.
+        """
+        accepted = 0
+        now = time.time()
+        for event in events:
+            if not clean_plate_text(event.get("plate") or ""):
+                continue
+            event.setdefault("ts", now)
+            try:
+                self._queue.put_nowait(event)
+                accepted += 1
+            except queue.Full:
+                self.dropped += 1
+                if self.metrics is not None:
+                    self.metrics.inc("anpr_plate_log_dropped_total")
+        return accepted
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                event = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while event is not None:
+                batch.append(event)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    event = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            stopping = event is None
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except sqlite3.Error as e:
+                    print(f"[LỖI] Không ghi được {len(batch)} sự kiện vào nhật ký biển số: {e}")
+
+    def write_batch(self, events: Sequence[dict]) -> None:
+        """Ghi đồng bộ một lô sự kiện trong một transaction (luồng nền gọi hàm này; cũng dùng khi nạp dữ liệu)."""
+        conn = self._connection()
+        plate_ids: Dict[str, int] = {}
+        with conn:
+            for event in events:
+                key = clean_plate_text(event["plate"])
+                plate_id = plate_ids.get(key)
+                if plate_id is None:
+                    plate_id = self._plate_id(conn, key, event["plate"], event["ts"])
+                    plate_ids[key] = plate_id
+                box = event.get("box") or (None, None, None, None)
+                conn.execute(
+                    "INSERT INTO reads (plate_id, ts, plate, confidence, x1, y1, x2, y2, session_id, plate_index, source)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (plate_id, event["ts"], event["plate"], event.get("confidence"), *box[:4],
+                     event.get("session_id"), event.get("plate_index"), event.get("source")))
+                conn.execute("UPDATE plates SET plate = ?, read_count = read_count + 1,"
+                             " first_seen = MIN(first_seen, ?), last_seen = MAX(last_seen, ?) WHERE id = ?",
+                             (event["plate"], event["ts"], event["ts"], plate_id))
+
+    def _plate_id(self, conn: sqlite3.Connection, key: str, plate: str, ts: float) -> int:
+        row = conn.execute("SELECT id FROM plates WHERE plate_key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        fuzzy_key = confusion_key(key)
+        plate_id = conn.execute(
+            "INSERT INTO plates (plate_key, fuzzy_key, plate, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)",
+            (key, fuzzy_key, plate, ts, ts)).lastrowid
+        conn.executemany("INSERT OR IGNORE INTO plate_variants (variant, plate_id) VALUES (?, ?)",
+                         [(variant, plate_id) for variant in deletion_variants(fuzzy_key, self.index_distance)])
+        return plate_id
+
+    # ------------------------------------------------------------------
+    # Tìm kiếm
+    # ------------------------------------------------------------------
+    def search(self, query: str = "", mode: str = "fuzzy", max_distance: int = 1, since: float = None,
+               until: float = None, limit: int = 50, max_plates: int = 200) -> dict:
+        """
+        Tìm các lần đọc theo biển số và/hoặc khoảng thời gian [since, until].
+
+        mode: 'exact' (cùng fuzzy_key), 'prefix' (fuzzy_key bắt đầu bằng query) hoặc 'fuzzy'
+        (khoảng cách sửa <= max_distance trên fuzzy_key). query rỗng: các lần đọc mới nhất trong khoảng thời gian.
+        Trả về {'plates': biển số khớp (kèm distance, read_count, first_seen, last_seen),
+                'reads': tối đa limit lần đọc mới nhất của các biển số đó}.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Kiểu tìm kiếm không hợp lệ: {mode} (hỗ trợ: {', '.join(SEARCH_MODES)})")
+        if mode == "fuzzy" and not 0 <= max_distance <= self.index_distance:
+            raise ValueError(f"max_distance phải nằm trong khoảng 0-{self.index_distance}")
+        conn = self._connection()
+        key = confusion_key(query)
+
+        if not key:
+            reads = self._reads(conn, None, since, until, limit)
+            return {"plates": [], "reads": reads}
+
+        if mode == "exact":
+            plates = self._plates(conn, "fuzzy_key = ?", (key,), max_plates)
+        elif mode == "prefix":
+            # Khoảng [key, key + ký tự lớn nhất) để SQLite dùng chỉ mục (LIKE không phân biệt hoa thường nên không dùng được)
+            plates = self._plates(conn, "fuzzy_key >= ? AND fuzzy_key < ?", (key, key + "\x7f"), max_plates)
+        else:
+            plates = self._fuzzy_plates(conn, key, max_distance, max_plates)
+
+        for plate in plates:
+            plate.setdefault("distance", 0 if plate["fuzzy_key"] == key else None)
+            del plate["fuzzy_key"]
+        reads = self._reads(conn, [plate["id"] for plate in plates], since, until, limit) if plates else []
+        return {"plates": plates, "reads": reads}
+
+    def _plates(self, conn: sqlite3.Connection, where: str, params: tuple, limit: int) -> List[dict]:
+        rows = conn.execute(f"SELECT id, plate, fuzzy_key, read_count, first_seen, last_seen FROM plates"
+                            f" WHERE {where} ORDER BY fuzzy_key LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _fuzzy_plates(self, conn: sqlite3.Connection, key: str, max_distance: int, limit: int) -> List[dict]:
+        variants = sorted(deletion_variants(key, max_distance))
+        candidate_ids = set()
+        for start in range(0, len(variants), 500):
+            chunk = variants[start:start + 500]
+            rows = conn.execute(f"SELECT plate_id FROM plate_variants WHERE variant IN ({','.join('?' * len(chunk))})",
+                                chunk).fetchall()
+            candidate_ids.update(row[0] for row in rows)
+
+        plates = []
+        ids = sorted(candidate_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(f"SELECT id, plate, fuzzy_key, read_count, first_seen, last_seen FROM plates"
+                                f" WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for row in rows:
+                distance = edit_distance(key, row["fuzzy_key"], max_distance)
+                if distance <= max_distance:
+                    plates.append({**dict(row), "distance": distance})
+        plates.sort(key=lambda p: (p["distance"], -p["read_count"], p["fuzzy_key"]))
+        return plates[:limit]
+
+    def _reads(self, conn: sqlite3.Connection, plate_ids: Optional[List[int]], since: Optional[float],
+               until: Optional[float], limit: int) -> List[dict]:
+        clauses, params = [], []
+        if plate_ids is not None:
+            clauses.append(f"r.plate_id IN ({','.join('?' * len(plate_ids))})")
+            params.extend(plate_ids)
+        if since is not None:
+            clauses.append("r.ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("r.ts <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(f"SELECT {_READ_COLUMNS} FROM reads r {where} ORDER BY r.ts DESC LIMIT ?",
+                            (*params, limit)).fetchall()
+        reads = []
+        for row in rows:
+            read = dict(row)
+            box = [read.pop(name) for name in ("x1", "y1", "x2", "y2")]
+            read["box"] = box if box[0] is not None else None
+            reads.append(read)
+        return reads
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        return {
+            "plates": conn.execute("SELECT COUNT(*) FROM plates").fetchone()[0],
+            "reads": conn.execute("SELECT MAX(id) FROM reads").fetchone()[0] or 0,
+            "pending": self.queue_depth(),
+            "dropped": self.dropped,
+        }
+
+
+# ==============================================================================
+# Đo tốc độ tìm kiếm trên dữ liệu giả lập: python plate_log.py --plates 200000 --reads 2000000
+# ==============================================================================
+
+if __name__ == "__main__":
+    from plate_normalizer import SERIES_LETTERS
+
+    parser = argparse.ArgumentParser(description="Nạp dữ liệu giả lập vào nhật ký biển số và đo thời gian tìm kiếm.")
+    parser.add_argument("--db", default="plate_log_bench.sqlite3")
+    parser.add_argument("--plates", type=int, default=100000, help="Số biển số khác nhau")
+    parser.add_argument("--reads", type=int, default=1000000, help="Số lần đọc")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    def random_plate():
+        digits = "".join(rng.choice("0123456789") for _ in range(5))
+        return f"{rng.randint(10, 99)}{rng.choice(SERIES_LETTERS)}-{digits[:3]}.{digits[3:]}"
+
+    log = PlateEventLog(args.db)
+    log.start()
+    existing = log.stats()["reads"]
+    if existing < args.reads:
+        plates = [random_plate() for _ in range(args.plates)]
+        print(f">>> Nạp {args.reads - existing} lần đọc ({args.plates} biển số) vào {args.db} <<<")
+        started = time.perf_counter()
+        ts = time.time() - 86400 * 30
+        for start in range(existing, args.reads, 50000):
+            batch = [{"plate": rng.choice(plates), "confidence": rng.random(), "box": (10, 20, 110, 60),
+                      "ts": ts + i * 2.5, "source": f"cam{i % 8}.jpg"}
+                     for i in range(start, min(start + 50000, args.reads))]
+            log.write_batch(batch)
+        print(f"Nạp xong trong {time.perf_counter() - started:.1f}s")
+    else:
+        plates = [row[0] for row in log._connection().execute("SELECT plate FROM plates")]
+
+    stats = log.stats()
+    print(f">>> {stats['reads']} lần đọc, {stats['plates']} biển số <<<")
+    queries = [rng.choice(plates) for _ in range(args.queries)]
+    # Làm hỏng truy vấn như OCR: đổi 8 <-> B, 0 -> O và một ký tự sai hẳn
+    noisy = [q.replace("8", "B").replace("0", "O")[:-1] + rng.choice("0123456789") for q in queries]
+    for mode, max_distance, texts in (("exact", 0, queries), ("prefix", 0, [q[:4] for q in queries]),
+                                      ("fuzzy", 1, noisy), ("fuzzy", 2, noisy)):
+        timings = []
+        for text in texts:
+            started = time.perf_counter()
+            log.search(text, mode=mode, max_distance=max_distance, limit=50)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"  {mode:<7} d={max_distance}: p50 {timings[len(timings) // 2]:.2f} ms, "
+              f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms")
+    log.shutdown()
@@ -0,0 +1,269 @@
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ==============================================================================
+# Bảng chuyển đổi ký tự (tính sẵn một lần khi import)
+# ==============================================================================
+
+# Chữ cái được dùng trong sê-ri biển số Việt Nam (không có I, J, O, Q, R, W)
+SERIES_LETTERS = "ABCDEFGHKLMNPSTUVXYZ"
+DIGITS = "0123456789"
+
+# Các cặp OCR hay nhầm: ở vị trí phải là số thì chữ -> số, ở vị trí phải là chữ thì số -> chữ
+CHAR_TO_DIGIT = {'B': '8', 'D': '0', 'O': '0', 'Q': '0', 'U': '0', 'I': '1', 'L': '1', 'T': '7',
+                 'S': '5', 'A': '4', 'X': '8', 'J': '3', 'G': '6', 'Z': '2'}
+DIGIT_TO_CHAR = {'8': 'B', '4': 'A', '0': 'D', '5': 'S', '6': 'G', '7': 'T', '2': 'Z'}
+
+_TO_DIGIT = str.maketrans(CHAR_TO_DIGIT)
+_TO_LETTER = str.maketrans(DIGIT_TO_CHAR)
+_CLEAN_RE = re.compile(r'[^A-Z0-9]')
+# Ký tự nằm ngoài A-Z0-9 bị xóa bằng bytes.translate (nhanh hơn regex khi xử lý hàng loạt)
+_KEEP = set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+_DELETE_BYTES = bytes(b for b in range(256) if b not in _KEEP)
+
+
+def _lookup_table(mapping: Dict[str, str], valid: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Bảng tra 256 phần tử cho một lớp ký tự: (byte sau khi sửa, byte sau khi sửa có hợp lệ không)."""
+    table = np.arange(256, dtype=np.uint8)
+    for src, dst in mapping.items():
+        table[ord(src)] = ord(dst)
+    is_valid = np.zeros(256, dtype=bool)
+    is_valid[[ord(c) for c in valid]] = True
+    return table, is_valid[table]
+
+
+_LUTS = {
+    'D': _lookup_table(CHAR_TO_DIGIT, DIGITS),
+    'L': _lookup_table(DIGIT_TO_CHAR, SERIES_LETTERS),
+}
+
+# ==============================================================================
+# Ngữ pháp biển số: mỗi mẫu là chuỗi lớp ký tự (D = số, L = chữ sê-ri) và cách trình bày
+# ==============================================================================
+
+
+class PlateTemplate:
+    """
+    Một định dạng biển số. pattern gồm tỉnh (2 số), sê-ri, số thứ tự (4 hoặc 5 số);
+    layout 1 = biển một dòng (ô tô), 2 = biển hai dòng (xe máy hoặc ô tô biển vuông).
+    """
+
+    def __init__(self, name: str, pattern: str, series_length: int, layout: int):
+        self.name = name
+        self.pattern = pattern
+        self.length = len(pattern)
+        self.series_length = series_length
+        self.layout = layout
+        self.digit_positions = [i for i, c in enumerate(pattern) if c == 'D']
+        self.letter_positions = [i for i, c in enumerate(pattern) if c == 'L']
+
+        # Bảng tra theo từng vị trí, dùng cho normalize_plates (xử lý cả lô bằng NumPy)
+        self.position_luts = np.stack([_LUTS[c][0] for c in pattern])
+        self.position_valid = np.stack([_LUTS[c][1] for c in pattern])
+
+    def coerce(self, text: str) -> Optional[Tuple[str, int]]:
+        """Sửa ký tự theo lớp của từng vị trí. Trả về (chuỗi đã sửa, số ký tự phải sửa) hoặc None."""
+        chars = []
+        for c, cls in zip(text, self.pattern):
+            fixed = c.translate(_TO_DIGIT) if cls == 'D' else c.translate(_TO_LETTER)
+            if (cls == 'D' and fixed not in DIGITS) or (cls == 'L' and fixed not in SERIES_LETTERS):
+                return None
+            chars.append(fixed)
+        fixed = ''.join(chars)
+        return fixed, sum(a != b for a, b in zip(text, fixed))
+
+    def format(self, text: str) -> str:
+        """Trình bày chuỗi đã sửa theo quy ước: 51A-123.45, 51A-1234, 59-X2 123.45, 29-H1 2345."""
+        province = text[:2]
+        series = text[2:2 + self.series_length]
+        serial = text[2 + self.series_length:]
+        if len(serial) == 5:
+            serial = f"{serial[:3]}.{serial[3:]}"
+        if self.layout == 1:
+            return f"{province}{series}-{serial}"
+        return f"{province}-{series} {serial}"
+
+
+# Thứ tự trong danh sách là thứ tự ưu tiên khi hai mẫu cần sửa cùng số ký tự
+PLATE_TEMPLATES: List[PlateTemplate] = [
+    # Ô tô, biển một dòng: 51A-123.45, 51A-1234, 51LD-123.45
+    PlateTemplate("car_5", "DDLDDDDD", 1, layout=1),
+    PlateTemplate("car_4", "DDLDDDD", 1, layout=1),
+    PlateTemplate("car_double_series_5", "DDLLDDDDD", 2, layout=1),
+    PlateTemplate("car_double_series_4", "DDLLDDDD", 2, layout=1),
+    # Xe máy, biển hai dòng: 59-X2 123.45, 29-H1 2345, 29-AA 123.45 (xe dưới 50cc)
+    PlateTemplate("motorbike_5", "DDLDDDDDD", 2, layout=2),
+    PlateTemplate("motorbike_4", "DDLDDDDD", 2, layout=2),
+    PlateTemplate("motorbike_double_series_5", "DDLLDDDDD", 2, layout=2),
+]
+
+_TEMPLATES_BY_LENGTH: Dict[int, List[PlateTemplate]] = {}
+for _template in PLATE_TEMPLATES:
+    _TEMPLATES_BY_LENGTH.setdefault(_template.length, []).append(_template)
+
+
+def _ordered_templates(length: int, two_line: bool) -> List[PlateTemplate]:
+    """Các mẫu cùng độ dài, mẫu đúng bố cục (một/hai dòng) được ưu tiên trước."""
+    templates = _TEMPLATES_BY_LENGTH.get(length, [])
+    preferred = 2 if two_line else 1
+    return sorted(templates, key=lambda t: t.layout != preferred)
+
+
+def clean_plate_text(text: str) -> str:
+    """Viết hoa và bỏ mọi ký tự ngoài A-Z, 0-9."""
+    return _CLEAN_RE.sub('', text.upper())
+
+
+def confusion_key(text: str) -> str:
+    """
+    Dạng làm sạch trong đó mọi chữ hay bị OCR đọc nhầm thành số (B/8, O/D/Q/0, ...) được thay bằng số,
+    để hai cách đọc nhầm lẫn nhau của cùng một biển số cho ra cùng một khóa (dùng khi tìm kiếm).
+    """
+    return clean_plate_text(text).translate(_TO_DIGIT)
+
+
+# ==============================================================================
+# API
+# ==============================================================================
+
+
+def match_plate(text: str, two_line: bool = False) -> Optional[str]:
+    """
+    Khớp chuỗi OCR với ngữ pháp biển số. Trả về biển số đã định dạng, hoặc None nếu không khớp mẫu nào.
+    Khi nhiều mẫu cùng khớp, chọn mẫu cần sửa ít ký tự nhất; nếu bằng nhau thì ưu tiên mẫu đúng bố cục
+    (two_line = True khi OCR đọc được hai dòng chữ).
+    """
+    cleaned = clean_plate_text(text)
+    best = None
+    for template in _ordered_templates(len(cleaned), two_line):
+        coerced = template.coerce(cleaned)
+        if coerced is not None and (best is None or coerced[1] < best[1]):
+            best = (template.format(coerced[0]), coerced[1])
+    return best[0] if best else None
+
+
+def normalize_plate(text: str, two_line: bool = False) -> str:
+    """
+    Chuẩn hóa một chuỗi OCR thành biển số Việt Nam. Nếu không khớp định dạng nào thì trả về dạng đã
+    làm sạch, và "N/A" nếu còn ít hơn 4 ký tự.
+    """
+    cleaned = clean_plate_text(text)
+    if len(cleaned) < 4:
+        return "N/A"
+    return match_plate(cleaned, two_line) or cleaned
+
+
+def is_valid_plate(text: str, two_line: bool = False) -> bool:
+    """Chuỗi có khớp một định dạng biển số hợp lệ hay không."""
+    return match_plate(text, two_line) is not None
+
+
+def match_plates(texts: Iterable[str], two_line: Sequence[bool] = None) -> List[Optional[str]]:
+    """
+    Phiên bản hàng loạt của match_plate cho các tác vụ chấm lại offline (hàng nghìn chuỗi mỗi lần gọi).
+
+    Các chuỗi được gom theo độ dài thành ma trận byte; với mỗi mẫu, việc sửa ký tự và kiểm tra hợp lệ
+    là phép tra bảng NumPy trên cả ma trận thay vì vòng lặp Python theo từng ký tự.
+    two_line: danh sách cờ hai dòng tương ứng từng chuỗi (mặc định tất cả là một dòng).
+    """
+    cleaned = [text.upper().encode('ascii', 'ignore').translate(None, _DELETE_BYTES) for text in texts]
+    two_line = np.zeros(len(cleaned), dtype=bool) if two_line is None else np.asarray(two_line, dtype=bool)
+    results: List[Optional[str]] = [None] * len(cleaned)
+
+    by_length: Dict[int, List[int]] = {}
+    for index, value in enumerate(cleaned):
+        if len(value) in _TEMPLATES_BY_LENGTH:
+            by_length.setdefault(len(value), []).append(index)
+
+    for length, indices in by_length.items():
+        indices = np.asarray(indices)
+        matrix = np.frombuffer(b''.join(cleaned[i] for i in indices), dtype=np.uint8).reshape(-1, length)
+        columns = np.arange(length)
+        best_cost = np.full(len(indices), length + 1, dtype=np.int32)
+        best_rank = np.full(len(indices), len(PLATE_TEMPLATES), dtype=np.int32)
+        best_template = np.full(len(indices), -1, dtype=np.int32)
+        best_text = np.zeros_like(matrix)
+        layouts = two_line[indices]
+
+        for template_index, template in enumerate(_TEMPLATES_BY_LENGTH[length]):
+            coerced = template.position_luts[columns, matrix]
+            valid = template.position_valid[columns, matrix].all(axis=1)
+            cost = (coerced != matrix).sum(axis=1)
+            # Hạng ưu tiên: mẫu đúng bố cục đứng trước, sau đó theo thứ tự trong PLATE_TEMPLATES
+            rank = np.where((template.layout == 2) == layouts, 0, len(PLATE_TEMPLATES)) + template_index
+            better = valid & ((cost < best_cost) | ((cost == best_cost) & (rank < best_rank)))
+            best_cost[better] = cost[better]
+            best_rank[better] = rank[better]
+            best_template[better] = template_index
+            best_text[better] = coerced[better]
+
+        templates = _TEMPLATES_BY_LENGTH[length]
+        for row, index in enumerate(indices):
+            if best_template[row] >= 0:
+                results[index] = templates[best_template[row]].format(best_text[row].tobytes().decode('ascii'))
+    return results
+
+
+def normalize_plates(texts: Iterable[str], two_line: Sequence[bool] = None) -> List[str]:
+    """Phiên bản hàng loạt của normalize_plate."""
+    texts = list(texts)
+    matched = match_plates(texts, two_line)
+    normalized = []
+    for text, plate in zip(texts, matched):
+        if plate is not None:
+            normalized.append(plate)
+            continue
+        cleaned = clean_plate_text(text)
+        normalized.append(cleaned if len(cleaned) >= 4 else "N/A")
+    return normalized
+
+
+# ==============================================================================
+# Micro-benchmark: python plate_normalizer.py --count 100000
+# ==============================================================================
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Đo tốc độ chuẩn hóa chuỗi OCR biển số.")
+    parser.add_argument("--count", type=int, default=100000, help="Số chuỗi OCR giả lập")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    confusions = {**CHAR_TO_DIGIT, **DIGIT_TO_CHAR}
+
+    def synthetic_read():
+        template = rng.choice(PLATE_TEMPLATES)
+        chars = [rng.choice(DIGITS if c == 'D' else SERIES_LETTERS) for c in template.pattern]
+        # Thêm lỗi OCR: nhầm ký tự, dấu phân cách, khoảng trắng
+        for i, c in enumerate(chars):
+            if c in confusions and rng.random() < 0.1:
+                chars[i] = confusions[c]
+        text = ''.join(chars)
+        if rng.random() < 0.5:
+            text = f"{text[:3]}-{text[3:]}"
+        return text, template.layout == 2
+
+    samples = [synthetic_read() for _ in range(args.count)]
+    texts = [text for text, _ in samples]
+    layouts = [layout for _, layout in samples]
+
+    started = time.perf_counter()
+    scalar = [normalize_plate(text, layout) for text, layout in samples]
+    scalar_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bulk = normalize_plates(texts, layouts)
+    bulk_time = time.perf_counter() - started
+
+    mismatches = sum(a != b for a, b in zip(scalar, bulk))
+    valid = sum(match is not None for match in match_plates(texts, layouts))
+    print(f"Số chuỗi: {args.count}, khớp ngữ pháp: {valid / args.count:.1%}")
+    print(f"normalize_plate (từng chuỗi): {scalar_time:.3f}s ({args.count / scalar_time:,.0f} chuỗi/s)")
+    print(f"normalize_plates (hàng loạt): {bulk_time:.3f}s ({args.count / bulk_time:,.0f} chuỗi/s)")
+    print(f"Kết quả khác nhau giữa hai cách: {mismatches}")
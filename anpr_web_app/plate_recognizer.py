@@ -0,0 +1,371 @@
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from plate_layout import split_rows
+from plate_normalizer import DIGITS, PLATE_TEMPLATES, SERIES_LETTERS, PlateTemplate
+
+# ==============================================================================
+# Bộ nhận dạng CRNN/CTC nhỏ chỉ cho biển số (thay EasyOCR, xem train_plate_ocr.py)
+# ==============================================================================
+
+# Lớp 0 là ký tự trống (blank) của CTC; '-' và '.' là dấu phân cách in trên biển số
+PLATE_ALPHABET = DIGITS + "ABCDEFGHIJKLMNOPQRSTUVWXYZ" + "-."
+SEPARATORS = "-."
+BLANK = 0
+INPUT_HEIGHT = 32    # Ảnh đầu vào: xám, cao INPUT_HEIGHT, rộng INPUT_WIDTH; các dòng chữ được ghép nối tiếp
+INPUT_WIDTH = 192
+# Khi giải mã theo ngữ pháp, kết quả chỉ được nhận nếu log-xác suất của đường đi tốt nhất theo ngữ pháp kém đường
+# đi tốt nhất không ràng buộc không quá ngưỡng này (nat); vượt quá thì vùng ảnh không giống biển số và kết quả
+# không ràng buộc được trả về để plate_normalizer quyết định như với EasyOCR
+MAX_GRAMMAR_PENALTY = 6.0
+MODEL_CONFIG_VERSION = 1
+
+
+def model_config(alphabet: str = PLATE_ALPHABET, input_height: int = INPUT_HEIGHT,
+                 input_width: int = INPUT_WIDTH) -> dict:
+    """Cấu hình đi kèm mô hình (trong checkpoint .pt và file .json cạnh file .onnx)."""
+    return {"version": MODEL_CONFIG_VERSION, "alphabet": alphabet,
+            "input_height": input_height, "input_width": input_width}
+
+
+def config_path_for(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def prepare_plate_image(gray: np.ndarray, rows: Optional[List[Tuple[int, int]]] = None,
+                        height: int = INPUT_HEIGHT, width: int = INPUT_WIDTH) -> np.ndarray:
+    """
+    Ảnh biển số (xám) -> đầu vào (height, width) float32 của CRNN, dùng chung cho huấn luyện và suy luận.
+    Mỗi dòng chữ (rows, mặc định tách bằng plate_layout.split_rows) được co giãn về chiều cao height rồi ghép
+    nối tiếp từ trái sang phải (biển hai dòng trở thành một dòng "59-X2 123.45"), cách nhau một khoảng nền.
+    Ảnh dài hơn width bị nén ngang, ngắn hơn thì được đệm nền bên phải; giá trị được chuẩn hóa theo từng ảnh.
+    """
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+    if rows is None:
+        rows = split_rows(gray)
+    background = float(np.median(gray)) if gray.size else 0.0
+    parts = []
+    for y0, y1 in rows:
+        row = gray[y0:y1]
+        if row.shape[0] == 0 or row.shape[1] == 0:
+            continue
+        row_width = max(1, int(round(row.shape[1] * height / row.shape[0])))
+        interpolation = cv2.INTER_AREA if row.shape[0] > height else cv2.INTER_LINEAR
+        if parts:
+            parts.append(np.full((height, height // 4), background, dtype=np.uint8))
+        parts.append(cv2.resize(row, (row_width, height), interpolation=interpolation))
+    if not parts:
+        return np.zeros((height, width), dtype=np.float32)
+
+    line = np.concatenate(parts, axis=1) if len(parts) > 1 else parts[0]
+    if line.shape[1] > width:
+        line = cv2.resize(line, (width, height), interpolation=cv2.INTER_AREA)
+    elif line.shape[1] < width:
+        line = cv2.copyMakeBorder(line, 0, 0, 0, width - line.shape[1], cv2.BORDER_CONSTANT, value=background)
+    line = line.astype(np.float32)
+    return (line - line.mean()) / (line.std() + 1e-6)
+
+
+def build_crnn(num_classes: int):
+    """
+    Mạng CRNN nhỏ (~1 triệu tham số): 6 lớp tích chập thu ảnh 32 x W về một hàng W/4 cột đặc trưng,
+    BiLSTM 2 lớp, rồi phân lớp từng cột. forward trả về log-softmax (N, W/4, num_classes) cho CTC.
+    torch chỉ được import khi cần (huấn luyện hoặc suy luận bằng file .pt).
+    """
+    import torch
+    from torch import nn
+
+    def block(in_channels, out_channels, pool):
+        layers = [nn.Conv2d(in_channels, out_channels, 3, padding=1, bias=False),
+                  nn.BatchNorm2d(out_channels), nn.ReLU(inplace=True)]
+        if pool:
+            layers.append(nn.MaxPool2d(pool))
+        return layers
+
+    class CRNN(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.features = nn.Sequential(
+                *block(1, 32, (2, 2)),      # 16 x W/2
+                *block(32, 64, (2, 2)),     # 8 x W/4
+                *block(64, 128, None),
+                *block(128, 128, (2, 1)),   # 4 x W/4
+                *block(128, 192, (2, 1)),   # 2 x W/4
+                nn.Conv2d(192, 256, (2, 1), bias=False), nn.BatchNorm2d(256), nn.ReLU(inplace=True),  # 1 x W/4
+            )
+            self.rnn = nn.LSTM(256, 128, num_layers=2, bidirectional=True, batch_first=True, dropout=0.1)
+            self.classifier = nn.Linear(256, num_classes)
+
+        def forward(self, x):
+            features = self.features(x).squeeze(2).permute(0, 2, 1)  # (N, T, 256)
+            output, _ = self.rnn(features)
+            return torch.log_softmax(self.classifier(output), dim=-1)
+
+    return CRNN()
+
+# ==============================================================================
+# Giải mã CTC
+# ==============================================================================
+
+
+def ctc_greedy_decode(log_probs: np.ndarray, alphabet: str = PLATE_ALPHABET) -> Tuple[str, float, float]:
+    """
+    Giải mã tham lam (T, C): lấy lớp tốt nhất ở mỗi cột, gộp các lớp lặp liền nhau, bỏ blank.
+    Trả về (chuỗi, log-xác suất của đường đi, độ tin cậy = trung bình xác suất cao nhất của từng ký tự).
+    """
+    best = log_probs.argmax(axis=1)
+    score = float(log_probs[np.arange(len(best)), best].sum())
+    chars, confidences = [], []
+    previous = BLANK
+    for t, index in enumerate(best):
+        if index != BLANK and index != previous:
+            chars.append(alphabet[index - 1])
+            confidences.append(float(np.exp(log_probs[t, index])))
+        elif index != BLANK and confidences:
+            confidences[-1] = max(confidences[-1], float(np.exp(log_probs[t, index])))
+        previous = index
+    return ''.join(chars), score, float(np.mean(confidences)) if confidences else 0.0
+
+
+def _pattern_masks(patterns: Sequence[str], alphabet: str) -> np.ndarray:
+    """(P, Lmax, C): lớp nào được phép ở vị trí nào của từng mẫu (D: chữ số, L: chữ sê-ri)."""
+    allowed = {cls: np.zeros(len(alphabet) + 1, dtype=bool) for cls in "DL"}
+    for cls, chars in (("D", DIGITS), ("L", SERIES_LETTERS)):
+        allowed[cls][[alphabet.index(c) + 1 for c in chars]] = True
+    masks = np.zeros((len(patterns), max(len(p) for p in patterns), len(alphabet) + 1), dtype=bool)
+    for p, pattern in enumerate(patterns):
+        for k, cls in enumerate(pattern):
+            masks[p, k] = allowed[cls]
+    return masks
+
+
+class GrammarDecoder:
+    """
+    Giải mã CTC ràng buộc theo ngữ pháp biển số (plate_normalizer.PLATE_TEMPLATES): với mỗi mẫu (chuỗi lớp
+    ký tự D/L), tìm bằng Viterbi đường đi CTC tốt nhất mà ký tự thứ k thuộc đúng lớp của vị trí k. Dấu phân
+    cách được coi như blank (định dạng do mẫu quyết định). Mọi mẫu được tính cùng lúc bằng NumPy.
+    """
+
+    def __init__(self, alphabet: str = PLATE_ALPHABET, templates: Sequence[PlateTemplate] = PLATE_TEMPLATES):
+        self.alphabet = alphabet
+        self.patterns = list(dict.fromkeys(t.pattern for t in templates))
+        self.templates: Dict[str, List[PlateTemplate]] = {}
+        for template in templates:
+            self.templates.setdefault(template.pattern, []).append(template)
+        self.lengths = np.array([len(p) for p in self.patterns])
+        self.masks = _pattern_masks(self.patterns, alphabet)
+        self.gap_classes = [BLANK] + [alphabet.index(c) + 1 for c in SEPARATORS if c in alphabet]
+
+    def decode(self, log_probs: np.ndarray) -> Optional[Tuple[str, float, float]]:
+        """
+        Trả về (chuỗi đã làm sạch theo mẫu tốt nhất, log-xác suất của đường đi, độ tin cậy) hoặc None nếu
+        chuỗi quá ngắn để chứa mẫu nào (số cột T nhỏ hơn độ dài mẫu).
+        """
+        T = len(log_probs)
+        P, L, C = self.masks.shape
+        neg_inf = -np.inf
+        gap = np.logaddexp.reduce(log_probs[:, self.gap_classes], axis=1)          # (T,)
+        emit = np.where(self.masks[None], log_probs[:, None, None, :], neg_inf)    # (T, P, L, C)
+
+        # char[p, k, c]: đường đi tốt nhất kết thúc ở ký tự thứ k = c; gaps[p, k]: ở khoảng trống trước ký tự k
+        char = np.full((P, L, C), neg_inf)
+        gaps = np.full((P, L + 1), neg_inf)
+        char[:, 0] = emit[0, :, 0]
+        gaps[:, 0] = gap[0]
+        # Vết để truy ngược: ký tự đến từ 0 = chính nó, 1 = khoảng trống trước, 2 = ký tự trước; khoảng trống
+        # đến từ ký tự trước hay không (gap_from); top1/top2: ký tự tốt nhất và tốt thứ hai của từng vị trí
+        char_from = np.zeros((T, P, L, C), dtype=np.int8)
+        gap_from = np.zeros((T, P, L + 1), dtype=bool)
+        top1s = np.zeros((T, P, L), dtype=np.int16)
+        top2s = np.zeros((T, P, L), dtype=np.int16)
+        classes = np.arange(C)
+        prev_score = np.full((P, L, C), neg_inf)
+        from_char = np.full((P, L + 1), neg_inf)
+        for t in range(1, T):
+            # Ký tự trước tốt nhất, và tốt thứ hai (hai ký tự giống nhau liền nhau phải cách bởi blank)
+            top1 = char.argmax(axis=2)
+            is_top = classes == top1[..., None]
+            others = np.where(is_top, neg_inf, char)
+            best1, best2 = char.max(axis=2), others.max(axis=2)
+            prev_score[:, 1:] = np.where(is_top[:, :-1], best2[:, :-1, None], best1[:, :-1, None])
+            from_gap = gaps[:, :L, None]
+
+            stay = char >= np.maximum(from_gap, prev_score)
+            via_gap = from_gap >= prev_score
+            char_from[t] = np.where(stay, 0, np.where(via_gap, 1, 2))
+            top1s[t - 1], top2s[t - 1] = top1, others.argmax(axis=2)
+            char = np.maximum(char, np.maximum(from_gap, prev_score)) + emit[t]
+
+            from_char[:, 1:] = best1
+            gap_from[t] = from_char > gaps
+            gaps = np.maximum(gaps, from_char) + gap[t]
+
+        rows = np.arange(P)
+        last = self.lengths - 1
+        end_char = char[rows, last].max(axis=1)
+        end_gap = gaps[rows, self.lengths]
+        scores = np.maximum(end_char, end_gap)
+        scores[self.lengths > T] = neg_inf
+        p = int(scores.argmax())
+        if not np.isfinite(scores[p]):
+            return None
+
+        # Truy ngược đường đi của mẫu tốt nhất: ký tự từng vị trí và xác suất cao nhất của nó trên các cột
+        k = int(last[p])
+        if end_char[p] >= end_gap[p]:
+            state, c = "char", int(char[p, k].argmax())
+        else:
+            state, k, c = "gap", k + 1, -1
+        chars: Dict[int, int] = {}
+        confidences: Dict[int, float] = {}
+        for t in range(T - 1, -1, -1):
+            if state == "char":
+                chars[k] = c
+                confidences[k] = max(confidences.get(k, 0.0), float(np.exp(log_probs[t, c])))
+                if t == 0:
+                    break
+                came_from = char_from[t, p, k, c]
+                if came_from == 1:
+                    state = "gap"
+                elif came_from == 2:
+                    previous = top1s[t - 1, p, k - 1]
+                    c, k = int(top2s[t - 1, p, k - 1] if previous == c else previous), k - 1
+            else:
+                if t == 0:
+                    break
+                if gap_from[t, p, k]:
+                    state, c, k = "char", int(top1s[t - 1, p, k - 1]), k - 1
+        text = ''.join(self.alphabet[chars[i] - 1] for i in range(len(self.patterns[p])))
+        return text, float(scores[p]), float(np.mean(list(confidences.values())))
+
+    def template_for(self, text: str, two_line: bool) -> PlateTemplate:
+        """Mẫu của chuỗi đã giải mã; các mẫu cùng chuỗi lớp ký tự (ô tô/xe máy) được chọn theo số dòng."""
+        templates = self.templates[''.join('D' if c in DIGITS else 'L' for c in text)]
+        preferred = 2 if two_line else 1
+        return next((t for t in templates if t.layout == preferred), templates[0])
+
+
+def decode_plate(log_probs: np.ndarray, decoder: GrammarDecoder, two_line: bool = False,
+                 max_grammar_penalty: float = MAX_GRAMMAR_PENALTY) -> Tuple[List[str], float]:
+    """
+    Chuỗi của một biển số từ (T, C): theo ngữ pháp nếu đủ gần kết quả không ràng buộc (xem MAX_GRAMMAR_PENALTY),
+    nếu không thì kết quả không ràng buộc. Trả về (chuỗi của từng dòng, độ tin cậy).
+    """
+    greedy_text, greedy_score, greedy_conf = ctc_greedy_decode(log_probs, decoder.alphabet)
+    constrained = decoder.decode(log_probs)
+    if constrained is not None and greedy_score - constrained[1] <= max_grammar_penalty:
+        text, _, conf = constrained
+        return decoder.template_for(text, two_line).format(text).split(" "), conf
+    return [greedy_text], greedy_conf
+
+# ==============================================================================
+# Suy luận trên CPU
+# ==============================================================================
+
+
+class CrnnPlateRecognizer:
+    """
+    Nhận dạng biển số bằng CRNN đã huấn luyện (train_plate_ocr.py), trên CPU:
+    - file .onnx: ONNX Runtime (không cần torch), cấu hình đọc từ file .json cùng tên;
+    - file .pt: torch, LSTM/Linear được lượng tử hóa động INT8 (quantize=True).
+    Có các phương thức recognize/readtext/readtext_batched cùng dạng kết quả (detail=1) với easyocr.Reader để
+    ANPRSystem dùng thay EasyOCR trong mọi bậc OCR. Không có bộ phát hiện chữ: vùng ảnh là biển số do YOLO cắt,
+    các dòng chữ được tách bằng plate_layout.split_rows. Mỗi instance chỉ dùng từ một luồng tại một thời điểm
+    (ANPRSystem giữ khóa 'reader').
+    """
+
+    # Mỗi ảnh được đưa về input_size riêng (prepare_plate_image) nên các ảnh trong một lô không cần cùng kích thước;
+    # ANPRSystem không đệm viền hay gom ảnh theo kích thước trước khi gọi readtext_batched
+    needs_uniform_batch = False
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None, quantize: bool = True,
+                 max_grammar_penalty: float = MAX_GRAMMAR_PENALTY):
+        self.model_path = model_path
+        self.max_grammar_penalty = max_grammar_penalty
+        if model_path.endswith(".onnx"):
+            import onnxruntime as ort
+
+            with open(config_path_for(model_path), encoding="utf-8") as f:
+                self.config = json.load(f)
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.model = None
+        else:
+            import torch
+
+            checkpoint = torch.load(model_path, map_location="cpu")
+            self.config = checkpoint["config"]
+            model = build_crnn(len(self.config["alphabet"]) + 1)
+            model.load_state_dict(checkpoint["state_dict"])
+            model.eval()
+            if quantize:
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear},
+                                                               dtype=torch.qint8)
+            self.model = model
+            self.session = None
+        if self.config.get("version") != MODEL_CONFIG_VERSION:
+            raise ValueError(f"Phiên bản cấu hình mô hình OCR không hỗ trợ: {self.config.get('version')}")
+        self.alphabet = self.config["alphabet"]
+        self.input_size = (self.config["input_height"], self.config["input_width"])
+        self.decoder = GrammarDecoder(self.alphabet)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """(N, H, W) float32 đã qua prepare_plate_image -> log-xác suất (N, T, C)."""
+        batch = np.ascontiguousarray(batch[:, None], dtype=np.float32)
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: batch})[0]
+        import torch
+
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(batch)).numpy()
+
+    def decode(self, log_probs: np.ndarray, two_line: bool) -> Tuple[List[str], float]:
+        return decode_plate(log_probs, self.decoder, two_line, self.max_grammar_penalty)
+
+    def read_plates(self, images: List[np.ndarray], rows_per_image: List[List[Tuple[int, int]]],
+                    batch_size: int = 32) -> List[Tuple[List[str], float]]:
+        """Nhận dạng nhiều biển số (ảnh xám + các dòng chữ) theo lô: [(chuỗi của từng dòng, độ tin cậy)]."""
+        results = []
+        height, width = self.input_size
+        for start in range(0, len(images), batch_size):
+            chunk = range(start, min(len(images), start + batch_size))
+            batch = np.stack([prepare_plate_image(images[i], rows_per_image[i], height, width) for i in chunk])
+            for i, log_probs in zip(chunk, self.predict(batch)):
+                results.append(self.decode(log_probs, two_line=len(rows_per_image[i]) > 1))
+        return results
+
+    @staticmethod
+    def _as_easyocr(texts: List[str], conf: float, rows: List[Tuple[int, int]], width: int) -> list:
+        """Kết quả dạng readtext(detail=1): một đoạn cho mỗi dòng, box là cả dòng (một đoạn nếu số dòng khác)."""
+        if len(texts) != len(rows):
+            texts, rows = [''.join(texts)], [(rows[0][0], rows[-1][1])]
+        return [([[0, y0], [width, y0], [width, y1], [0, y1]], text, conf)
+                for text, (y0, y1) in zip(texts, rows) if text]
+
+    def recognize(self, gray: np.ndarray, horizontal_list: list, free_list: list = None, detail: int = 1,
+                  paragraph: bool = False, allowlist: str = None, **kwargs) -> list:
+        """Như easyocr.Reader.recognize: các dòng horizontal_list [x0, x1, y0, y1] của cùng một biển số."""
+        rows = [(int(y0), int(y1)) for _, _, y0, y1 in horizontal_list] or [(0, gray.shape[0])]
+        texts, conf = self.read_plates([gray], [rows])[0]
+        return self._as_easyocr(texts, conf, rows, gray.shape[1])
+
+    def readtext(self, image: np.ndarray, detail: int = 1, paragraph: bool = False, **kwargs) -> list:
+        """Như easyocr.Reader.readtext nhưng không có CRAFT: các dòng được tách bằng split_rows."""
+        return self.readtext_batched([image])[0]
+
+    def readtext_batched(self, images: List[np.ndarray], detail: int = 1, paragraph: bool = False,
+                         batch_size: int = 32, **kwargs) -> List[list]:
+        grays = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image for image in images]
+        rows_per_image = [split_rows(gray) for gray in grays]
+        return [self._as_easyocr(texts, conf, rows, gray.shape[1])
+                for (texts, conf), rows, gray in zip(self.read_plates(grays, rows_per_image, batch_size),
+                                                     rows_per_image, grays)]
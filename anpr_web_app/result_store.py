@@ -0,0 +1,321 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+
+def _estimate_nbytes(value: Any) -> int:
+    """Ước lượng dung lượng bộ nhớ (byte) của một kết quả: chủ yếu là các NumPy array lồng bên trong."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_estimate_nbytes(v) for v in value.values()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_nbytes(v) for v in value) + 64
+    if isinstance(value, (str, bytes)):
+        return len(value) + 48
+    return 32
+
+
+def _flatten(value: Any, arrays: dict) -> Any:
+    """Thay các NumPy array bằng tham chiếu tên để phần khung còn lại có thể ghi ra JSON."""
+    if isinstance(value, np.ndarray):
+        name = f"a{len(arrays)}"
+        arrays[name] = value
+        return {"__ndarray__": name}
+    if isinstance(value, dict):
+        return {k: _flatten(v, arrays) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_flatten(v, arrays) for v in value]
+    return value
+
+
+def _pid_alive(pid: int) -> bool:
+    """Tiến trình pid còn chạy không (không chắc chắn thì coi như còn, để không xóa nhầm)."""
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == "nt":
+        # os.kill trên Windows kết thúc tiến trình thay vì chỉ kiểm tra
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _unflatten(value: Any, arrays) -> Any:
+    """Ngược lại với _flatten."""
+    if isinstance(value, dict):
+        if set(value.keys()) == {"__ndarray__"}:
+            return arrays[value["__ndarray__"]]
+        return {k: _unflatten(v, arrays) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unflatten(v, arrays) for v in value]
+    return value
+
+
+class ResultStore:
+    """
+    Bộ nhớ tạm cho kết quả xử lý (thay cho dictionary TEMP_RESULTS_STORAGE).
+
+    - Giới hạn tổng dung lượng RAM (max_bytes), khi vượt sẽ loại bỏ kết quả ít dùng nhất (LRU).
+    - Mỗi kết quả chỉ sống trong ttl_seconds giây kể từ khi được lưu.
+    - Nếu có spill_dir, kết quả bị loại khỏi RAM nhưng chưa hết hạn được nén ra đĩa (.npz)
+      và được nạp lại khi có yêu cầu. Việc nén chạy ngoài khóa, không chặn các get/put khác.
+      Mỗi tiến trình ghi vào spill_dir/<pid> (tạo khi ghi lần đầu, xóa bởi close()); thư mục của các
+      tiến trình đã dừng (ví dụ lần chạy trước bị tắt đột ngột) được xóa khi khởi tạo.
+    - Có bộ đếm hits/misses/evictions và dung lượng đang chiếm giữ (xem stats()).
+
+    Các phương thức đều an toàn khi gọi từ nhiều luồng.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, ttl_seconds: float = 1800,
+                 spill_dir: Optional[str] = None, max_spill_bytes: int = 4 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+
+        self._lock = threading.RLock()
+        # key -> (value, nbytes, created_at)
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        # key -> (path, nbytes trên đĩa, created_at)
+        self._spilled: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+        # key -> (value, created_at): đã bị loại khỏi RAM, đang được nén ra đĩa (ngoài khóa)
+        self._spilling: "dict[str, Tuple[Any, float]]" = {}
+        self._resident_bytes = 0
+        self._spilled_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spills = 0
+
+        if spill_dir:
+            # Mỗi tiến trình dùng thư mục con riêng để không xóa nhầm file của tiến trình khác
+            self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+            # File còn sót lại (của tiến trình trước có cùng pid, hoặc đã dừng) không còn key tương ứng nên xóa đi
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self._remove_stale_spill_dirs(spill_dir)
+
+    # ------------------------------------------------------------------
+    # API chính
+    # ------------------------------------------------------------------
+    def put(self, key: str, value: Any) -> None:
+        """Lưu một kết quả. Nếu key đã tồn tại thì ghi đè."""
+        nbytes = _estimate_nbytes(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, nbytes, time.time())
+            self._resident_bytes += nbytes
+            self._purge_expired()
+            evicted = self._enforce_budget()
+        self._spill_evicted(evicted)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Lấy kết quả theo key, trả về None nếu không có hoặc đã hết hạn."""
+        value, evicted = None, []
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            spilling = self._spilling.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+            elif spilling is not None:
+                # Đang được ghi ra đĩa nhưng vẫn còn trong bộ nhớ
+                self.hits += 1
+                value = spilling[0]
+            elif key in self._spilled:
+                value, evicted = self._load_spilled(key)
+                if value is not None:
+                    self.hits += 1
+                    self.disk_hits += 1
+            if value is None:
+                self.misses += 1
+        self._spill_evicted(evicted)
+        return value
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Lấy và xóa kết quả khỏi bộ nhớ tạm."""
+        value = self.get(key)
+        with self._lock:
+            self._remove(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._purge_expired()
+            return key in self._entries or key in self._spilling or key in self._spilled
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries) + len(self._spilling) + len(self._spilled)
+
+    def close(self) -> None:
+        """Xóa mọi kết quả đã ghi ra đĩa cùng thư mục của tiến trình này (gọi khi dừng server)."""
+        with self._lock:
+            for key in list(self._spilled):
+                self._remove(key)
+            self._spilling.clear()
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        """Các bộ đếm phục vụ giám sát."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "spilled_entries": len(self._spilled) + len(self._spilling),
+                "resident_bytes": self._resident_bytes,
+                "spilled_bytes": self._spilled_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "spills": self.spills,
+            }
+
+    # ------------------------------------------------------------------
+    # Nội bộ (gọi khi đang giữ self._lock)
+    # ------------------------------------------------------------------
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        self._spilling.pop(key, None)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._resident_bytes -= entry[1]
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            self._spilled_bytes -= spilled[1]
+            self._delete_file(spilled[0])
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        # Các OrderedDict được sắp theo thứ tự truy cập, không phải thời điểm tạo, nên phải duyệt hết
+        for key in [k for k, (_, _, created) in self._entries.items() if self._is_expired(created, now)]:
+            self._remove(key)
+            self.expirations += 1
+        for key in [k for k, (_, created) in self._spilling.items() if self._is_expired(created, now)]:
+            self._remove(key)
+            self.expirations += 1
+        for key in [k for k, (_, _, created) in self._spilled.items() if self._is_expired(created, now)]:
+            self._remove(key)
+            self.expirations += 1
+
+    def _enforce_budget(self) -> List[Tuple[str, Any, float]]:
+        """
+        Loại các kết quả ít dùng nhất cho đến khi vừa max_bytes. Nếu có spill_dir, trả về các kết quả bị loại
+        (key, value, created_at) để ghi ra đĩa bằng _spill_evicted sau khi nhả khóa.
+        """
+        evicted = []
+        while self._resident_bytes > self.max_bytes and self._entries:
+            key, (value, nbytes, created_at) = self._entries.popitem(last=False)
+            self._resident_bytes -= nbytes
+            self.evictions += 1
+            if self.spill_dir:
+                self._spilling[key] = (value, created_at)
+                evicted.append((key, value, created_at))
+        self._enforce_spill_budget()
+        return evicted
+
+    def _enforce_spill_budget(self) -> None:
+        while self._spilled_bytes > self.max_spill_bytes and self._spilled:
+            key, (path, nbytes, _) = self._spilled.popitem(last=False)
+            self._spilled_bytes -= nbytes
+            self._delete_file(path)
+
+    def _load_spilled(self, key: str) -> Tuple[Optional[Any], List[Tuple[str, Any, float]]]:
+        path, nbytes, created_at = self._spilled.pop(key)
+        self._spilled_bytes -= nbytes
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                skeleton = json.loads(data["__meta__"].tobytes().decode("utf-8"))
+                arrays = {name: data[name] for name in data.files if name != "__meta__"}
+        except Exception as e:
+            print(f"[CẢNH BÁO] Không thể đọc kết quả tạm từ đĩa: {e}")
+            return None, []
+        finally:
+            self._delete_file(path)
+
+        value = _unflatten(skeleton, arrays)
+        # Đưa lại vào RAM với thời điểm tạo ban đầu để TTL không bị kéo dài
+        nbytes = _estimate_nbytes(value)
+        self._entries[key] = (value, nbytes, created_at)
+        self._resident_bytes += nbytes
+        return value, self._enforce_budget()
+
+    # ------------------------------------------------------------------
+    # Ghi ra đĩa (gọi khi KHÔNG giữ self._lock)
+    # ------------------------------------------------------------------
+    def _spill_evicted(self, evicted: List[Tuple[str, Any, float]]) -> None:
+        """Nén các kết quả bị loại ra đĩa ngoài khóa, rồi chỉ ghi nhận đường dẫn file khi đang giữ khóa."""
+        for key, value, created_at in evicted:
+            path = self._write_spill_file(value)
+            with self._lock:
+                current = self._spilling.get(key)
+                if current is None or current[0] is not value:
+                    # Key đã bị xóa hoặc ghi đè trong lúc nén
+                    if path is not None:
+                        self._delete_file(path)
+                    continue
+                del self._spilling[key]
+                if path is None:
+                    continue
+                nbytes = os.path.getsize(path)
+                self._spilled[key] = (path, nbytes, created_at)
+                self._spilled_bytes += nbytes
+                self.spills += 1
+                self._enforce_spill_budget()
+
+    def _write_spill_file(self, value: Any) -> Optional[str]:
+        arrays = {}
+        skeleton = _flatten(value, arrays)
+        meta = np.frombuffer(json.dumps(skeleton).encode("utf-8"), dtype=np.uint8)
+        path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.npz")
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            np.savez_compressed(path, __meta__=meta, **arrays)
+        except Exception as e:
+            print(f"[CẢNH BÁO] Không thể ghi kết quả tạm ra đĩa: {e}")
+            self._delete_file(path)
+            return None
+        return path
+
+    @staticmethod
+    def _remove_stale_spill_dirs(spill_root: str) -> None:
+        """Xóa thư mục spill_root/<pid> của các tiến trình không còn chạy (file của chúng không còn key nào)."""
+        try:
+            entries = list(os.scandir(spill_root))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir() and entry.name.isdigit() and int(entry.name) != os.getpid() \
+                    and not _pid_alive(int(entry.name)):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    @staticmethod
+    def _delete_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,346 @@
+import io
+import itertools
+import json
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+
+from plate_layout import binarize_plate
+
+STORAGE_MODES = ('files', 'zip', 'segment')
+
+# Mỗi bản ghi trong file segment: MAGIC, độ dài phần JSON (uint32), độ dài phần dữ liệu (uint64),
+# phần JSON (tên file -> (offset, độ dài) trong phần dữ liệu, kèm metadata), rồi phần dữ liệu.
+SEGMENT_MAGIC = b"ANPRSEG1"
+_SEGMENT_HEADER = struct.Struct(">8sIQ")
+
+
+class WriterQueueFullError(Exception):
+    """Hàng đợi ghi kết quả đã đầy, client nên thử lại sau."""
+
+
+class WriterClosedError(Exception):
+    """Bộ ghi kết quả đã dừng nên không nhận thêm công việc."""
+
+
+def _fsync_dir(path: str) -> None:
+    """Đồng bộ thư mục để thao tác đổi tên/tạo file được ghi bền vững (bỏ qua trên Windows)."""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Ghi file qua file tạm + fsync + os.replace: người đọc chỉ thấy file cũ hoặc file mới đầy đủ."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(directory)
+
+
+def read_segment_record(path: str, offset: int) -> Tuple[dict, Dict[str, bytes]]:
+    """Đọc một bản ghi trong file segment: trả về (metadata, tên file -> bytes)."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        magic, meta_length, data_length = _SEGMENT_HEADER.unpack(f.read(_SEGMENT_HEADER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Bản ghi segment không hợp lệ tại offset {offset}")
+        meta = json.loads(f.read(meta_length).decode("utf-8"))
+        data = f.read(data_length)
+    files = {name: data[start:start + length] for name, (start, length) in meta.pop("files").items()}
+    return meta, files
+
+
+class ResultWriter:
+    """
+    Ghi kết quả (/save-results) ở nền thay vì chặn luồng xử lý request.
+
+    - submit() trả về job_id ngay; trạng thái (queued, encoding, writing, done, failed) xem bằng status().
+      Trạng thái 'done' nghĩa là dữ liệu đã được fsync xuống đĩa.
+    - Ảnh của mỗi công việc được mã hóa JPEG song song trên nhiều luồng (cv2.imencode nhả GIL).
+    - storage='files': mỗi phiên một thư mục (như trước), được dựng trong thư mục tạm rồi đổi tên một lần.
+      storage='zip': mỗi phiên một file .zip duy nhất, ghi nguyên tử.
+      storage='segment': nối tiếp vào file segment dùng chung (segments/segment-NNNNNN.seg), vị trí từng
+      phiên được ghi vào segments/index.jsonl sau khi bản ghi đã fsync; đọc lại bằng read_segment_record().
+    - Hàng đợi có giới hạn; khi đầy, submit() ném WriterQueueFullError.
+    """
+
+    def __init__(self, output_dir: str, storage: str = 'files', num_workers: int = 2, encode_threads: int = 4,
+                 max_pending: int = 64, max_segment_bytes: int = 256 * 1024 * 1024, jpeg_quality: int = 95,
+                 max_job_history: int = 1000):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Kiểu lưu trữ không hợp lệ: {storage} (hỗ trợ: {', '.join(STORAGE_MODES)})")
+        self.output_dir = output_dir
+        self.storage = storage
+        self.num_workers = num_workers
+        self.max_segment_bytes = max_segment_bytes
+        self.jpeg_quality = jpeg_quality
+        self.max_job_history = max_job_history
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._encoder = ThreadPoolExecutor(max_workers=encode_threads, thread_name_prefix="result-encode")
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._segment_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._accepting = False
+        self._job_ids = itertools.count(1)
+
+    # ------------------------------------------------------------------
+    # Vòng đời
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._accepting or self._threads:
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._accepting = True
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"result-writer-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self, drain_timeout: float = 30.0) -> None:
+        """Ngừng nhận việc, ghi nốt các công việc đã nhận rồi dừng."""
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+            threads = list(self._threads)
+        deadline = time.time() + drain_timeout
+        for _ in threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.time()))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.time()))
+        self._encoder.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def submit(self, session_id: str, results_data: dict,
+               on_complete: Optional[Callable[[dict], None]] = None) -> str:
+        """Đưa một phiên vào hàng đợi ghi, trả về job_id. on_complete(job) được gọi khi ghi xong bền vững."""
+        if not self._accepting:
+            raise WriterClosedError("Bộ ghi kết quả không nhận thêm công việc.")
+        job_id = f"{int(time.time())}-{next(self._job_ids)}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "job_id": job_id,
+            "session_id": session_id,
+            "status": "queued",
+            "storage": self.storage,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "location": None,
+            "bytes": 0,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_job_history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest["status"] not in ("done", "failed"):
+                    break
+                self._jobs.pop(oldest_id)
+        try:
+            self._queue.put_nowait((job, results_data, on_complete))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise WriterQueueFullError("Hàng đợi ghi kết quả đã đầy.")
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Chờ công việc kết thúc (done/failed) rồi trả về trạng thái; hết thời gian thì trả về trạng thái hiện tại."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.status(job_id)
+            if job is None or job["status"] in ("done", "failed"):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(0.02)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # ------------------------------------------------------------------
+    # Nội bộ
+    # ------------------------------------------------------------------
+    def _set(self, job: dict, **changes) -> None:
+        with self._lock:
+            job.update(changes)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, results_data, on_complete = item
+            try:
+                self._set(job, status="encoding")
+                files, meta = self._encode(job["session_id"], results_data)
+                self._set(job, status="writing")
+                location = getattr(self, f"_write_{self.storage}")(job["session_id"], files, meta)
+                self._set(job, status="done", location=location, finished_at=time.time(),
+                          bytes=sum(len(data) for data in files.values()))
+            except Exception as e:
+                print(f"Lỗi khi lưu file: {e}")
+                self._set(job, status="failed", error=str(e), finished_at=time.time())
+                continue
+            if on_complete is not None:
+                try:
+                    on_complete(self.status(job["job_id"]))
+                except Exception as e:
+                    print(f"[CẢNH BÁO] Lỗi trong callback sau khi lưu: {e}")
+
+    def _encode(self, session_id: str, results_data: dict) -> Tuple["OrderedDict[str, bytes]", dict]:
+        """Mã hóa toàn bộ ảnh của một phiên song song; trả về (tên file -> bytes, metadata)."""
+        images = []
+        if results_data.get("result_image_np") is not None:
+            images.append(("result_image_with_box.jpg", results_data["result_image_np"]))
+        plates_meta = []
+        for i, plate in enumerate(results_data["plates"]):
+            text_for_filename = re.sub(r'[^A-Z0-9]', '_', plate["text"])
+            plate_meta = {"text": plate["text"], "confidence": plate["confidence"], "box": plate.get("box"),
+                          "ocr_tier": plate.get("ocr_tier")}
+            cropped_filename = f"plate_{i}_{text_for_filename}_cropped.jpg"
+            images.append((cropped_filename, plate["cropped_plate_np"]))
+            plate_meta["cropped"] = cropped_filename
+            if plate["cropped_plate_np"] is not None:
+                # Ảnh nhị phân không có sẵn trong kết quả: được tính (cùng lúc mã hóa) trên luồng mã hóa
+                binary_filename = f"plate_{i}_{text_for_filename}_binary.jpg"
+                images.append((binary_filename, (binarize_plate, plate["cropped_plate_np"])))
+                plate_meta["binary"] = binary_filename
+            plates_meta.append(plate_meta)
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+
+        def encode(image) -> bytes:
+            if isinstance(image, tuple):
+                make_image, source = image
+                image = make_image(source)
+            ok, buffer = cv2.imencode(".jpg", image, params)
+            if not ok:
+                raise ValueError("Không thể mã hóa ảnh JPEG.")
+            return buffer.tobytes()
+
+        encoded = self._encoder.map(encode, [image for _, image in images])
+        files: "OrderedDict[str, bytes]" = OrderedDict(zip((name for name, _ in images), encoded))
+        meta = {"session_id": session_id, "saved_at": time.time(), "plates": plates_meta}
+        files["results.json"] = json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")
+        return files, meta
+
+    def _write_files(self, session_id: str, files: Dict[str, bytes], meta: dict) -> str:
+        final_dir = os.path.join(self.output_dir, session_id)
+        tmp_dir = os.path.join(self.output_dir, f".{session_id}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmp_dir)
+        try:
+            for name, data in files.items():
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            _fsync_dir(tmp_dir)
+            if os.path.isdir(final_dir):
+                # Lưu lại cùng một phiên: thay thư mục cũ
+                old_dir = f"{tmp_dir}.old"
+                os.replace(final_dir, old_dir)
+                os.replace(tmp_dir, final_dir)
+                for name in os.listdir(old_dir):
+                    os.remove(os.path.join(old_dir, name))
+                os.rmdir(old_dir)
+            else:
+                os.replace(tmp_dir, final_dir)
+        except BaseException:
+            if os.path.isdir(tmp_dir):
+                for name in os.listdir(tmp_dir):
+                    os.remove(os.path.join(tmp_dir, name))
+                os.rmdir(tmp_dir)
+            raise
+        _fsync_dir(self.output_dir)
+        return final_dir
+
+    def _write_zip(self, session_id: str, files: Dict[str, bytes], meta: dict) -> str:
+        buffer = io.BytesIO()
+        # JPEG đã nén nên lưu nguyên (ZIP_STORED), chỉ nén file JSON
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for name, data in files.items():
+                compress_type = zipfile.ZIP_DEFLATED if name.endswith(".json") else zipfile.ZIP_STORED
+                archive.writestr(name, data, compress_type=compress_type)
+        path = os.path.join(self.output_dir, f"{session_id}.zip")
+        atomic_write(path, buffer.getvalue())
+        return path
+
+    def _write_segment(self, session_id: str, files: Dict[str, bytes], meta: dict) -> str:
+        offsets = {}
+        position = 0
+        for name, data in files.items():
+            offsets[name] = (position, len(data))
+            position += len(data)
+        record_meta = json.dumps({**meta, "files": offsets}, ensure_ascii=False).encode("utf-8")
+        header = _SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(record_meta), position)
+
+        segments_dir = os.path.join(self.output_dir, "segments")
+        with self._segment_lock:
+            os.makedirs(segments_dir, exist_ok=True)
+            path = self._current_segment(segments_dir)
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(header)
+                f.write(record_meta)
+                for data in files.values():
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # Chỉ ghi chỉ mục sau khi bản ghi đã bền vững: bản ghi dở dang ở cuối segment (do sự cố)
+            # không bao giờ được trỏ tới
+            entry = {"session_id": session_id, "segment": os.path.basename(path), "offset": offset,
+                     "length": _SEGMENT_HEADER.size + len(record_meta) + position}
+            with open(os.path.join(segments_dir, "index.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return f"{path}@{offset}"
+
+    def _current_segment(self, segments_dir: str) -> str:
+        """File segment đang ghi; chuyển sang file mới khi vượt max_segment_bytes."""
+        names = sorted(name for name in os.listdir(segments_dir) if name.endswith(".seg"))
+        if names:
+            path = os.path.join(segments_dir, names[-1])
+            if os.path.getsize(path) < self.max_segment_bytes:
+                return path
+            number = int(names[-1][len("segment-"):-len(".seg")]) + 1
+        else:
+            number = 1
+        return os.path.join(segments_dir, f"segment-{number:06d}.seg")
@@ -88,7 +88,7 @@ async function processImage() {
     formData.append('image', selectedFile);
 
     try {
-        const response = await fetch('/process-image', {
+        const response = await fetch('/process-image?response=urls', {
             method: 'POST',
             body: formData,
         });
@@ -111,7 +111,7 @@ async function processImage() {
 
 function displayResults(data) {
     currentSessionId = data.session_id;
-    resultImage.src = data.result_image_base64;
+    resultImage.src = data.result_image_url;
     plateResultsContainer.innerHTML = ''; 
 
     if (data.plates && data.plates.length > 0) {
@@ -126,11 +126,11 @@ function displayResults(data) {
                 <div class="plate-images-container">
                     <div class="plate-image-section">
                         <div class="plate-image-title">📸 Ảnh Biển Số</div>
-                        <img src="${plate.cropped_plate_base64}" class="plate-image" alt="Cropped Plate">
+                        <img src="${plate.cropped_plate_url}" class="plate-image" alt="Cropped Plate">
                     </div>
                     <div class="plate-image-section">
                         <div class="plate-image-title">⚫ Ảnh Nhị Phân</div>
-                        <img src="${plate.binary_plate_base64 || ''}" class="plate-image" alt="Binary Plate">
+                        <img src="${plate.binary_plate_url || ''}" class="plate-image" alt="Binary Plate">
                     </div>
                 </div>
             `;
@@ -161,9 +161,19 @@ async function saveResults() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ session_id: currentSessionId }),
         });
-        const data = await response.json();
+        let data = await response.json();
+
+        // Việc ghi file chạy ở nền: theo dõi trạng thái cho đến khi ghi xong
+        while (response.status === 202 && (data.status === 'accepted' || data.status === 'pending')) {
+            await new Promise(resolve => setTimeout(resolve, 300));
+            const statusResponse = await fetch(data.status_url || `/save-results/${data.job_id}`);
+            data = await statusResponse.json();
+            if (statusResponse.status !== 202) {
+                break;
+            }
+        }
 
-        if (response.ok && data.status === 'success') {
+        if (data.status === 'success') {
             showStatus(data.message, 'success');
         } else {
             showStatus(data.message || 'Lỗi không xác định khi lưu.', 'error');
@@ -0,0 +1,421 @@
+import argparse
+import json
+import time
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ocr_cache import PlateVoter
+
+Box = Tuple[int, int, int, int]
+
+
+def box_iou(a: Box, b: Box) -> float:
+    """IoU của hai box (x1, y1, x2, y2)."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+class StageStats:
+    """Thống kê độ trễ (ms) của từng bước xử lý trong pipeline."""
+
+    def __init__(self):
+        self._totals: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._max: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        ms = seconds * 1000.0
+        self._totals[stage] = self._totals.get(stage, 0.0) + ms
+        self._counts[stage] = self._counts.get(stage, 0) + 1
+        self._max[stage] = max(self._max.get(stage, 0.0), ms)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": self._counts[stage],
+                "avg_ms": self._totals[stage] / self._counts[stage],
+                "max_ms": self._max[stage],
+            }
+            for stage in self._totals
+        }
+
+
+class MotionDetector:
+    """
+    Phát hiện chuyển động bằng hiệu ảnh xám đã thu nhỏ giữa hai khung hình liên tiếp.
+    Rất rẻ so với YOLO nên dùng để quyết định có cần chạy phát hiện biển số hay không.
+    """
+
+    def __init__(self, min_changed_ratio: float = 0.002, pixel_threshold: int = 25, width: int = 320):
+        self.min_changed_ratio = min_changed_ratio
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self._previous: Optional[np.ndarray] = None
+        # Các điểm thay đổi ở lần update gần nhất (ảnh thu nhỏ), None ở khung hình đầu tiên
+        self.mask: Optional[np.ndarray] = None
+
+    def update(self, frame: np.ndarray) -> bool:
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, int(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            self.mask = None
+            return True
+        self.mask = cv2.absdiff(gray, previous) > self.pixel_threshold
+        return np.count_nonzero(self.mask) >= self.min_changed_ratio * self.mask.size
+
+
+class PlateTracker:
+    """
+    Bộ theo vết nhẹ cho các box biển số: ghép box mới với track cũ theo IoU,
+    nếu không chồng lấn thì theo khoảng cách tâm (tương đối theo kích thước box).
+    Giữa hai lần phát hiện, vị trí track được ngoại suy theo vận tốc ước lượng.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_centroid_distance: float = 1.0,
+                 max_missed_frames: int = 30, min_hits: int = 2):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed_frames = max_missed_frames
+        self.min_hits = min_hits
+        self.tracks: Dict[int, dict] = {}
+        self.removed: List[dict] = []
+        self._next_id = 0
+
+    @staticmethod
+    def _predict(track: dict, frame_index: int) -> Box:
+        gap = frame_index - track["last_frame"]
+        dx, dy = track["velocity"]
+        x1, y1, x2, y2 = track["box"]
+        return (int(x1 + dx * gap), int(y1 + dy * gap), int(x2 + dx * gap), int(y2 + dy * gap))
+
+    def _match_score(self, predicted: Box, box: Box) -> float:
+        """Điểm ghép càng lớn càng tốt; 0 nghĩa là không ghép được."""
+        iou = box_iou(predicted, box)
+        if iou >= self.iou_threshold:
+            return 1.0 + iou
+        pcx, pcy = (predicted[0] + predicted[2]) / 2, (predicted[1] + predicted[3]) / 2
+        bcx, bcy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        diag = max(1.0, ((box[2] - box[0]) ** 2 + (box[3] - box[1]) ** 2) ** 0.5)
+        distance = ((pcx - bcx) ** 2 + (pcy - bcy) ** 2) ** 0.5 / diag
+        if distance <= self.max_centroid_distance:
+            return 1.0 - distance / (self.max_centroid_distance + 1e-6)
+        return 0.0
+
+    def update(self, detections: List[Tuple[int, int, int, int, float]], frame_index: int) -> List[dict]:
+        """Cập nhật tracker với các box phát hiện được ở khung hình frame_index, trả về các track đang sống."""
+        predictions = {tid: self._predict(t, frame_index) for tid, t in self.tracks.items()}
+        candidates = []
+        for tid, predicted in predictions.items():
+            for d, det in enumerate(detections):
+                score = self._match_score(predicted, det[:4])
+                if score > 0:
+                    candidates.append((score, tid, d))
+        candidates.sort(reverse=True)
+
+        matched_tracks, matched_dets = set(), set()
+        for score, tid, d in candidates:
+            if tid in matched_tracks or d in matched_dets:
+                continue
+            matched_tracks.add(tid)
+            matched_dets.add(d)
+            track = self.tracks[tid]
+            x1, y1, x2, y2, conf = detections[d]
+            gap = max(1, frame_index - track["last_frame"])
+            old = track["box"]
+            track["velocity"] = (((x1 + x2) - (old[0] + old[2])) / 2 / gap, ((y1 + y2) - (old[1] + old[3])) / 2 / gap)
+            track["box"] = (x1, y1, x2, y2)
+            track["confidence"] = conf
+            track["hits"] += 1
+            track["missed"] = 0
+            track["last_frame"] = frame_index
+
+        for tid in list(self.tracks):
+            if tid not in matched_tracks:
+                self.tracks[tid]["missed"] += 1
+        self.age_out(frame_index)
+
+        for d, (x1, y1, x2, y2, conf) in enumerate(detections):
+            if d in matched_dets:
+                continue
+            self.tracks[self._next_id] = {
+                "track_id": self._next_id,
+                "box": (x1, y1, x2, y2),
+                "confidence": conf,
+                "velocity": (0.0, 0.0),
+                "hits": 1,
+                "missed": 0,
+                "first_frame": frame_index,
+                "last_frame": frame_index,
+                "ocr_attempts": 0,
+                "ocr_done": False,
+                "voter": PlateVoter(),
+                "text": None,
+            }
+            self._next_id += 1
+
+        return list(self.tracks.values())
+
+    def age_out(self, frame_index: int) -> None:
+        """Xóa các track đã quá lâu không được phát hiện lại, đưa chúng vào danh sách removed."""
+        for tid in list(self.tracks):
+            if frame_index - self.tracks[tid]["last_frame"] > self.max_missed_frames:
+                self.removed.append(self.tracks.pop(tid))
+
+    def pop_removed(self) -> List[dict]:
+        """Lấy (và xóa) danh sách các track đã bị loại từ lần gọi trước."""
+        removed, self.removed = self.removed, []
+        return removed
+
+
+class StreamProcessor:
+    """
+    Pipeline nhận dạng biển số cho video/luồng camera (file, RTSP/HTTP URL hoặc chỉ số webcam).
+
+    - Khi đang có xe được theo vết, YOLO chạy mỗi detect_every_n khung hình; khi chưa có xe nào,
+      YOLO chỉ chạy ở khung hình có chuyển động (use_motion=False: luôn chạy mỗi detect_every_n khung hình).
+    - Các box được theo vết giữa các khung hình, OCR chỉ chạy cho mỗi xe (track) chứ không phải mỗi khung hình:
+      mỗi track được đọc tối đa reads_per_track lần rồi bỏ phiếu theo từng ký tự (PlateVoter) để ra kết quả ổn định.
+    - Kết quả được phát ra dưới dạng sự kiện (dictionary) qua generator run() và/hoặc callback.
+    - Nếu anpr_system bật chế độ tile (tile_size), YOLO chỉ chạy trên các tile có chuyển động hoặc chứa xe
+      đang theo vết; cứ full_scan_every lần phát hiện thì quét toàn bộ tile một lần (bắt cả xe đứng yên).
+    """
+
+    def __init__(self, anpr_system, detect_every_n: int = 5, use_motion: bool = True,
+                 tracker: Optional[PlateTracker] = None, motion_detector: Optional[MotionDetector] = None,
+                 reads_per_track: int = 3, max_ocr_attempts: int = 5, reconnect_attempts: int = 5,
+                 full_scan_every: int = 10):
+        self.anpr_system = anpr_system
+        self.detect_every_n = max(1, detect_every_n)
+        self.use_motion = use_motion
+        self.tracker = tracker or PlateTracker()
+        self.motion_detector = motion_detector or MotionDetector()
+        self.reads_per_track = max(1, reads_per_track)
+        self.max_ocr_attempts = max(max_ocr_attempts, self.reads_per_track)
+        self.reconnect_attempts = reconnect_attempts
+        self.full_scan_every = max(1, full_scan_every)
+
+        self.stage_stats = StageStats()
+        self.frames_read = 0
+        self.frames_detected = 0
+        self.ocr_calls = 0
+        self.events_emitted = 0
+        self._started_at: Optional[float] = None
+        # Cache OCR chỉ dùng lại kết quả của ảnh gần giống trong cùng một track của luồng này
+        self._cache_scope = uuid.uuid4().hex
+
+    @staticmethod
+    def _open(source):
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        return cv2.VideoCapture(source)
+
+    def _read_frames(self, source, max_frames: Optional[int]) -> Iterator[Tuple[int, Optional[np.ndarray], float]]:
+        """
+        Đọc khung hình từ nguồn. Với các khung hình chắc chắn không cần xử lý (không chạy YOLO và
+        không cần kiểm tra chuyển động) chỉ gọi grab() để bỏ qua bước giải mã, khi đó frame là None.
+        """
+        is_stream = isinstance(source, str) and "://" in source
+        capture = self._open(source)
+        if not capture.isOpened():
+            raise IOError(f"Không thể mở nguồn video: {source}")
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+
+        frame_index = 0
+        failures = 0
+        try:
+            while max_frames is None or frame_index < max_frames:
+                started = time.perf_counter()
+                need_pixels = self.use_motion or frame_index % self.detect_every_n == 0
+                if need_pixels:
+                    ok, frame = capture.read()
+                else:
+                    ok, frame = capture.grab(), None
+                self.stage_stats.add("read", time.perf_counter() - started)
+
+                if not ok:
+                    if is_stream and failures < self.reconnect_attempts:
+                        failures += 1
+                        print(f"[CẢNH BÁO] Mất kết nối tới {source}, thử kết nối lại ({failures}/{self.reconnect_attempts})...")
+                        capture.release()
+                        time.sleep(min(2 ** failures, 10))
+                        capture = self._open(source)
+                        continue
+                    break
+
+                failures = 0
+                timestamp = frame_index / source_fps if source_fps > 0 and not is_stream else time.time()
+                yield frame_index, frame, timestamp
+                frame_index += 1
+        finally:
+            capture.release()
+
+    def _recognize_track(self, frame: np.ndarray, track: dict) -> None:
+        """Đọc biển số của track ở khung hình hiện tại và thêm kết quả vào phiếu bầu của track."""
+        x1, y1, x2, y2 = track["box"]
+        h, w = frame.shape[:2]
+        crop = frame[max(0, y1):min(h, y2), max(0, x1):min(w, x2)]
+        started = time.perf_counter()
+        plate_text, ocr_conf, plate_roi, _ = self.anpr_system._recognize_plate(
+            crop, scope=(self._cache_scope, track["track_id"]))
+        self.stage_stats.add("ocr", time.perf_counter() - started)
+        self.ocr_calls += 1
+        track["ocr_attempts"] += 1
+        if plate_roi is not None:
+            track["voter"].add(plate_text, ocr_conf)
+
+    def _finish_track(self, track: dict, frame_index: int, timestamp: float) -> Optional[dict]:
+        """Kết thúc việc đọc một track: bỏ phiếu và tạo sự kiện (None nếu không có lần đọc hợp lệ nào)."""
+        track["ocr_done"] = True
+        plate_text, agreement = track["voter"].result()
+        if plate_text is None:
+            return None
+        track["text"] = plate_text
+        self.events_emitted += 1
+        return {
+            "track_id": track["track_id"],
+            "text": plate_text,
+            "confidence": track["confidence"],
+            "votes": len(track["voter"]),
+            "agreement": agreement,
+            "box": list(track["box"]),
+            "frame_index": frame_index,
+            "timestamp": timestamp,
+        }
+
+    def _flush_removed(self, frame_index: int, timestamp: float) -> List[dict]:
+        """Track bị mất trước khi đủ số lần đọc vẫn được bỏ phiếu với các lần đọc đã có."""
+        events = []
+        for track in self.tracker.pop_removed():
+            if self.anpr_system.ocr_cache is not None:
+                self.anpr_system.ocr_cache.drop_scope((self._cache_scope, track["track_id"]))
+            if not track["ocr_done"]:
+                event = self._finish_track(track, frame_index, timestamp)
+                if event is not None:
+                    events.append(event)
+        return events
+
+    def run(self, source, callback: Optional[Callable[[dict], None]] = None,
+            max_frames: Optional[int] = None) -> Iterator[dict]:
+        """Xử lý nguồn video và phát ra các sự kiện nhận dạng biển số (mỗi xe một sự kiện)."""
+        self._started_at = time.perf_counter()
+        frame_index, timestamp = 0, 0.0
+
+        for frame_index, frame, timestamp in self._read_frames(source, max_frames):
+            self.frames_read += 1
+
+            run_detection = frame_index % self.detect_every_n == 0
+            if self.use_motion and frame is not None:
+                started = time.perf_counter()
+                moving = self.motion_detector.update(frame)
+                self.stage_stats.add("motion", time.perf_counter() - started)
+                if not self.tracker.tracks:
+                    # Không có xe nào đang được theo vết: chỉ chạy YOLO khi có chuyển động (xe mới đi vào),
+                    # khung cảnh tĩnh thì bỏ qua kể cả ở khung hình định kỳ
+                    run_detection = moving
+
+            if not run_detection or frame is None:
+                self.tracker.age_out(frame_index)
+                for event in self._flush_removed(frame_index, timestamp):
+                    if callback is not None:
+                        callback(event)
+                    yield event
+                continue
+
+            started = time.perf_counter()
+            if getattr(self.anpr_system, "tile_size", None):
+                full_scan = self.frames_detected % self.full_scan_every == 0
+                detections = self.anpr_system.detect_plates_tiled(
+                    frame,
+                    motion_mask=None if full_scan or not self.use_motion else self.motion_detector.mask,
+                    prior_boxes=None if full_scan else [self.tracker._predict(track, frame_index)
+                                                        for track in self.tracker.tracks.values()])
+            else:
+                detections = self.anpr_system.detect_plates([frame])[0]
+            self.stage_stats.add("detect", time.perf_counter() - started)
+            self.frames_detected += 1
+
+            started = time.perf_counter()
+            tracks = self.tracker.update(detections, frame_index)
+            self.stage_stats.add("track", time.perf_counter() - started)
+
+            events = self._flush_removed(frame_index, timestamp)
+            for track in tracks:
+                # Chỉ OCR các track vừa được phát hiện lại ở khung hình này và đã đủ ổn định
+                if track["ocr_done"] or track["last_frame"] != frame_index or track["hits"] < self.tracker.min_hits:
+                    continue
+                self._recognize_track(frame, track)
+                if len(track["voter"]) >= self.reads_per_track or track["ocr_attempts"] >= self.max_ocr_attempts:
+                    event = self._finish_track(track, frame_index, timestamp)
+                    if event is not None:
+                        events.append(event)
+
+            for event in events:
+                if callback is not None:
+                    callback(event)
+                yield event
+
+        # Hết nguồn video: bỏ phiếu cho các track còn dở
+        for track in list(self.tracker.tracks.values()):
+            if not track["ocr_done"]:
+                event = self._finish_track(track, frame_index, timestamp)
+                if event is not None:
+                    if callback is not None:
+                        callback(event)
+                    yield event
+
+    def stats(self) -> dict:
+        """FPS đạt được và độ trễ trung bình/lớn nhất của từng bước."""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "frames_read": self.frames_read,
+            "frames_detected": self.frames_detected,
+            "ocr_calls": self.ocr_calls,
+            "events": self.events_emitted,
+            "elapsed_seconds": elapsed,
+            "fps": self.frames_read / elapsed if elapsed > 0 else 0.0,
+            "stages": self.stage_stats.summary(),
+            "ocr_cache": self.anpr_system.ocr_cache.stats() if self.anpr_system.ocr_cache is not None else None,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nhận dạng biển số từ file video hoặc luồng camera (RTSP/HTTP).")
+    parser.add_argument("--source", required=True, help="Đường dẫn file video, URL luồng hoặc chỉ số webcam")
+    parser.add_argument("--model", default="../runs/yolo_bien_so_xe_detector/weights/best.pt", help="File trọng số YOLO")
+    parser.add_argument("--backend", default="ultralytics", help="Backend phát hiện: ultralytics hoặc onnx")
+    parser.add_argument("--every", type=int, default=5, help="Chạy YOLO mỗi N khung hình")
+    parser.add_argument("--no-motion", action="store_true", help="Không dùng phát hiện chuyển động")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--tile-size", type=int, default=None, help="Bật phát hiện theo tile với kích thước này (camera 4K)")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Tỉ lệ chồng lấn giữa hai tile liền kề")
+    parser.add_argument("--output", default=None, help="Ghi sự kiện ra file JSON Lines")
+    args = parser.parse_args()
+
+    from anpr_core import ANPRSystem
+
+    processor = StreamProcessor(ANPRSystem(yolo_model_path=args.model, detector_backend=args.backend,
+                                           tile_size=args.tile_size, tile_overlap=args.tile_overlap),
+                                detect_every_n=args.every, use_motion=not args.no_motion)
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    try:
+        for event in processor.run(args.source, max_frames=args.max_frames):
+            print(f"[BIỂN SỐ] #{event['track_id']} {event['text']} ({event['confidence']:.2f}, "
+                  f"{event['votes']} lần đọc) @ khung hình {event['frame_index']}")
+            if output:
+                output.write(json.dumps(event, ensure_ascii=False) + "\n")
+                output.flush()
+    finally:
+        if output:
+            output.close()
+    print(json.dumps(processor.stats(), indent=2, ensure_ascii=False))
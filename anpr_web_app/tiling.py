@@ -0,0 +1,114 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Cách gộp box của các tile chồng lấn: 'nms' giữ box điểm cao nhất của mỗi cụm, 'wbf' (weighted boxes fusion)
+# lấy trung bình toạ độ các box trong cụm theo trọng số là điểm tin cậy
+MERGE_METHODS = ('nms', 'wbf')
+
+Tile = Tuple[int, int, int, int]
+
+
+def _axis_starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Tile cuối luôn khớp mép ảnh, không để phần dư nhỏ hơn một tile
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: float = 0.2) -> List[Tile]:
+    """
+    Chia ảnh thành các tile vuông tile_size x tile_size, hai tile liền kề chồng lên nhau một tỉ lệ overlap,
+    để biển số nằm trên đường cắt vẫn lọt trọn trong ít nhất một tile (khi biển số nhỏ hơn phần chồng lấn).
+    Trả về danh sách (x1, y1, x2, y2) theo hàng, từ trên xuống và từ trái sang phải.
+    """
+    stride = max(1, int(round(tile_size * (1.0 - overlap))))
+    return [(x, y, min(width, x + tile_size), min(height, y + tile_size))
+            for y in _axis_starts(height, tile_size, stride)
+            for x in _axis_starts(width, tile_size, stride)]
+
+
+def _intersects(tile: Tile, box: Sequence[float]) -> bool:
+    return box[0] < tile[2] and box[2] > tile[0] and box[1] < tile[3] and box[3] > tile[1]
+
+
+def select_tiles(tiles: List[Tile], image_shape, motion_mask: Optional[np.ndarray] = None,
+                 prior_boxes: Optional[Sequence[Sequence[float]]] = None, min_motion_ratio: float = 0.002) -> List[int]:
+    """
+    Chỉ số các tile cần chạy YOLO: tile có chuyển động (tỉ lệ điểm thay đổi trong motion_mask >= min_motion_ratio;
+    motion_mask có thể nhỏ hơn ảnh, toạ độ được đổi theo tỉ lệ) hoặc giao với một box đã phát hiện trước đó
+    (biển số đang được theo vết, có thể đã dừng lại). Không có motion_mask (khung hình đầu, hoặc không dùng
+    phát hiện chuyển động) thì không biết tile nào tĩnh, nên chạy mọi tile.
+    """
+    if motion_mask is None:
+        return list(range(len(tiles)))
+    height, width = image_shape[:2]
+    selected = []
+    for index, tile in enumerate(tiles):
+        if prior_boxes and any(_intersects(tile, box) for box in prior_boxes):
+            selected.append(index)
+            continue
+        if motion_mask is not None:
+            scale_y, scale_x = motion_mask.shape[0] / height, motion_mask.shape[1] / width
+            region = motion_mask[int(tile[1] * scale_y):max(int(tile[1] * scale_y) + 1, int(tile[3] * scale_y)),
+                                 int(tile[0] * scale_x):max(int(tile[0] * scale_x) + 1, int(tile[2] * scale_x))]
+            if region.size and np.count_nonzero(region) >= min_motion_ratio * region.size:
+                selected.append(index)
+    return selected
+
+
+def tile_box_truncated(box: Sequence[float], tile: Tile, image_shape, margin: int = 2) -> bool:
+    """Box (toạ độ trong tile) chạm cạnh tile tại chỗ cạnh đó là đường cắt bên trong ảnh, không phải mép ảnh."""
+    height, width = image_shape[:2]
+    x1, y1, x2, y2 = box[:4]
+    tile_w, tile_h = tile[2] - tile[0], tile[3] - tile[1]
+    return bool((x1 <= margin and tile[0] > 0) or (y1 <= margin and tile[1] > 0)
+                or (x2 >= tile_w - margin and tile[2] < width) or (y2 >= tile_h - margin and tile[3] < height))
+
+
+def merge_boxes(boxes: np.ndarray, iou_threshold: float = 0.5, method: str = 'nms',
+                truncated: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Gộp các box (N, 5) [x1, y1, x2, y2, conf] phát hiện trên nhiều tile (đã đổi về toạ độ ảnh gốc).
+    Hai box được coi là cùng một biển số khi IoU hoặc tỉ lệ giao trên diện tích box nhỏ hơn >= iou_threshold:
+    biển số bị đường cắt tile chia đôi cho ra một box cụt nằm gọn trong box đầy đủ ở tile bên cạnh,
+    IoU của hai box này thấp nhưng box cụt vẫn phải bị loại.
+    truncated: cờ (N,) đánh dấu box chạm đường cắt bên trong ảnh của tile chứa nó (có thể bị cụt, xem
+    tile_box_truncated); trong mỗi cụm, box không cụt luôn được ưu tiên giữ lại trước box cụt dù điểm thấp hơn.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Cách gộp box không hợp lệ: {method} (hỗ trợ: {', '.join(MERGE_METHODS)})")
+    if len(boxes) <= 1:
+        return boxes.astype(np.float32).reshape(-1, 5)
+
+    coords, scores = boxes[:, :4].astype(np.float64), boxes[:, 4].astype(np.float64)
+    areas = (coords[:, 2] - coords[:, 0]) * (coords[:, 3] - coords[:, 1])
+    if truncated is None:
+        order = scores.argsort()[::-1]
+    else:
+        order = np.lexsort((-scores, np.asarray(truncated, dtype=bool)))
+    merged = []
+    while order.size > 0:
+        i, rest = order[0], order[1:]
+        xx1 = np.maximum(coords[i, 0], coords[rest, 0])
+        yy1 = np.maximum(coords[i, 1], coords[rest, 1])
+        xx2 = np.minimum(coords[i, 2], coords[rest, 2])
+        yy2 = np.minimum(coords[i, 3], coords[rest, 3])
+        inter = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        ios = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        fused = iou >= iou_threshold
+        same = fused | (ios >= iou_threshold)
+        if method == 'wbf':
+            # Chỉ lấy trung bình các box gần trùng nhau; box cụt (chỉ trùng theo tỉ lệ giao) bị loại, không
+            # được tính vào trung bình vì sẽ làm box co lại
+            cluster = np.concatenate(([i], rest[fused]))
+            weights = scores[cluster] / scores[cluster].sum()
+            box = (coords[cluster] * weights[:, None]).sum(axis=0)
+        else:
+            box = coords[i]
+        merged.append([*box, scores[i]])
+        order = rest[~same]
+    return np.asarray(merged, dtype=np.float32)
@@ -0,0 +1,248 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import OCR_TIERS, ANPRSystem  # noqa: E402
+from metrics import Metrics  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Mô hình phát hiện biển số (file .pt cho backend 'ultralytics', .onnx cho backend 'onnx')
+WEIGHTS_PATH = "runs/yolo_bien_so_xe_detector/weights/best.pt"
+
+# Thư mục ảnh mặc định
+IMAGES_DIR = "dataset/images"
+
+# Số ảnh chạy thử trước khi đo (không tính vào kết quả)
+NUM_WARMUP_IMAGES = 4
+
+# Các giá trị nhãn stage của anpr_stage_seconds do ANPRSystem ghi
+STAGES = ("decode", "detection", "layout", "preprocessing", "ocr", "formatting")
+
+# ==============================================================================
+# PHẦN 2: ĐO ĐẠC
+# ==============================================================================
+
+
+def list_images(paths, limit=None):
+    """Liệt kê ảnh từ các thư mục/mẫu glob/file, sắp xếp để các lần chạy so sánh được với nhau."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = glob.glob(os.path.join(path, "*"))
+        else:
+            candidates = glob.glob(path)
+        files.extend(f for f in candidates if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    files = sorted(set(files))
+    return files[:limit] if limit else files
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(values.max()),
+        "total_ms": float(values.sum()),
+    }
+
+
+class StageRecorder:
+    """
+    Gom kết quả từ nhiều luồng: thời gian end-to-end (ms) của từng lô đo ở đây, còn thời gian từng bước
+    được lấy từ anpr_system.metrics (cùng số liệu với /metrics của web app) sau mỗi lô. Từng giá trị đều
+    được giữ lại (Metrics(keep_samples=True)) nên phân vị là chính xác, không bị làm tròn theo ngưỡng histogram.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {"end_to_end": [], "per_image": []}
+        self.metrics = Metrics(keep_samples=True)
+        self.plates = 0
+        self.na_plates = 0
+        self.failed_images = 0
+        self.tiers = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds * 1000.0)
+
+    def count(self, plates=0, na_plates=0, failed_images=0, tier=None):
+        with self._lock:
+            if tier is not None:
+                self.tiers[tier] = self.tiers.get(tier, 0) + 1
+            self.plates += plates
+            self.na_plates += na_plates
+            self.failed_images += failed_images
+
+    def stages(self):
+        """
+        Thời gian từng bước (anpr_stage_seconds) và từng bậc OCR (anpr_ocr_tier_seconds), rồi end-to-end.
+        Gọi một lần khi đã đo xong (số liệu của self.metrics được lấy ra và xóa).
+        """
+        samples = self.metrics.drain()["samples"]
+
+        def to_ms(values):
+            return [value * 1000.0 for value in values]
+
+        stages = {}
+        for stage in STAGES:
+            stages[stage] = percentiles(to_ms(samples.get(("anpr_stage_seconds", (("stage", stage),)), [])))
+        for (name, labels), values in sorted(samples.items()):
+            if name == "anpr_ocr_tier_seconds":
+                stages[f"tier_{dict(labels)['tier']}"] = percentiles(to_ms(values))
+        with self._lock:
+            stages.update({stage: percentiles(samples) for stage, samples in self.samples.items()})
+        return stages
+
+
+def run_batch(anpr_system, images_bytes, recorder, batch_size):
+    """
+    Đo đúng đường xử lý của web app: ANPRSystem.process_images_in_memory cho một lô ảnh. Thời gian từng bước
+    (decode, detection, layout, preprocessing, ocr, formatting) và từng bậc OCR do chính ANPRSystem ghi vào
+    anpr_system.metrics, được chuyển sang recorder sau mỗi lô.
+    """
+    started = time.perf_counter()
+    results = anpr_system.process_images_in_memory(images_bytes, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    recorder.metrics.merge(anpr_system.metrics.drain())
+
+    recorder.add("end_to_end", elapsed)
+    for _ in images_bytes:
+        recorder.add("per_image", elapsed / len(images_bytes))
+    for result in results:
+        if "error" in result:
+            recorder.count(failed_images=1)
+            continue
+        for plate in result["plates"]:
+            recorder.count(plates=1, na_plates=int(plate["text"] == "N/A"), tier=plate["ocr_tier"])
+
+
+def run_benchmark(image_paths, weights_path, backend, concurrency, batch_size, warmup, ocr_tiers=OCR_TIERS):
+    """
+    Mỗi luồng có ANPRSystem riêng (mô hình YOLO/EasyOCR không được chia sẻ giữa các luồng)
+    và lần lượt lấy các lô ảnh để xử lý. Ảnh được đọc sẵn vào RAM để không đo thời gian đọc đĩa.
+    """
+    images_bytes = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            images_bytes.append(f.read())
+    batches = [images_bytes[i:i + batch_size] for i in range(0, len(images_bytes), batch_size)]
+
+    print(f">>> Tải {concurrency} bản ANPRSystem (backend: {backend}) <<<")
+    started = time.perf_counter()
+    # Tắt cache OCR để đo đúng chi phí OCR khi ảnh lặp lại
+    systems = [ANPRSystem(weights_path, ocr_cache_size=0, detector_backend=backend, warmup=True,
+                          ocr_tiers=ocr_tiers)
+               for _ in range(concurrency)]
+    load_seconds = time.perf_counter() - started
+
+    warmup_recorder = StageRecorder()
+    for anpr_system in systems:
+        anpr_system.metrics.keep_samples = True
+        if warmup:
+            run_batch(anpr_system, images_bytes[:warmup], warmup_recorder, batch_size)
+        # Bỏ số liệu của lúc tải mô hình và chạy thử
+        anpr_system.metrics.drain()
+
+    recorder = StageRecorder()
+    local = threading.local()
+    free_systems = list(systems)
+    free_lock = threading.Lock()
+
+    def worker(batch):
+        if not hasattr(local, "system"):
+            with free_lock:
+                local.system = free_systems.pop()
+        run_batch(local.system, batch, recorder, batch_size)
+
+    print(f">>> Đo {len(images_bytes)} ảnh, batch_size={batch_size}, concurrency={concurrency} <<<")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, batches))
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        "config": {
+            "weights": weights_path,
+            "backend": backend,
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "ocr_tiers": list(ocr_tiers),
+            "warmup_images": warmup,
+            "num_images": len(images_bytes),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "model_load_seconds": load_seconds,
+        "wall_seconds": wall_seconds,
+        "images_per_second": len(images_bytes) / wall_seconds if wall_seconds > 0 else 0.0,
+        "plates": recorder.plates,
+        "na_plates": recorder.na_plates,
+        "failed_images": recorder.failed_images,
+        "ocr_tiers": recorder.tiers,
+        "stages": recorder.stages(),
+    }
+
+
+def print_report(report):
+    print(f"\n>>> KẾT QUẢ ({report['config']['num_images']} ảnh) <<<")
+    print(f"  - Thông lượng: {report['images_per_second']:.2f} ảnh/s (tổng {report['wall_seconds']:.2f}s)")
+    print(f"  - Biển số: {report['plates']} (N/A: {report['na_plates']}), ảnh lỗi: {report['failed_images']}")
+    if report["ocr_tiers"]:
+        tiers = ", ".join(f"{tier}={count}" for tier, count in report["ocr_tiers"].items())
+        print(f"  - Bậc OCR đọc được biển số: {tiers}")
+    print(f"  {'bước':<16}{'số lần':>8}{'tb ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in report["stages"].items():
+        if not stats["count"]:
+            continue
+        print(f"  {stage:<16}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo thông lượng và độ trễ từng bước của pipeline ANPR.")
+    parser.add_argument("images", nargs="*", default=[IMAGES_DIR], help="Thư mục, mẫu glob hoặc file ảnh")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--backend", default="ultralytics", choices=("ultralytics", "onnx"))
+    parser.add_argument("--concurrency", type=int, default=1, help="Số luồng xử lý song song")
+    parser.add_argument("--batch-size", type=int, default=1, help="Số ảnh mỗi lô YOLO/EasyOCR")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ dùng N ảnh đầu tiên")
+    parser.add_argument("--warmup", type=int, default=NUM_WARMUP_IMAGES, help="Số ảnh chạy thử trước khi đo")
+    parser.add_argument("--ocr-tiers", default=",".join(OCR_TIERS),
+                        help="Các bậc OCR theo thứ tự, phân cách bằng dấu phẩy (ví dụ: full để đo pipeline cũ)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    image_paths = list_images(args.images, args.limit)
+    if not image_paths:
+        print(f"[LỖI] Không tìm thấy ảnh nào trong: {', '.join(args.images)}")
+        sys.exit(1)
+
+    report = run_benchmark(image_paths, args.weights, args.backend, max(1, args.concurrency),
+                           max(1, args.batch_size), args.warmup, tuple(args.ocr_tiers.split(",")))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã ghi kết quả: {args.output}")
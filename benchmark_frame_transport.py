@@ -0,0 +1,270 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmark_anpr import list_images, percentiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import ANPRSystem  # noqa: E402
+from frame_ring import FrameRing, SlotDescriptor, export_frame_results, resolve_frame_args  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Các cách chuyển ảnh từ tiến trình nhận ảnh sang worker suy luận (và kết quả về), cùng qua multiprocessing.Queue
+# như InferenceWorkerPool:
+#   pipe-bytes:   gửi bytes JPEG, worker giải mã; ảnh kết quả và ảnh biển số được pickle gửi về (như /process-image)
+#   pipe-decoded: bên nhận ảnh giải mã rồi pickle cả ảnh đã giải mã sang worker (ví dụ khung hình video)
+#   shm:          bên nhận ảnh giải mã vào một slot của FrameRing, chỉ SlotDescriptor đi qua pipe; worker đọc view
+#                 của slot, vẽ box tại chỗ và ghi ảnh biển số vào phần trống của slot
+MODES = ("pipe-bytes", "pipe-decoded", "shm")
+DATASET_DIR = "dataset"
+NUM_IMAGES = 200
+RING_SLOTS = 4
+# Mảng/bytes nhỏ hơn ngưỡng này (box, văn bản, descriptor) không được tính là một lần sao chép ảnh
+MIN_BUFFER_BYTES = 1024
+
+# ==============================================================================
+# PHẦN 2: ĐO ĐẠC
+# ==============================================================================
+
+
+def plate_boxes(image_path, width, height):
+    """Box biển số theo nhãn YOLO của ảnh (dataset/labels), dùng thay YOLO khi không có mô hình."""
+    label_path = os.path.join(os.path.dirname(os.path.dirname(image_path)), "labels",
+                              os.path.splitext(os.path.basename(image_path))[0] + ".txt")
+    boxes = []
+    if not os.path.exists(label_path):
+        return boxes
+    with open(label_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            cx, cy, w, h = (float(value) for value in parts[1:5])
+            boxes.append((int((cx - w / 2) * width), int((cy - h / 2) * height),
+                          int((cx + w / 2) * width), int((cy + h / 2) * height)))
+    return boxes
+
+
+def simulated_process(frame, boxes, annotate):
+    """
+    Phần việc của ANPRSystem.process_frame ảnh hưởng tới việc chuyển dữ liệu (cắt biển số thành bản sao riêng, vẽ box
+    tại chỗ), với box lấy từ nhãn thay cho YOLO, để đo riêng chi phí vận chuyển khi không có mô hình.
+    """
+    height, width = frame.shape[:2]
+    plates = []
+    for x1, y1, x2, y2 in boxes:
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+        if x1 >= x2 or y1 >= y2:
+            continue
+        plates.append({"text": "N/A", "confidence": 1.0, "box": [x1, y1, x2, y2],
+                       "cropped_plate_np": ANPRSystem._upscale_plate(frame[y1:y2, x1:x2]), "ocr_tier": None})
+    if annotate:
+        for plate in plates:
+            ANPRSystem._draw_plate(frame, tuple(plate["box"]), plate["text"])
+    return {"result_image_np": frame if annotate else None, "plates": plates}
+
+
+def _transport_worker(ring_handle, weights, job_queue, result_queue):
+    """Worker của benchmark: nhận (chế độ, ảnh, box, annotate), xử lý như worker của InferenceWorkerPool."""
+    ring = FrameRing.attach(*ring_handle)
+    anpr_system = ANPRSystem(yolo_model_path=weights, warmup=True) if weights else None
+    result_queue.put("ready")
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        mode, payload, boxes, annotate = job
+        frames = []
+        if mode == "shm":
+            (payload,), frames = resolve_frame_args(ring, (payload,))
+        if anpr_system is not None:
+            result = (anpr_system.process_image_in_memory(payload, annotate) if mode == "pipe-bytes"
+                      else anpr_system.process_frame(payload, annotate))
+        else:
+            frame = ANPRSystem._decode_image(payload) if mode == "pipe-bytes" else payload
+            result = simulated_process(frame, boxes, annotate)
+        if frames:
+            result = export_frame_results(ring, result, frames)
+        result_queue.put(result)
+
+
+def buffer_stats(message):
+    """(số mảng/bytes ảnh, tổng byte của chúng) trong một thông điệp đi qua pipe."""
+    count = total = 0
+    stack = [message]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)) and not isinstance(value, SlotDescriptor):
+            stack.extend(value)
+        elif isinstance(value, (bytes, np.ndarray)):
+            size = value.nbytes if isinstance(value, np.ndarray) else len(value)
+            if size >= MIN_BUFFER_BYTES:
+                count += 1
+                total += size
+    return count, total
+
+
+def slot_writes(message):
+    """(số lần ghi vào slot, số byte) của kết quả ở chế độ shm: ảnh biển số được worker chép vào slot."""
+    descriptors = [plate["cropped_plate_np"] for plate in message.get("plates", [])
+                   if isinstance(plate.get("cropped_plate_np"), SlotDescriptor)]
+    return len(descriptors), sum(descriptor.nbytes for descriptor in descriptors)
+
+
+def load_inputs(image_paths, resize_width):
+    """(bytes JPEG, box) của từng ảnh; resize_width: phóng ảnh lên (ví dụ 1920) để mô phỏng khung hình camera."""
+    inputs = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        height, width = image.shape[:2]
+        scale = resize_width / width if resize_width else 1.0
+        if scale != 1.0:
+            image = cv2.resize(image, (resize_width, int(round(height * scale))), interpolation=cv2.INTER_LINEAR)
+        ok, encoded = cv2.imencode(".jpg", image)
+        if ok:
+            inputs.append((encoded.tobytes(), plate_boxes(path, image.shape[1], image.shape[0])))
+    return inputs
+
+
+def run_mode(mode, inputs, ring, job_queue, result_queue, annotate):
+    samples_ms, copies, pipe_bytes, shm_bytes = [], [], [], []
+    for jpeg, boxes in inputs:
+        started = time.perf_counter()
+        shm_written = 0
+        slot = None
+        if mode == "pipe-bytes":
+            payload = jpeg
+        else:
+            frame = ANPRSystem._decode_image(jpeg)
+            if mode == "pipe-decoded":
+                payload = frame
+            else:
+                slot = ring.acquire(timeout=5.0)
+                payload = ring.write(slot, frame)
+                shm_written = frame.nbytes
+        job = (mode, payload, boxes, annotate)
+        job_queue.put(job)
+        message = result_queue.get()
+        result = ring.import_result(message) if mode == "shm" else message
+        # Dùng kết quả như tầng web (mã hóa ảnh kết quả) trước khi trả slot
+        ANPRSystem.encode_image(result["result_image_np"])
+        if slot is not None:
+            ring.release(slot)
+        samples_ms.append((time.perf_counter() - started) * 1000.0)
+
+        job_buffers, _ = buffer_stats(job)
+        result_buffers, _ = buffer_stats(message)
+        crop_writes, crop_bytes = slot_writes(message) if mode == "shm" else (0, 0)
+        # Mỗi mảng/bytes đi qua pipe bị sao chép 2 lần (pickle bên gửi, unpickle bên nhận), mỗi lần ghi vào slot 1 lần
+        copies.append(2 * (job_buffers + result_buffers) + (1 if slot is not None else 0) + crop_writes)
+        pipe_bytes.append(len(pickle.dumps(job, protocol=pickle.HIGHEST_PROTOCOL))
+                          + len(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)))
+        shm_bytes.append(shm_written + crop_bytes)
+    return {
+        "mode": mode,
+        "requests": len(samples_ms),
+        "latency": percentiles(samples_ms),
+        "copies_per_request": float(np.mean(copies)),
+        "pipe_bytes_per_request": float(np.mean(pipe_bytes)),
+        "shm_bytes_per_request": float(np.mean(shm_bytes)),
+        "bytes_moved_per_request": float(np.mean(pipe_bytes) + np.mean(shm_bytes)),
+    }
+
+
+def benchmark(inputs, modes, weights, annotate):
+    max_frame_bytes = max(ANPRSystem._decode_image(jpeg).nbytes for jpeg, _ in inputs)
+    # Phần trống sau ảnh dành cho ảnh biển số
+    ring = FrameRing(num_slots=RING_SLOTS, slot_bytes=max_frame_bytes + max(max_frame_bytes // 4, 1024 * 1024))
+    context = multiprocessing.get_context("spawn")
+    job_queue, result_queue = context.Queue(), context.Queue()
+    worker = context.Process(target=_transport_worker, args=(ring.handle(), weights, job_queue, result_queue),
+                             daemon=True)
+    worker.start()
+    try:
+        result_queue.get()
+        results = []
+        for mode in modes:
+            print(f">>> {mode} <<<")
+            run_mode(mode, inputs[:5], ring, job_queue, result_queue, annotate)  # chạy thử, không tính
+            results.append(run_mode(mode, inputs, ring, job_queue, result_queue, annotate))
+        return results
+    finally:
+        job_queue.put(None)
+        worker.join(timeout=10)
+        ring.close()
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"\n>>> KẾT QUẢ ({config['images']} ảnh, ảnh giải mã trung bình {config['mean_frame_bytes'] / 1e6:.2f} MB, "
+          f"{'ANPRSystem' if config['weights'] else 'chỉ vận chuyển, box theo nhãn'}) <<<")
+    print(f"  {'chế độ':<14}{'sao chép':>10}{'pipe KB':>10}{'shm KB':>10}{'tổng KB':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for result in report["results"]:
+        print(f"  {result['mode']:<14}{result['copies_per_request']:>10.1f}"
+              f"{result['pipe_bytes_per_request'] / 1024:>10.1f}{result['shm_bytes_per_request'] / 1024:>10.1f}"
+              f"{result['bytes_moved_per_request'] / 1024:>10.1f}{result['latency']['p50_ms']:>9.2f}"
+              f"{result['latency']['p95_ms']:>9.2f}")
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="So sánh số lần sao chép và số byte vận chuyển mỗi request giữa pipe và vòng đệm dùng chung.")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(DATASET_DIR, "images")],
+                        help="Thư mục/mẫu glob/file ảnh (nhãn YOLO ở thư mục labels bên cạnh)")
+    parser.add_argument("--limit", type=int, default=NUM_IMAGES)
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Các chế độ cần đo ({', '.join(MODES)})")
+    parser.add_argument("--resize-width", type=int, default=None,
+                        help="Phóng ảnh lên chiều rộng này (ví dụ 1920) để mô phỏng khung hình camera")
+    parser.add_argument("--weights", default=None,
+                        help="Chạy ANPRSystem thật với file YOLO này; mặc định chỉ đo vận chuyển với box theo nhãn")
+    parser.add_argument("--no-annotate", action="store_true", help="Không vẽ và không trả ảnh kết quả")
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"[LỖI] Chế độ không hợp lệ: {', '.join(unknown)}")
+        sys.exit(1)
+    inputs = load_inputs(list_images(args.paths, args.limit), args.resize_width)
+    if not inputs:
+        print("[LỖI] Không có ảnh nào để đo")
+        sys.exit(1)
+
+    results = benchmark(inputs, modes, args.weights, not args.no_annotate)
+    report = {
+        "config": {
+            "images": len(inputs),
+            "mean_frame_bytes": float(np.mean([ANPRSystem._decode_image(jpeg).nbytes for jpeg, _ in inputs])),
+            "mean_jpeg_bytes": float(np.mean([len(jpeg) for jpeg, _ in inputs])),
+            "resize_width": args.resize_width,
+            "weights": args.weights,
+            "annotate": not args.no_annotate,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã ghi kết quả: {args.output}")
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import PLATE_ALLOWLIST, ANPRSystem, configure_threads  # noqa: E402
+from benchmark_anpr import percentiles  # noqa: E402
+from plate_layout import order_text_boxes  # noqa: E402
+from plate_normalizer import clean_plate_text, match_plate, normalize_plate  # noqa: E402
+from plate_recognizer import CrnnPlateRecognizer  # noqa: E402
+from train_plate_ocr import SOURCE_DATASET_DIR, TEXT_LABELS_PATH, is_validation, load_text_labels, plate_crops  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Các bộ nhận dạng được so sánh trên cùng các vùng biển số:
+#   easyocr-fast: mạng nhận dạng của EasyOCR trên từng dòng chữ (bậc 'fast' của ANPRSystem)
+#   easyocr-full: EasyOCR đầy đủ (CRAFT + nhận dạng), như pipeline cũ
+#   crnn:<file>:  CRNN biển số (train_plate_ocr.py), file .onnx (ONNX Runtime) hoặc .pt (torch, INT8 động)
+EASYOCR_MODES = ("easyocr-fast", "easyocr-full")
+CRNN_BATCH_SIZE = 32
+
+# ==============================================================================
+# PHẦN 2: ĐO ĐẠC
+# ==============================================================================
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def load_samples(dataset_dir, labels, split, manual_only, limit):
+    """Các mẫu (crop_id, ảnh BGR, biển số đúng) có nhãn, thuộc tập split ('val' hoặc 'all')."""
+    samples = []
+    for crop_id, crop in plate_crops(dataset_dir):
+        if crop_id not in labels or (split == "val" and not is_validation(crop_id)):
+            continue
+        text, source = labels[crop_id]
+        if manual_only and source != "manual":
+            continue
+        samples.append((crop_id, crop, text))
+        if limit and len(samples) >= limit:
+            break
+    return samples
+
+
+def run_reader(name, read, samples):
+    """
+    read(ảnh xám, các dòng) -> kết quả dạng readtext (detail=1). Ảnh biển số qua đúng các bước của bậc 'fast'
+    (chỉnh nghiêng, tách dòng, co giãn) trước khi đo; chỉ thời gian nhận dạng + định dạng được tính.
+    """
+    prepared = [ANPRSystem._fast_plate_image(crop) for _, crop, _ in samples]
+    read(*prepared[0])  # chạy thử, không tính
+    samples_ms, correct, valid, char_errors, char_total = [], 0, 0, 0, 0
+    for (gray, rows), (_, _, truth) in zip(prepared, samples):
+        started = time.perf_counter()
+        ordered, num_lines = order_text_boxes(read(gray, rows))
+        raw = ''.join(item[1] for item in ordered)
+        plate = match_plate(raw, two_line=num_lines > 1)
+        samples_ms.append((time.perf_counter() - started) * 1000.0)
+        valid += plate is not None
+        predicted = plate or normalize_plate(raw, two_line=num_lines > 1)
+        correct += predicted == truth
+        char_errors += edit_distance(clean_plate_text(predicted), clean_plate_text(truth))
+        char_total += len(clean_plate_text(truth))
+    return {
+        "name": name,
+        "samples": len(samples),
+        "accuracy": correct / len(samples),
+        "char_accuracy": 1.0 - char_errors / char_total if char_total else 0.0,
+        "valid_rate": valid / len(samples),
+        "latency": percentiles(samples_ms),
+    }
+
+
+def benchmark_easyocr(samples, modes):
+    import easyocr
+
+    started = time.perf_counter()
+    reader = easyocr.Reader(['vi', 'en'])
+    load_seconds = time.perf_counter() - started
+    results = []
+    for mode in modes:
+        print(f">>> {mode} <<<")
+        if mode == "easyocr-fast":
+            def read(gray, rows):
+                return reader.recognize(gray, horizontal_list=[[0, gray.shape[1], y0, y1] for y0, y1 in rows],
+                                        free_list=[], detail=1, paragraph=False, allowlist=PLATE_ALLOWLIST)
+        else:
+            def read(gray, rows):
+                return reader.readtext(gray, detail=1, paragraph=False)
+        result = run_reader(mode, read, samples)
+        result["model_load_seconds"] = load_seconds
+        results.append(result)
+    return results
+
+
+def benchmark_crnn(samples, model_path, num_threads):
+    name = f"crnn:{os.path.basename(model_path)}"
+    print(f">>> {name} <<<")
+    started = time.perf_counter()
+    recognizer = CrnnPlateRecognizer(model_path, num_threads=num_threads)
+    load_seconds = time.perf_counter() - started
+
+    def read(gray, rows):
+        return recognizer.recognize(gray, horizontal_list=[[0, gray.shape[1], y0, y1] for y0, y1 in rows])
+
+    result = run_reader(name, read, samples)
+    # Thông lượng khi nhận dạng theo lô (process_images_in_memory gom biển số của cả lô ảnh)
+    prepared = [ANPRSystem._fast_plate_image(crop) for _, crop, _ in samples]
+    started = time.perf_counter()
+    recognizer.read_plates([gray for gray, _ in prepared], [rows for _, rows in prepared], CRNN_BATCH_SIZE)
+    result["batched_ms_per_plate"] = (time.perf_counter() - started) * 1000.0 / len(prepared)
+    result["model_load_seconds"] = load_seconds
+    result["model_bytes"] = os.path.getsize(model_path)
+    return result
+
+
+def print_report(report):
+    print(f"\n>>> KẾT QUẢ ({report['config']['samples']} vùng biển số, tập {report['config']['split']}) <<<")
+    print(f"  {'bộ nhận dạng':<26}{'đúng':>8}{'ký tự':>8}{'hợp lệ':>8}{'p50 ms':>9}{'p95 ms':>9}{'lô ms':>8}{'tải s':>8}")
+    for result in report["results"]:
+        batched = f"{result['batched_ms_per_plate']:.2f}" if "batched_ms_per_plate" in result else "-"
+        print(f"  {result['name']:<26}{result['accuracy']:>8.3f}{result['char_accuracy']:>8.3f}"
+              f"{result['valid_rate']:>8.3f}{result['latency']['p50_ms']:>9.2f}{result['latency']['p95_ms']:>9.2f}"
+              f"{batched:>8}{result['model_load_seconds']:>8.2f}")
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="So sánh độ chính xác và độ trễ của CRNN biển số với EasyOCR trên các vùng biển số đã gán nhãn.")
+    parser.add_argument("--dataset", default=SOURCE_DATASET_DIR)
+    parser.add_argument("--labels", default=TEXT_LABELS_PATH)
+    parser.add_argument("--crnn", nargs="*", default=[], help="Các file mô hình CRNN (.onnx hoặc .pt)")
+    parser.add_argument("--easyocr", default=",".join(EASYOCR_MODES),
+                        help=f"Các chế độ EasyOCR cần đo ({', '.join(EASYOCR_MODES)}), để trống để bỏ qua")
+    parser.add_argument("--split", default="val", choices=("val", "all"),
+                        help="Chỉ đo trên tập kiểm tra của train_plate_ocr.py (mặc định) hoặc mọi vùng có nhãn")
+    parser.add_argument("--manual-only", action="store_true",
+                        help="Chỉ dùng nhãn source=manual (nhãn tự động do EasyOCR gán thiên vị EasyOCR)")
+    parser.add_argument("--threads", type=int, default=None, help="Số luồng của ONNX Runtime/torch")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    easyocr_modes = [mode for mode in args.easyocr.split(",") if mode]
+    unknown = [mode for mode in easyocr_modes if mode not in EASYOCR_MODES]
+    if unknown:
+        print(f"[LỖI] Chế độ EasyOCR không hợp lệ: {', '.join(unknown)}")
+        sys.exit(1)
+    labels = load_text_labels(args.labels)
+    samples = load_samples(args.dataset, labels, args.split, args.manual_only, args.limit)
+    if not samples:
+        print(f"[LỖI] Không có vùng biển số nào có nhãn trong {args.labels} (chạy train_plate_ocr.py trước)")
+        sys.exit(1)
+    if not args.manual_only and any(labels[crop_id][1] != "manual" for crop_id, _, _ in samples):
+        print("[CẢNH BÁO] Có nhãn do EasyOCR gán tự động: độ chính xác của EasyOCR trên các nhãn này bị đánh giá cao "
+              "hơn thực tế; dùng --manual-only khi đã có đủ nhãn gán tay")
+
+    if args.threads:
+        configure_threads(args.threads)
+    results = benchmark_easyocr(samples, easyocr_modes) if easyocr_modes else []
+    results.extend(benchmark_crnn(samples, model_path, args.threads) for model_path in args.crnn)
+    report = {
+        "config": {
+            "samples": len(samples),
+            "split": args.split,
+            "manual_only": args.manual_only,
+            "threads": args.threads,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã ghi kết quả: {args.output}")
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import DETECTOR_BACKENDS, ANPRSystem, create_plate_detector  # noqa: E402
+from benchmark_anpr import IMAGES_DIR, WEIGHTS_PATH, list_images, percentiles  # noqa: E402
+from tiling import MERGE_METHODS  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Cấu hình so sánh: YOLO trên cả khung hình ở các imgsz, và phát hiện theo tile (kích thước:tỉ lệ chồng lấn)
+FULL_FRAME_IMGSZ = "640,960,1280"
+TILE_CONFIGS = "640:0.2"
+# Khung hình 4K tổng hợp: ghép GRID x GRID ảnh của dataset thành một khung hình FRAME_SIZE,
+# mô phỏng camera toàn cảnh nhiều làn xe với biển số nhỏ
+GRID = 4
+FRAME_SIZE = (3840, 2160)
+IOU_MATCH = 0.5           # Box phát hiện khớp với nhãn khi IoU >= ngưỡng này
+SMALL_PLATE_HEIGHT = 24   # Biển số cao dưới ngưỡng này (pixel trên khung hình) được tính riêng (recall_small)
+
+# ==============================================================================
+# PHẦN 2: DỮ LIỆU VÀ ĐO ĐẠC
+# ==============================================================================
+
+
+def read_labels(image_path, labels_dir, width, height, offset=(0, 0)):
+    """Box (x1, y1, x2, y2) của nhãn YOLO (class x y w h chuẩn hóa) trên ảnh width x height, cộng thêm offset."""
+    label_path = os.path.join(labels_dir, os.path.splitext(os.path.basename(image_path))[0] + ".txt")
+    boxes = []
+    if not os.path.exists(label_path):
+        return boxes
+    with open(label_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 5:
+                continue
+            cx, cy, w, h = (float(v) for v in parts[1:])
+            boxes.append(((cx - w / 2) * width + offset[0], (cy - h / 2) * height + offset[1],
+                          (cx + w / 2) * width + offset[0], (cy + h / 2) * height + offset[1]))
+    return boxes
+
+
+def build_frames(image_paths, labels_dir, grid, frame_size):
+    """
+    Tạo các khung hình đo: grid=1 dùng nguyên ảnh; grid>1 ghép grid x grid ảnh vào một khung hình frame_size
+    (mỗi ảnh co giãn vào một ô), nhãn được đổi theo. Trả về danh sách (khung hình, các box nhãn).
+    """
+    frames = []
+    if grid <= 1:
+        for path in image_paths:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append((image, read_labels(path, labels_dir, image.shape[1], image.shape[0])))
+        return frames
+
+    frame_w, frame_h = frame_size
+    cell_w, cell_h = frame_w // grid, frame_h // grid
+    per_frame = grid * grid
+    for start in range(0, len(image_paths) - per_frame + 1, per_frame):
+        frame = np.full((frame_h, frame_w, 3), 114, dtype=np.uint8)
+        labels = []
+        for cell, path in enumerate(image_paths[start:start + per_frame]):
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            x0, y0 = (cell % grid) * cell_w, (cell // grid) * cell_h
+            frame[y0:y0 + cell_h, x0:x0 + cell_w] = cv2.resize(image, (cell_w, cell_h), interpolation=cv2.INTER_AREA)
+            labels.extend(read_labels(path, labels_dir, cell_w, cell_h, offset=(x0, y0)))
+        frames.append((frame, labels))
+    return frames
+
+
+def box_iou(a, b):
+    ix1, iy1, ix2, iy2 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(detections, labels):
+    """Ghép tham lam theo IoU; trả về (các nhãn được phát hiện, số box phát hiện đúng)."""
+    found = [False] * len(labels)
+    true_positives = 0
+    for detection in sorted(detections, key=lambda d: -d[4]):
+        best, best_iou = None, IOU_MATCH
+        for i, label in enumerate(labels):
+            if not found[i]:
+                iou = box_iou(detection, label)
+                if iou >= best_iou:
+                    best, best_iou = i, iou
+        if best is not None:
+            found[best] = True
+            true_positives += 1
+    return found, true_positives
+
+
+def evaluate(anpr_system, frames, name):
+    """Chạy detect_plates trên từng khung hình (đã giải mã sẵn), đo thời gian và recall/precision."""
+    anpr_system.detect_plates([frames[0][0]])  # chạy thử, không tính
+    samples_ms = []
+    labels_total = labels_found = small_total = small_found = detections_total = true_positives = 0
+    for frame, labels in frames:
+        started = time.perf_counter()
+        detections = anpr_system.detect_plates([frame])[0]
+        samples_ms.append((time.perf_counter() - started) * 1000.0)
+        found, tp = match(detections, labels)
+        detections_total += len(detections)
+        true_positives += tp
+        labels_total += len(labels)
+        labels_found += sum(found)
+        for label, hit in zip(labels, found):
+            if label[3] - label[1] < SMALL_PLATE_HEIGHT:
+                small_total += 1
+                small_found += hit
+
+    latency = percentiles(samples_ms)
+    recall = labels_found / labels_total if labels_total else 0.0
+    return {
+        "name": name,
+        "recall": recall,
+        "recall_small": small_found / small_total if small_total else None,
+        "precision": true_positives / detections_total if detections_total else 0.0,
+        "labels": labels_total,
+        "small_labels": small_total,
+        "latency": latency,
+        "recall_per_ms": recall / latency["mean_ms"] if latency["count"] and latency["mean_ms"] > 0 else 0.0,
+    }
+
+
+def run_benchmark(frames, weights_path, backend, imgsz_list, tile_configs, merge):
+    """
+    Một ANPRSystem cho mọi cấu hình (EasyOCR chỉ tải một lần): với mỗi imgsz, detector được tạo lại với
+    imgsz đó; với mỗi cấu hình tile, các thuộc tính tile_* được đặt trực tiếp (đọc lại ở mỗi lần gọi).
+    """
+    anpr_system = ANPRSystem(weights_path, ocr_cache_size=0, detector_backend=backend, warmup=True)
+    results = []
+    for imgsz in imgsz_list:
+        print(f">>> Cả khung hình, imgsz={imgsz} <<<")
+        anpr_system.detector = create_plate_detector(weights_path, backend=backend, imgsz=imgsz)
+        anpr_system.tile_size = None
+        results.append(evaluate(anpr_system, frames, f"full@{imgsz}"))
+
+    anpr_system.detector = create_plate_detector(weights_path, backend=backend)
+    anpr_system.tile_merge = merge
+    for tile_size, overlap in tile_configs:
+        for full_frame in (True, False):
+            name = f"tile{tile_size}/{overlap:g}" + ("+full" if full_frame else "")
+            print(f">>> Theo tile: {name} <<<")
+            anpr_system.tile_size, anpr_system.tile_overlap, anpr_system.tile_full_frame = tile_size, overlap, full_frame
+            results.append(evaluate(anpr_system, frames, name))
+    return results
+
+
+def print_report(report):
+    print(f"\n>>> KẾT QUẢ ({report['config']['num_frames']} khung hình "
+          f"{report['config']['frame_size']}, {report['results'][0]['labels']} biển số) <<<")
+    print(f"  {'cấu hình':<20}{'recall':>8}{'nhỏ':>8}{'precision':>11}{'p50 ms':>10}{'p95 ms':>10}{'recall/ms':>11}")
+    for result in report["results"]:
+        small = f"{result['recall_small']:.3f}" if result["recall_small"] is not None else "-"
+        print(f"  {result['name']:<20}{result['recall']:>8.3f}{small:>8}{result['precision']:>11.3f}"
+              f"{result['latency']['p50_ms']:>10.1f}{result['latency']['p95_ms']:>10.1f}{result['recall_per_ms']:>11.5f}")
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="So sánh recall/độ trễ của phát hiện theo tile với YOLO trên cả khung hình ở imgsz lớn hơn.")
+    parser.add_argument("images", nargs="*", default=[IMAGES_DIR], help="Thư mục, mẫu glob hoặc file ảnh")
+    parser.add_argument("--labels", default=None, help="Thư mục nhãn YOLO (mặc định: thư mục labels cạnh thư mục ảnh)")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--backend", default="ultralytics", choices=DETECTOR_BACKENDS)
+    parser.add_argument("--grid", type=int, default=GRID, help="Ghép grid x grid ảnh thành một khung hình (1: dùng nguyên ảnh)")
+    parser.add_argument("--frame-size", default="x".join(map(str, FRAME_SIZE)), help="Kích thước khung hình ghép, ví dụ 3840x2160")
+    parser.add_argument("--imgsz", default=FULL_FRAME_IMGSZ, help="Các imgsz cho YOLO trên cả khung hình")
+    parser.add_argument("--tiles", default=TILE_CONFIGS, help="Các cấu hình tile dạng kích_thước:chồng_lấn, phân cách bằng dấu phẩy")
+    parser.add_argument("--merge", default="nms", choices=MERGE_METHODS)
+    parser.add_argument("--limit", type=int, default=160, help="Số ảnh của dataset dùng để tạo khung hình")
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    image_paths = list_images(args.images, args.limit)
+    if not image_paths:
+        print(f"[LỖI] Không tìm thấy ảnh nào trong: {', '.join(args.images)}")
+        sys.exit(1)
+    labels_dir = args.labels or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(image_paths[0]))), "labels")
+    frame_size = tuple(int(v) for v in args.frame_size.lower().split("x"))
+    frames = build_frames(image_paths, labels_dir, args.grid, frame_size)
+    if not frames:
+        print(f"[LỖI] Không đủ ảnh để ghép khung hình {args.grid}x{args.grid}")
+        sys.exit(1)
+
+    tile_configs = [(int(size), float(overlap)) for size, overlap in
+                    (item.split(":") for item in args.tiles.split(",") if item)]
+    results = run_benchmark(frames, args.weights, args.backend, [int(v) for v in args.imgsz.split(",") if v],
+                            tile_configs, args.merge)
+    report = {
+        "config": {
+            "weights": args.weights,
+            "backend": args.backend,
+            "grid": args.grid,
+            "frame_size": "x".join(map(str, frames[0][0].shape[1::-1])),
+            "num_frames": len(frames),
+            "merge": args.merge,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã ghi kết quả: {args.output}")
@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Manifest lưu kết quả kiểm tra từng cặp ảnh/nhãn, để lần chạy sau chỉ xử lý file mới hoặc đã thay đổi
+MANIFEST_NAME = ".dataset_manifest.json"
+MANIFEST_VERSION = 1
+
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+# Số cặp file gửi cho mỗi tiến trình một lần (giảm chi phí giao tiếp giữa các tiến trình)
+CHUNK_SIZE = 64
+
+# ==============================================================================
+# PHẦN 2: KIỂM TRA DỮ LIỆU
+# ==============================================================================
+
+
+def validate_label_text(text: str, num_classes: int) -> Tuple[Optional[str], int]:
+    """
+    Kiểm tra nội dung một file nhãn YOLO (class_id x y w h, tọa độ chuẩn hóa trong [0, 1]).
+    Trả về (lý do không hợp lệ hoặc None, số box).
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return "File rỗng", 0
+
+    for i, line in enumerate(lines):
+        parts = line.split()
+        # Phải có đúng 5 phần
+        if len(parts) != 5:
+            return f"Dòng {i + 1} không có 5 phần", 0
+        if not parts[0].isdigit():
+            return f"Dòng {i + 1}: class_id không phải số nguyên", 0
+        class_id = int(parts[0])
+        if class_id >= num_classes:
+            return f"Dòng {i + 1}: class_id ({class_id}) vượt quá số lớp ({num_classes})", 0
+        try:
+            coords = [float(value) for value in parts[1:]]
+        except ValueError:
+            return f"Dòng {i + 1}: Tọa độ không phải là số", 0
+        for coord in coords:
+            if not (0.0 <= coord <= 1.0):
+                return f"Dòng {i + 1}: Tọa độ {coord} nằm ngoài khoảng [0, 1]", 0
+        if coords[2] <= 0.0 or coords[3] <= 0.0:
+            return f"Dòng {i + 1}: Box có chiều rộng/cao bằng 0", 0
+    return None, len(lines)
+
+
+def _file_signature(path: Optional[str]) -> Optional[List[int]]:
+    """(kích thước, mtime_ns) dùng để nhận biết file đã thay đổi mà không cần đọc lại nội dung."""
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _inspect_pair(task: Tuple[str, str, Optional[str], int, bool]) -> dict:
+    """
+    Chạy trong tiến trình con: băm nội dung ảnh, kiểm tra ảnh giải mã được và kiểm tra file nhãn.
+    """
+    stem, image_path, label_path, num_classes, check_images = task
+    record = {
+        "image": os.path.basename(image_path),
+        "label": os.path.basename(label_path) if label_path else None,
+        "image_signature": _file_signature(image_path),
+        "label_signature": _file_signature(label_path),
+        "hash": None,
+        "num_boxes": 0,
+        "reason": None,
+    }
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        record["hash"] = hashlib.sha1(data).hexdigest()
+        if check_images:
+            # Giải mã ở 1/8 kích thước: vẫn phát hiện được file hỏng nhưng nhanh hơn nhiều
+            if cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8) is None:
+                record["reason"] = "Ảnh không giải mã được"
+                return record
+
+        if label_path is None:
+            record["reason"] = "Không có file nhãn"
+            return record
+        with open(label_path, "r", encoding="utf-8", errors="replace") as f:
+            record["reason"], record["num_boxes"] = validate_label_text(f.read(), num_classes)
+    except Exception as e:
+        record["reason"] = f"Lỗi không xác định: {e}"
+    return record
+
+
+def load_manifest(path: Optional[str], settings: dict) -> Dict[str, dict]:
+    """Đọc kết quả kiểm tra cũ; bỏ qua nếu manifest khác phiên bản hoặc được tạo với cấu hình khác."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[CẢNH BÁO] Không đọc được manifest {path}, kiểm tra lại toàn bộ: {e}")
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != settings:
+        return {}
+    return manifest.get("records", {})
+
+
+def save_manifest(path: str, records: Dict[str, dict], settings: dict) -> None:
+    """Ghi manifest qua file tạm rồi đổi tên để không để lại manifest hỏng khi bị dừng giữa chừng."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "settings": settings, "records": records}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def scan_dataset(source_dir: str, num_classes: int = 1, check_images: bool = True,
+                 workers: Optional[int] = None, manifest_path: Optional[str] = None) -> dict:
+    """
+    Kiểm tra song song (nhiều tiến trình) mọi cặp ảnh/nhãn trong source_dir/images và source_dir/labels.
+
+    Nếu có manifest_path, kết quả được lưu lại và lần chạy sau chỉ kiểm tra các cặp file mới hoặc
+    có kích thước/thời điểm sửa đổi khác đi. Trả về dict gồm:
+    records (tên file không đuôi -> kết quả), orphan_labels, checked, reused.
+    """
+    images_dir = os.path.join(source_dir, "images")
+    labels_dir = os.path.join(source_dir, "labels")
+    if not os.path.isdir(images_dir) or not os.path.isdir(labels_dir):
+        raise FileNotFoundError(f"Không tìm thấy thư mục 'images' hoặc 'labels' bên trong '{source_dir}'.")
+
+    image_files = {}
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                image_files[os.path.splitext(entry.name)[0]] = entry.path
+    label_files = {}
+    with os.scandir(labels_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".txt"):
+                label_files[os.path.splitext(entry.name)[0]] = entry.path
+
+    settings = {"num_classes": num_classes, "check_images": check_images}
+    previous = load_manifest(manifest_path, settings)
+    records: Dict[str, dict] = {}
+    tasks = []
+    for stem in sorted(image_files):
+        image_path, label_path = image_files[stem], label_files.get(stem)
+        old = previous.get(stem)
+        if (old is not None
+                and old["image"] == os.path.basename(image_path)
+                and old["image_signature"] == _file_signature(image_path)
+                and old["label_signature"] == _file_signature(label_path)):
+            records[stem] = old
+        else:
+            tasks.append((stem, image_path, label_path, num_classes, check_images))
+
+    reused = len(records)
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for task, record in zip(tasks, executor.map(_inspect_pair, tasks, chunksize=CHUNK_SIZE)):
+                records[task[0]] = record
+
+    if manifest_path:
+        save_manifest(manifest_path, records, settings)
+
+    return {
+        "records": records,
+        "orphan_labels": sorted(set(label_files) - set(image_files)),
+        "checked": len(tasks),
+        "reused": reused,
+    }
+
+# ==============================================================================
+# PHẦN 3: CHIA TRAIN/VAL
+# ==============================================================================
+
+
+def assign_split(content_hash: str, val_split: float, seed: int = 0) -> str:
+    """
+    Chọn tập cho một ảnh dựa trên hash nội dung: cùng ảnh luôn rơi vào cùng một tập, và thêm ảnh mới
+    không làm xáo trộn lại các ảnh cũ (khác với random.shuffle trên toàn bộ danh sách).
+    """
+    digest = hashlib.sha1(f"{seed}:{content_hash}".encode("ascii")).digest()
+    return "val" if int.from_bytes(digest[:8], "big") / 2.0 ** 64 < val_split else "train"
+
+
+def _same_file(src: str, dst: str, link_mode: str) -> bool:
+    try:
+        if link_mode == "copy":
+            src_stat, dst_stat = os.stat(src), os.stat(dst)
+            return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+        if link_mode == "symlink":
+            return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+        return os.path.samefile(src, dst)
+    except OSError:
+        return False
+
+
+def link_file(src: str, dst: str, link_mode: str = "hardlink") -> bool:
+    """
+    Đặt src vào dst bằng hardlink, symlink hoặc bản sao. Hardlink không được hỗ trợ (khác ổ đĩa,
+    hệ thống file không hỗ trợ) thì chuyển sang sao chép. Trả về False nếu dst đã đúng và được bỏ qua.
+    """
+    if os.path.lexists(dst):
+        if _same_file(src, dst, link_mode):
+            return False
+        os.remove(dst)
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            link_mode = "copy"
+    if link_mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        shutil.copy2(src, dst)
+    return True
+
+
+def split_dataset(source_dir: str, output_dir: str, val_split: float, seed: int = 0,
+                  link_mode: str = "hardlink", num_classes: int = 1, check_images: bool = True,
+                  workers: Optional[int] = None) -> dict:
+    """
+    Kiểm tra dữ liệu (scan_dataset) rồi chia các cặp hợp lệ vào output_dir/{train,val}/{images,labels}.
+
+    Việc chia là tất định (theo seed và hash nội dung ảnh) và tăng dần: file đã có ở đích và không đổi
+    thì bỏ qua, file không còn hợp lệ hoặc đã bị xóa khỏi nguồn thì được gỡ khỏi đích.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Kiểu liên kết không hợp lệ: {link_mode} (hỗ trợ: {', '.join(LINK_MODES)})")
+
+    started = time.perf_counter()
+    scan = scan_dataset(source_dir, num_classes=num_classes, check_images=check_images, workers=workers,
+                        manifest_path=os.path.join(output_dir, MANIFEST_NAME))
+    scan_seconds = time.perf_counter() - started
+
+    target_dirs = {
+        (split, kind): os.path.join(output_dir, split, kind)
+        for split in ("train", "val") for kind in ("images", "labels")
+    }
+    for dir_path in target_dirs.values():
+        os.makedirs(dir_path, exist_ok=True)
+
+    expected = {key: set() for key in target_dirs}
+    counts = {"train": 0, "val": 0}
+    linked = 0
+    invalid = []
+    images_dir = os.path.join(source_dir, "images")
+    labels_dir = os.path.join(source_dir, "labels")
+    for stem, record in sorted(scan["records"].items()):
+        if record["reason"] is not None:
+            invalid.append((stem, record["reason"]))
+            continue
+        split = assign_split(record["hash"], val_split, seed)
+        for kind, filename, src_dir in (("images", record["image"], images_dir),
+                                        ("labels", record["label"], labels_dir)):
+            expected[(split, kind)].add(filename)
+            linked += link_file(os.path.join(src_dir, filename),
+                                os.path.join(target_dirs[(split, kind)], filename), link_mode)
+        counts[split] += 1
+
+    removed = 0
+    for key, dir_path in target_dirs.items():
+        for filename in os.listdir(dir_path):
+            if filename not in expected[key]:
+                os.remove(os.path.join(dir_path, filename))
+                removed += 1
+
+    return {
+        "train": counts["train"],
+        "val": counts["val"],
+        "invalid": invalid,
+        "orphan_labels": scan["orphan_labels"],
+        "checked": scan["checked"],
+        "reused": scan["reused"],
+        "linked": linked,
+        "removed": removed,
+        "scan_seconds": scan_seconds,
+        "total_seconds": time.perf_counter() - started,
+    }
+
+
+def print_split_summary(summary: dict) -> None:
+    print(f"  - Kiểm tra: {summary['checked']} cặp file mới/thay đổi, dùng lại {summary['reused']} kết quả cũ "
+          f"({summary['scan_seconds']:.2f}s)")
+    print(f"  - Tập Train: {summary['train']} ảnh, Tập Validation: {summary['val']} ảnh")
+    print(f"  - Đã liên kết {summary['linked']} file, gỡ {summary['removed']} file cũ "
+          f"(tổng {summary['total_seconds']:.2f}s)")
+    if summary["invalid"]:
+        print(f"  - [CẢNH BÁO] Bỏ qua {len(summary['invalid'])} ảnh không hợp lệ:")
+        for stem, reason in summary["invalid"][:10]:
+            print(f"      {stem}: {reason}")
+
+# ==============================================================================
+# PHẦN 4: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kiểm tra và chia bộ dữ liệu YOLO (song song, tăng dần).")
+    parser.add_argument("source", help="Thư mục dataset gốc (chứa images/ và labels/)")
+    parser.add_argument("output", help="Thư mục đích cho train/val")
+    parser.add_argument("--val-split", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--link-mode", default="hardlink", choices=LINK_MODES)
+    parser.add_argument("--num-classes", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình kiểm tra (mặc định: số CPU)")
+    parser.add_argument("--skip-image-check", action="store_true", help="Không giải mã thử ảnh")
+    args = parser.parse_args()
+
+    print(">>> CHIA DỮ LIỆU <<<")
+    print_split_summary(split_dataset(args.source, args.output, args.val_split, seed=args.seed,
+                                      link_mode=args.link_mode, num_classes=args.num_classes,
+                                      check_images=not args.skip_image_check, workers=args.workers))
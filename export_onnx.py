@@ -0,0 +1,251 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import OnnxPlateDetector, UltralyticsPlateDetector  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Mô hình đã huấn luyện bởi train_yolo.py
+WEIGHTS_PATH = "runs/yolo_bien_so_xe_detector/weights/best.pt"
+
+# Kích thước đầu vào khi export, phải trùng với IMAGE_SIZE lúc huấn luyện
+IMAGE_SIZE = 640
+
+# Phiên bản ONNX opset
+OPSET = 12
+
+# Thư mục ảnh dùng để hiệu chỉnh (calibration) khi lượng tử hóa INT8 và để kiểm tra parity
+CALIBRATION_IMAGES_DIR = "dataset/images"
+NUM_CALIBRATION_IMAGES = 200
+NUM_PARITY_IMAGES = 50
+
+# Ngưỡng kiểm tra parity: box ONNX được coi là khớp box PyTorch nếu IoU >= ngưỡng
+# và độ tin cậy chênh lệch không quá PARITY_CONF_TOLERANCE
+PARITY_IOU_THRESHOLD = 0.9
+PARITY_CONF_TOLERANCE = 0.05
+
+# OnnxPlateDetector letterbox về ảnh vuông, ultralytics letterbox về hình chữ nhật (bội số của stride);
+# parity được kiểm tra thêm trên các bản cắt ngang/dọc của ảnh để bao phủ các tỉ lệ khung hình khác nhau
+PARITY_ASPECT_VARIANTS = True
+
+# ==============================================================================
+# PHẦN 2: CÁC HÀM TIỆN ÍCH
+# ==============================================================================
+
+
+def list_images(images_dir, limit):
+    files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    return [os.path.join(images_dir, f) for f in files[:limit]]
+
+
+def export_onnx(weights_path, image_size, opset):
+    """Export best.pt sang ONNX (batch động để backend ONNX chạy được theo lô)."""
+    print(">>> BƯỚC 1: EXPORT ONNX <<<")
+    model = YOLO(weights_path)
+    onnx_path = model.export(format="onnx", imgsz=image_size, opset=opset, simplify=True, dynamic=True)
+    print(f"[THÀNH CÔNG] Đã export: {onnx_path}")
+    return onnx_path
+
+
+def export_openvino(weights_path, image_size, int8, data_yaml=None):
+    """Export sang OpenVINO IR (tùy chọn INT8). Thư mục kết quả nạp được bằng backend 'ultralytics'."""
+    print(">>> EXPORT OPENVINO <<<")
+    model = YOLO(weights_path)
+    kwargs = {"format": "openvino", "imgsz": image_size, "int8": int8}
+    if int8 and data_yaml:
+        kwargs["data"] = data_yaml
+    openvino_path = model.export(**kwargs)
+    print(f"[THÀNH CÔNG] Đã export: {openvino_path}")
+    return openvino_path
+
+
+class _LetterboxCalibrationReader:
+    """Cấp ảnh hiệu chỉnh cho quantize_static, tiền xử lý giống hệt OnnxPlateDetector."""
+
+    def __init__(self, onnx_path, image_paths):
+        self.detector = OnnxPlateDetector(onnx_path)
+        self.image_paths = list(image_paths)
+        self._index = 0
+
+    def get_next(self):
+        while self._index < len(self.image_paths):
+            image = cv2.imread(self.image_paths[self._index])
+            self._index += 1
+            if image is None:
+                continue
+            letterboxed, _, _ = self.detector._letterbox(image)
+            blob = letterboxed[None, ..., ::-1].transpose(0, 3, 1, 2)
+            blob = np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+            return {self.detector.input_name: blob}
+        return None
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize_int8(onnx_path, image_paths):
+    """
+    Lượng tử hóa tĩnh INT8 (QDQ, per-channel) với dữ liệu hiệu chỉnh là ảnh thật của bộ dữ liệu.
+    Trả về đường dẫn file *_int8.onnx.
+    """
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    print(">>> BƯỚC 2: LƯỢNG TỬ HÓA INT8 <<<")
+    base, _ = os.path.splitext(onnx_path)
+    preprocessed_path = f"{base}_preprocessed.onnx"
+    int8_path = f"{base}_int8.onnx"
+
+    quant_pre_process(onnx_path, preprocessed_path)
+    quantize_static(
+        preprocessed_path,
+        int8_path,
+        _LetterboxCalibrationReader(onnx_path, image_paths),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(preprocessed_path)
+    print(f"[THÀNH CÔNG] Đã lượng tử hóa: {int8_path} ({len(image_paths)} ảnh hiệu chỉnh)")
+    return int8_path
+
+
+def _box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def parity_tolerances(onnx_path):
+    """(ngưỡng IoU, chênh lệch độ tin cậy tối đa); mô hình INT8 được phép lệch nhiều hơn một chút so với FP32."""
+    if onnx_path.endswith("_int8.onnx"):
+        return PARITY_IOU_THRESHOLD - 0.1, PARITY_CONF_TOLERANCE * 2
+    return PARITY_IOU_THRESHOLD, PARITY_CONF_TOLERANCE
+
+
+def parity_samples(image_paths, aspect_variants=True):
+    """
+    Sinh (tên, ảnh) cho kiểm tra parity: ảnh gốc và, nếu aspect_variants, bản cắt nửa trên (ảnh ngang)
+    và một phần ba bên trái (ảnh dọc) của nó.
+    """
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        name = os.path.basename(path)
+        yield name, image
+        if aspect_variants:
+            h, w = image.shape[:2]
+            yield f"{name} (nửa trên)", image[:max(1, h // 2)]
+            yield f"{name} (1/3 trái)", image[:, :max(1, w // 3)]
+
+
+def check_parity(weights_path, onnx_path, image_paths, iou_threshold, conf_tolerance,
+                 aspect_variants=PARITY_ASPECT_VARIANTS):
+    """
+    So sánh box của backend ONNX với backend PyTorch (ultralytics) trên cùng tập ảnh (xem parity_samples).
+    Mỗi box PyTorch phải có đúng một box ONNX tương ứng (IoU >= iou_threshold, chênh lệch độ tin cậy
+    <= conf_tolerance) và ngược lại. Trả về True nếu tất cả ảnh đều khớp.
+    """
+    print(f">>> KIỂM TRA PARITY: {os.path.basename(onnx_path)} so với {os.path.basename(weights_path)} "
+          f"(IoU >= {iou_threshold:.2f}, |Δconf| <= {conf_tolerance:.2f}) <<<")
+    reference = UltralyticsPlateDetector(weights_path)
+    candidate = OnnxPlateDetector(onnx_path)
+
+    mismatched = []
+    matched_ious = []
+    n = total_boxes = 0
+    reference_time = candidate_time = 0.0
+    for name, image in parity_samples(image_paths, aspect_variants):
+        n += 1
+        started = time.perf_counter()
+        expected = reference([image])[0]
+        reference_time += time.perf_counter() - started
+        started = time.perf_counter()
+        actual = candidate([image])[0]
+        candidate_time += time.perf_counter() - started
+
+        total_boxes += len(expected)
+        unmatched = list(range(len(actual)))
+        ok = True
+        for box in expected:
+            best = max(unmatched, key=lambda j: _box_iou(box, actual[j]), default=None)
+            if best is None or _box_iou(box, actual[best]) < iou_threshold or abs(box[4] - actual[best][4]) > conf_tolerance:
+                ok = False
+                break
+            matched_ious.append(_box_iou(box, actual[best]))
+            unmatched.remove(best)
+        if not ok or unmatched:
+            mismatched.append((name, len(expected), len(actual)))
+
+    print(f"  - Số ảnh: {n}, số box tham chiếu: {total_boxes}")
+    if matched_ious:
+        print(f"  - IoU của các box khớp: nhỏ nhất {min(matched_ious):.3f}, "
+              f"trung bình {sum(matched_ious) / len(matched_ious):.3f}")
+    print(f"  - Thời gian trung bình: PyTorch {reference_time / max(n, 1) * 1000:.1f} ms/ảnh, "
+          f"ONNX {candidate_time / max(n, 1) * 1000:.1f} ms/ảnh")
+    if mismatched:
+        print(f"[LỖI] {len(mismatched)} ảnh không khớp:")
+        for name, n_expected, n_actual in mismatched[:10]:
+            print(f"  - {name}: PyTorch {n_expected} box, ONNX {n_actual} box")
+        return False
+    print("[THÀNH CÔNG] Kết quả ONNX khớp với PyTorch.")
+    return True
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export mô hình phát hiện biển số sang ONNX/INT8/OpenVINO.")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--imgsz", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--int8", action="store_true", help="Tạo thêm bản ONNX lượng tử hóa INT8")
+    parser.add_argument("--openvino", action="store_true", help="Tạo thêm bản OpenVINO IR")
+    parser.add_argument("--data", default=None, help="File data.yaml (cho OpenVINO INT8)")
+    parser.add_argument("--images", default=CALIBRATION_IMAGES_DIR, help="Thư mục ảnh hiệu chỉnh/kiểm tra parity")
+    parser.add_argument("--skip-parity", action="store_true")
+    parser.add_argument("--check", nargs="+", metavar="ONNX_PATH", default=None,
+                        help="Chỉ kiểm tra parity các file .onnx đã có với --weights (không export lại)")
+    args = parser.parse_args()
+
+    if args.check:
+        # Kiểm tra lặp lại được, ví dụ trước khi publish mô hình hoặc sau khi sửa OnnxPlateDetector
+        parity_images = list_images(args.images, NUM_PARITY_IMAGES)
+        if not parity_images:
+            print(f"[LỖI] Không có ảnh nào trong {args.images}")
+            sys.exit(1)
+        all_ok = True
+        for path in args.check:
+            all_ok &= check_parity(args.weights, path, parity_images, *parity_tolerances(path))
+        sys.exit(0 if all_ok else 1)
+
+    onnx_path = export_onnx(args.weights, args.imgsz, OPSET)
+    exported = [onnx_path]
+    if args.int8:
+        exported.append(quantize_int8(onnx_path, list_images(args.images, NUM_CALIBRATION_IMAGES)))
+    if args.openvino:
+        export_openvino(args.weights, args.imgsz, int8=args.int8, data_yaml=args.data)
+
+    all_ok = True
+    if not args.skip_parity:
+        parity_images = list_images(args.images, NUM_PARITY_IMAGES)
+        for path in exported:
+            all_ok &= check_parity(args.weights, path, parity_images, *parity_tolerances(path))
+
+    print("\nĐể dùng trong web app, đặt DETECTOR_BACKEND = 'onnx' trong anpr_web_app/app.py và chép file .onnx vào "
+          "thư mục mô hình (MODELS_DIR, xem model_registry.publish_model)")
+    sys.exit(0 if all_ok else 1)
@@ -5,20 +5,15 @@ import re
 from ultralytics import YOLO
 from typing import Optional, Tuple
 import easyocr
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from plate_layout import order_text_boxes  # noqa: E402
+from plate_normalizer import normalize_plate  # noqa: E402
 
 # Cấu hình EasyOCR
 reader = easyocr.Reader(['vi', 'en'])  # Thêm 'vi' để hỗ trợ tiếng Việt
 
-def format_vietnam_plate(text: str) -> str:
-    """Định dạng văn bản biển số Việt Nam với kiểm tra linh hoạt hơn."""
-    text = re.sub(r'[^A-Z0-9.-]', '', text.upper())
-    replacements = {'O': '0', 'Q': '0', 'I': '1'}
-    corrected = ''.join(replacements.get(c, c) for c in text)
-    # Kiểm tra linh hoạt hơn: chấp nhận 2 số + ký tự + 4 số hoặc các biến thể
-    if len(corrected) >= 6 and corrected[2] in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
-        return corrected[:2] + '-' + corrected[2]  # Thêm - nếu có ký tự ở vị trí 3
-    return corrected if len(corrected) >= 6 else "N/A"
-
 def ultimate_license_plate_pipeline(plate_image: np.ndarray, output_dir: str = "test_results",
                                    debug: bool = False) -> Tuple[np.ndarray, np.ndarray, str]:
     """Xử lý ảnh biển số: cắt, tiền xử lý nhẹ với bilateral filter + Otsu, và OCR với EasyOCR."""
@@ -63,19 +58,21 @@ def ultimate_license_plate_pipeline(plate_image: np.ndarray, output_dir: str = "
     try:
         result = reader.readtext(plate_roi)
         print(f"Raw OCR result: {result}")  # Debug kết quả thô
-        if result:
+        # Sắp xếp theo dòng (biển hai dòng không bị xen kẽ), trong dòng từ trái sang phải
+        ordered, num_lines = order_text_boxes(result)
+        if ordered:
             # Kết hợp tất cả chuỗi từ EasyOCR
-            tess_text = ' '.join([item[-2] for item in result])  # Ghép '60*12' và '9999'
+            tess_text = ' '.join([item[-2] for item in ordered])  # Ghép '60*12' và '9999'
             print(f"Combined text: {tess_text}")
         else:
             tess_text = ""
-        plate_text = format_vietnam_plate(tess_text) if len(tess_text) >= 3 else "N/A"
+        plate_text = normalize_plate(tess_text, two_line=num_lines > 1) if len(tess_text) >= 3 else "N/A"
         # Hậu xử lý
         if plate_text == "N/A" and len(tess_text) >= 3:
             parts = tess_text.split()
             if len(parts) >= 2 and '*' in parts[0]:
                 corrected = parts[0].replace('*12', 'X2') + ' ' + ' '.join(parts[1:])
-                plate_text = corrected  # Bỏ qua format_vietnam_plate ở bước này
+                plate_text = corrected  # Bỏ qua normalize_plate ở bước này
             elif re.match(r'^\d{2}\d{2}\d{4}$', tess_text.replace(' ', '')):
                 plate_text = tess_text[:2] + '-X' + tess_text[4:]  # Thêm -X nếu phát hiện 2 số + 2 số + 4 số
     except Exception as e:
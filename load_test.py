@@ -0,0 +1,198 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from benchmark_anpr import IMAGES_DIR, WEIGHTS_PATH, list_images, percentiles  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Các mô hình đồng thời được so sánh:
+#   shared:    một ANPRSystem dùng chung cho mọi luồng (khóa mô hình), ngân sách luồng = --threads
+#   pool:      ANPRSystemPool, mỗi luồng một ANPRSystem, ngân sách --threads chia đều cho các instance
+#   unbounded: mỗi luồng một ANPRSystem, giữ số luồng mặc định của torch/OpenCV/OpenMP (cấu hình cũ,
+#              các pool luồng tranh nhau CPU)
+MODES = ("shared", "pool", "unbounded")
+CONCURRENCY_LEVELS = "1,2,4"
+REQUESTS_PER_THREAD = 20
+
+# ==============================================================================
+# PHẦN 2: CHẠY TẢI
+# ==============================================================================
+
+
+def run_level(mode, concurrency, images_bytes, weights_path, backend, num_threads, requests_per_thread):
+    """
+    Chạy trong một tiến trình riêng (spawn): số luồng của torch/OpenCV là thiết lập của cả tiến trình,
+    nên mỗi cấu hình phải bắt đầu từ một tiến trình sạch để không bị cấu hình trước ảnh hưởng.
+    Mỗi luồng gửi requests_per_thread ảnh (xoay vòng) qua process_image_in_memory.
+    """
+    from anpr_core import ANPRSystem, ANPRSystemPool
+
+    # Tắt cache OCR để mỗi request thực sự chạy OCR
+    anpr_kwargs = {"ocr_cache_size": 0, "detector_backend": backend, "warmup": True}
+    started = time.perf_counter()
+    if mode == "shared":
+        shared = ANPRSystem(weights_path, num_threads=num_threads, **anpr_kwargs)
+        acquire = lambda: _Borrowed(shared)  # noqa: E731
+        thread_settings = shared.thread_settings
+    elif mode == "pool":
+        pool = ANPRSystemPool(weights_path, size=concurrency, num_threads=num_threads, **anpr_kwargs)
+        acquire = pool.acquire
+        thread_settings = pool.systems[0].thread_settings
+    else:
+        pool = _UnboundedPool([ANPRSystem(weights_path, **anpr_kwargs) for _ in range(concurrency)])
+        acquire = pool.acquire
+        thread_settings = {}
+    load_seconds = time.perf_counter() - started
+
+    latencies_ms = []
+    latencies_lock = threading.Lock()
+    errors = [0]
+
+    def client(offset):
+        for i in range(requests_per_thread):
+            image_bytes = images_bytes[(offset + i * concurrency) % len(images_bytes)]
+            request_started = time.perf_counter()
+            with acquire() as anpr_system:
+                result = anpr_system.process_image_in_memory(image_bytes, annotate=False)
+            elapsed_ms = (time.perf_counter() - request_started) * 1000.0
+            with latencies_lock:
+                latencies_ms.append(elapsed_ms)
+                errors[0] += "error" in result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "thread_settings": thread_settings,
+        "model_load_seconds": load_seconds,
+        "requests": len(latencies_ms),
+        "errors": errors[0],
+        "wall_seconds": wall_seconds,
+        "requests_per_second": len(latencies_ms) / wall_seconds if wall_seconds > 0 else 0.0,
+        "latency": percentiles(latencies_ms),
+    }
+
+
+class _Borrowed:
+    """Context manager trả về luôn instance dùng chung (chế độ shared)."""
+
+    def __init__(self, anpr_system):
+        self.anpr_system = anpr_system
+
+    def __enter__(self):
+        return self.anpr_system
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _UnboundedPool:
+    """Mỗi luồng một instance như ANPRSystemPool nhưng không giới hạn số luồng tính toán."""
+
+    def __init__(self, systems):
+        self._free = list(systems)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self):
+        if not hasattr(self._local, "system"):
+            with self._lock:
+                self._local.system = self._free.pop()
+        return _Borrowed(self._local.system)
+
+
+def run_load_test(image_paths, weights_path, backend, modes, levels, num_threads, requests_per_thread):
+    images_bytes = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            images_bytes.append(f.read())
+
+    results = []
+    ctx = mp.get_context("spawn")
+    for mode in modes:
+        for concurrency in levels:
+            print(f">>> {mode}: {concurrency} luồng, {concurrency * requests_per_thread} request <<<")
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                result = executor.submit(run_level, mode, concurrency, images_bytes, weights_path, backend,
+                                         num_threads, requests_per_thread).result()
+            baseline = next((r for r in results if r["mode"] == mode and r["concurrency"] == levels[0]), result)
+            result["speedup"] = (result["requests_per_second"] / baseline["requests_per_second"]
+                                 if baseline["requests_per_second"] > 0 else 0.0)
+            results.append(result)
+            print(f"  - {result['requests_per_second']:.2f} request/s, p50 {result['latency']['p50_ms']:.1f} ms, "
+                  f"p95 {result['latency']['p95_ms']:.1f} ms, lỗi: {result['errors']}")
+
+    return {
+        "config": {
+            "weights": weights_path,
+            "backend": backend,
+            "threads": num_threads,
+            "cpu_count": os.cpu_count(),
+            "requests_per_thread": requests_per_thread,
+            "num_images": len(images_bytes),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def print_report(report):
+    print(f"\n>>> KẾT QUẢ (ngân sách {report['config']['threads']} luồng, {report['config']['cpu_count']} nhân CPU) <<<")
+    print(f"  {'chế độ':<11}{'luồng':>6}{'req/s':>10}{'tăng tốc':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in report["results"]:
+        latency = result["latency"]
+        print(f"  {result['mode']:<11}{result['concurrency']:>6}{result['requests_per_second']:>10.2f}"
+              f"{result['speedup']:>9.2f}x{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}")
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Đo thông lượng khi nhiều luồng cùng suy luận trong một tiến trình, với các mô hình đồng thời khác nhau.")
+    parser.add_argument("images", nargs="*", default=[IMAGES_DIR], help="Thư mục, mẫu glob hoặc file ảnh")
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--backend", default="ultralytics", choices=("ultralytics", "onnx"))
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Các chế độ cần đo ({', '.join(MODES)})")
+    parser.add_argument("--concurrency", default=CONCURRENCY_LEVELS, help="Các mức số luồng, phân cách bằng dấu phẩy")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="Ngân sách luồng tính toán của tiến trình (mặc định: số nhân CPU)")
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_THREAD, help="Số request mỗi luồng gửi")
+    parser.add_argument("--limit", type=int, default=50, help="Số ảnh dùng để tạo tải (xoay vòng)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    modes = tuple(args.modes.split(","))
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"[LỖI] Chế độ không hợp lệ: {', '.join(unknown)}")
+        sys.exit(1)
+    image_paths = list_images(args.images, args.limit)
+    if not image_paths:
+        print(f"[LỖI] Không tìm thấy ảnh nào trong: {', '.join(args.images)}")
+        sys.exit(1)
+
+    report = run_load_test(image_paths, args.weights, args.backend, modes,
+                           sorted(max(1, int(level)) for level in args.concurrency.split(",")),
+                           max(1, args.threads), max(1, args.requests))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã ghi kết quả: {args.output}")
@@ -0,0 +1,367 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+import uuid
+
+import cv2
+import yaml
+
+from benchmark_anpr import list_images, percentiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import configure_threads, create_plate_detector  # noqa: E402
+from model_registry import process_memory_bytes, publish_model, select_sweep_candidate  # noqa: E402
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# Các ứng viên là mọi tổ hợp (mô hình gốc, kích thước đầu vào). Mỗi ứng viên được huấn luyện trên cùng
+# dataset_split (train_yolo.py), đánh giá độ chính xác trên tập val và đo độ trễ YOLO trên CPU.
+SWEEP_MODELS = ["yolov8n.pt", "yolov8s.pt", "yolov8m.pt"]
+SWEEP_IMAGE_SIZES = [320, 480, 640]
+SWEEP_EPOCHS = 50
+SWEEP_BATCH_SIZE = 16
+SWEEP_PROJECT_DIR = os.path.join("runs", "sweep")   # runs/sweep/<ứng viên>/weights/best.pt
+DATA_YAML_PATH = os.path.join("dataset_split", "data.yaml")
+
+# File tổng kết (JSON) mà web app đọc để chọn mô hình theo ngân sách độ trễ (LATENCY_BUDGET_MS trong app.py)
+SUMMARY_PATH = os.path.join("runs", "model_sweep.json")
+SUMMARY_VERSION = 1
+
+# Độ chính xác dùng để so sánh: map50_95 (mAP@0.5:0.95) hoặc map50
+SWEEP_METRIC = "map50_95"
+METRICS = ("map50_95", "map50")
+# Độ trễ dùng cho biên Pareto và ngân sách
+LATENCY_KEY = "p95_ms"
+
+# Đo độ trễ: mỗi ứng viên chạy trong một tiến trình riêng (bộ nhớ đỉnh không lẫn giữa các ứng viên),
+# với số luồng như một worker của web app (THREADS_PER_WORKER với 2 worker)
+LATENCY_IMAGES = 100
+WARMUP_RUNS = 5
+LATENCY_THREADS = max(1, (os.cpu_count() or 1) // 2)
+LATENCY_TIMEOUT_SECONDS = 1800
+ONNX_OPSET = 12
+
+# ==============================================================================
+# PHẦN 2: CÁC HÀM TIỆN ÍCH
+# ==============================================================================
+
+
+def candidate_name(model, imgsz):
+    """
+    'yolov8n.pt', 480 -> 'yolov8n-480'. File best.pt/last.pt lấy tên thư mục huấn luyện:
+    'runs/yolo_bien_so_xe_detector/weights/best.pt', 640 -> 'yolo_bien_so_xe_detector-640'.
+    """
+    path = os.path.abspath(model) if os.path.exists(model) else model
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem in ("best", "last") and os.path.basename(os.path.dirname(path)) == "weights":
+        stem = os.path.basename(os.path.dirname(os.path.dirname(path)))
+    return f"{stem}-{imgsz}"
+
+
+def train_candidate(model, imgsz, data_yaml, epochs, batch, retrain=False, cache_workers=8):
+    """
+    Huấn luyện một ứng viên (dùng cache ảnh của train_cache.py như train_yolo.py), trả về đường dẫn best.pt.
+    Nếu runs/sweep/<ứng viên>/weights/best.pt đã có và không yêu cầu retrain thì dùng lại, để chạy lại
+    sweep (ví dụ thêm kích thước mới) không phải huấn luyện lại các ứng viên cũ.
+    """
+    from ultralytics import YOLO
+    from train_cache import cached_trainer_class
+
+    name = candidate_name(model, imgsz)
+    project = os.path.abspath(SWEEP_PROJECT_DIR)
+    best_path = os.path.join(project, name, "weights", "best.pt")
+    if os.path.exists(best_path) and not retrain:
+        print(f"[INFO] {name}: dùng lại {best_path}")
+        return best_path
+    print(f">>> HUẤN LUYỆN {name} <<<")
+    yolo = YOLO(model)
+    yolo.train(data=data_yaml, epochs=epochs, imgsz=imgsz, batch=batch, project=project, name=name,
+               exist_ok=True, plots=False, trainer=cached_trainer_class(cache_workers))
+    best = getattr(getattr(yolo, "trainer", None), "best", None)
+    return str(best) if best and os.path.exists(best) else best_path
+
+
+def evaluate_accuracy(weights, data_yaml, imgsz):
+    """Độ chính xác trên tập val của data_yaml, ở đúng kích thước đầu vào của ứng viên."""
+    from ultralytics import YOLO
+
+    results = YOLO(weights).val(data=data_yaml, imgsz=imgsz, split="val", plots=False, verbose=False)
+    box = results.box
+    return {
+        "map50_95": float(box.map),
+        "map50": float(box.map50),
+        "precision": float(box.mp),
+        "recall": float(box.mr),
+    }
+
+
+def peak_memory_bytes():
+    """Bộ nhớ đỉnh (RSS) của tiến trình hiện tại; None nếu không xác định được."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset   # Windows
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _latency_worker(weights, backend, imgsz, image_paths, num_threads, warmup_runs, results):
+    """Chạy trong tiến trình con: tải detector, chạy thử, rồi đo thời gian YOLO trên từng ảnh."""
+    try:
+        configure_threads(num_threads)
+        rss_before = process_memory_bytes(os.getpid())
+        started = time.perf_counter()
+        detector = create_plate_detector(weights, backend, num_threads=num_threads, imgsz=imgsz)
+        load_seconds = time.perf_counter() - started
+        rss_loaded = process_memory_bytes(os.getpid())
+        images = (image for image in map(cv2.imread, image_paths) if image is not None)
+        first = next(images, None)
+        if first is None:
+            raise RuntimeError("không đọc được ảnh nào để đo độ trễ")
+        for _ in range(warmup_runs):
+            detector([first])
+        samples_ms = []
+        for image in [first, *images]:
+            started = time.perf_counter()
+            detector([image])
+            samples_ms.append((time.perf_counter() - started) * 1000.0)
+        results.put({
+            "latency": percentiles(samples_ms),
+            "load_seconds": load_seconds,
+            "model_rss_bytes": rss_loaded - rss_before if rss_before and rss_loaded else None,
+            "peak_rss_bytes": peak_memory_bytes(),
+        })
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure_latency(weights, backend, imgsz, image_paths, num_threads, warmup_runs=WARMUP_RUNS,
+                    timeout=LATENCY_TIMEOUT_SECONDS):
+    """
+    Độ trễ (ms/ảnh, chỉ bước phát hiện YOLO, lô 1 ảnh như một request /process-image) và bộ nhớ đỉnh của một
+    ứng viên. Mỗi lần đo chạy trong một tiến trình spawn mới để bộ nhớ đỉnh chỉ gồm mô hình đó và số luồng
+    được áp dụng trước khi nạp torch/onnxruntime.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_latency_worker,
+                              args=(weights, backend, imgsz, image_paths, num_threads, warmup_runs, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                result = {"error": f"tiến trình đo bị dừng (exit code {process.exitcode})"}
+                break
+            if time.monotonic() > deadline:
+                result = {"error": f"hết thời gian chờ ({timeout}s)"}
+                break
+    process.join(timeout=10)
+    if process.is_alive():
+        process.terminate()
+    return result
+
+
+def pareto_frontier(candidates, metric=SWEEP_METRIC, latency_key=LATENCY_KEY):
+    """
+    Các ứng viên không bị ứng viên nào khác vượt trội (nhanh hơn hoặc bằng và chính xác hơn hoặc bằng,
+    hơn hẳn ở ít nhất một tiêu chí), sắp xếp theo độ trễ tăng dần (độ chính xác cũng tăng dần).
+    """
+    frontier = []
+    best_metric = None
+    for candidate in sorted(candidates, key=lambda c: (c["latency"][latency_key], -c[metric])):
+        if best_metric is None or candidate[metric] > best_metric:
+            frontier.append(candidate)
+            best_metric = candidate[metric]
+    return frontier
+
+
+def run_sweep(candidates, data_yaml, backend, image_paths, num_threads, metric=SWEEP_METRIC):
+    """
+    candidates: danh sách (tên, file .pt, mô hình gốc, imgsz). Đánh giá độ chính xác (luôn trên file .pt),
+    đo độ trễ theo backend (với 'onnx', file .pt được export sang .onnx batch động), đánh dấu biên Pareto.
+    Trả về bản tổng kết (xem write_summary).
+    """
+    exported = {}
+    results = []
+    for name, weights, model, imgsz in candidates:
+        print(f"\n>>> ĐÁNH GIÁ {name} <<<")
+        accuracy = evaluate_accuracy(weights, data_yaml, imgsz)
+        serving_weights = weights
+        if backend == "onnx":
+            if weights not in exported:
+                from export_onnx import export_onnx
+                exported[weights] = os.path.abspath(export_onnx(weights, imgsz, ONNX_OPSET))
+            serving_weights = exported[weights]
+        measured = measure_latency(serving_weights, backend, imgsz, image_paths, num_threads)
+        if "error" in measured:
+            print(f"[LỖI] {name}: không đo được độ trễ ({measured['error']}), bỏ qua")
+            continue
+        peak = measured["peak_rss_bytes"]
+        results.append({
+            "name": name,
+            "model": model,
+            "imgsz": imgsz,
+            "backend": backend,
+            "weights": os.path.abspath(serving_weights),
+            "file_bytes": os.path.getsize(serving_weights),
+            **accuracy,
+            "latency": measured["latency"],
+            "load_seconds": measured["load_seconds"],
+            "peak_rss_mb": peak / (1024 * 1024) if peak else None,
+            "model_rss_mb": measured["model_rss_bytes"] / (1024 * 1024) if measured["model_rss_bytes"] else None,
+        })
+        print(f"[INFO] {name}: {metric} {results[-1][metric]:.4f}, "
+              f"{LATENCY_KEY} {measured['latency'][LATENCY_KEY]:.1f} ms/ảnh")
+
+    frontier = pareto_frontier(results, metric)
+    for result in results:
+        result["pareto"] = any(result is candidate for candidate in frontier)
+    return {
+        "version": SUMMARY_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "metric": metric,
+        "latency_key": LATENCY_KEY,
+        "data": os.path.abspath(data_yaml),
+        "latency_images": len(image_paths),
+        "hardware": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "threads": num_threads,
+            "python": platform.python_version(),
+        },
+        "candidates": results,
+        "frontier": [candidate["name"] for candidate in frontier],
+    }
+
+
+def write_summary(summary, path):
+    """Ghi bản tổng kết bằng file tạm + os.replace để web app không bao giờ đọc phải file ghi dở."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def print_report(summary):
+    metric = summary["metric"]
+    print(f"\n>>> KẾT QUẢ ({summary['latency_images']} ảnh, {summary['hardware']['threads']} luồng CPU) <<<")
+    print(f"  {'ứng viên':<18}{metric:>10}{'mAP50':>8}{'p50 ms':>9}{'p95 ms':>9}{'RAM MB':>9}{'file MB':>9}  pareto")
+    for c in sorted(summary["candidates"], key=lambda c: c["latency"][summary["latency_key"]]):
+        peak = f"{c['peak_rss_mb']:.0f}" if c["peak_rss_mb"] else "-"
+        print(f"  {c['name']:<18}{c[metric]:>10.4f}{c['map50']:>8.4f}{c['latency']['p50_ms']:>9.1f}"
+              f"{c['latency']['p95_ms']:>9.1f}{peak:>9}{c['file_bytes'] / (1024 * 1024):>9.1f}"
+              f"  {'*' if c['pareto'] else ''}")
+    print(f"  Biên Pareto ({metric} theo {summary['latency_key']}): {' -> '.join(summary['frontier'])}")
+
+
+def build_candidates(data_yaml, models, image_sizes, weights=(), epochs=SWEEP_EPOCHS, batch=SWEEP_BATCH_SIZE,
+                     retrain=False):
+    """Danh sách (tên, file .pt, mô hình gốc, imgsz): từ các file weights có sẵn, hoặc huấn luyện mọi tổ hợp."""
+    if weights:
+        return [(candidate_name(path, imgsz), path, path, imgsz) for path in weights for imgsz in image_sizes]
+    return [(candidate_name(model, imgsz), train_candidate(model, imgsz, data_yaml, epochs, batch, retrain=retrain),
+             model, imgsz)
+            for model in models for imgsz in image_sizes]
+
+
+def validation_images(data_yaml, limit):
+    """Ảnh của tập val trong data.yaml (tạo bởi train_yolo.py), dùng để đo độ trễ."""
+    with open(data_yaml, encoding="utf-8") as f:
+        data_config = yaml.safe_load(f)
+    val_dir = os.path.join(data_config.get("path") or os.path.dirname(os.path.abspath(data_yaml)), data_config["val"])
+    return list_images([val_dir], limit)
+
+
+def sweep(data_yaml, models=SWEEP_MODELS, image_sizes=SWEEP_IMAGE_SIZES, weights=(), epochs=SWEEP_EPOCHS,
+          batch=SWEEP_BATCH_SIZE, retrain=False, backend="ultralytics", num_threads=LATENCY_THREADS,
+          latency_images=LATENCY_IMAGES, metric=SWEEP_METRIC, output=SUMMARY_PATH):
+    """Huấn luyện/đánh giá mọi ứng viên, ghi bản tổng kết ra output và in bảng kết quả. Trả về bản tổng kết."""
+    image_paths = validation_images(data_yaml, latency_images)
+    if not image_paths:
+        raise FileNotFoundError(f"Không có ảnh nào trong tập val của {data_yaml}")
+    candidates = build_candidates(data_yaml, models, image_sizes, weights, epochs, batch, retrain)
+    summary = run_sweep(candidates, data_yaml, backend, image_paths, num_threads, metric)
+    if summary["candidates"]:
+        write_summary(summary, output)
+        print_report(summary)
+        print(f"\nĐã ghi bản tổng kết: {output}")
+    return summary
+
+
+def publish_selected(summary_path, latency_budget_ms, backend, models_dir):
+    """Đưa ứng viên được chọn theo ngân sách độ trễ (select_sweep_candidate) vào models_dir, kèm imgsz."""
+    selected = select_sweep_candidate(summary_path, latency_budget_ms, backend)
+    if selected is None:
+        print(f"[LỖI] Không có ứng viên nào trong {summary_path} cho backend {backend}")
+        return None
+    if selected["latency"][LATENCY_KEY] > latency_budget_ms:
+        print(f"[CẢNH BÁO] Không ứng viên nào đạt {latency_budget_ms} ms/ảnh, chọn ứng viên nhanh nhất")
+    published = publish_model(selected["weights"], models_dir, version=f"sweep-{selected['name']}",
+                              metadata={"imgsz": selected["imgsz"], "sweep_candidate": selected["name"]})
+    print(f"[INFO] Đã đưa {selected['name']} ({selected['latency'][LATENCY_KEY]:.1f} ms/ảnh) vào thư mục của "
+          f"web app: {published}")
+    return published
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep kích thước mô hình x kích thước đầu vào: mAP, độ trễ CPU, bộ nhớ đỉnh và biên Pareto.")
+    parser.add_argument("--data", default=DATA_YAML_PATH, help="data.yaml tạo bởi train_yolo.py")
+    parser.add_argument("--models", default=",".join(SWEEP_MODELS), help="Các mô hình gốc để huấn luyện")
+    parser.add_argument("--imgsz", default=",".join(map(str, SWEEP_IMAGE_SIZES)), help="Các kích thước đầu vào")
+    parser.add_argument("--weights", nargs="*", default=[],
+                        help="Chỉ đánh giá các file .pt đã huấn luyện (mỗi file ở mọi --imgsz), không huấn luyện")
+    parser.add_argument("--epochs", type=int, default=SWEEP_EPOCHS)
+    parser.add_argument("--batch", type=int, default=SWEEP_BATCH_SIZE)
+    parser.add_argument("--retrain", action="store_true", help="Huấn luyện lại cả ứng viên đã có best.pt")
+    parser.add_argument("--backend", default="ultralytics", choices=("ultralytics", "onnx"),
+                        help="Backend dùng để đo độ trễ (như DETECTOR_BACKEND của web app)")
+    parser.add_argument("--threads", type=int, default=LATENCY_THREADS)
+    parser.add_argument("--latency-images", type=int, default=LATENCY_IMAGES)
+    parser.add_argument("--metric", default=SWEEP_METRIC, choices=METRICS)
+    parser.add_argument("--output", default=SUMMARY_PATH)
+    parser.add_argument("--publish-budget-ms", type=float, default=None,
+                        help=f"Đưa ứng viên chính xác nhất có {LATENCY_KEY} <= ngân sách vào --publish-dir (kèm imgsz)")
+    parser.add_argument("--publish-dir", default=os.path.join("anpr_web_app", "models"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data):
+        print(f"[LỖI] Không tìm thấy {args.data} (chạy train_yolo.py trước để chia dữ liệu)")
+        sys.exit(1)
+    try:
+        summary = sweep(args.data, [model for model in args.models.split(",") if model],
+                        [int(size) for size in args.imgsz.split(",") if size], weights=args.weights,
+                        epochs=args.epochs, batch=args.batch, retrain=args.retrain, backend=args.backend,
+                        num_threads=args.threads, latency_images=args.latency_images, metric=args.metric,
+                        output=args.output)
+    except FileNotFoundError as e:
+        print(f"[LỖI] {e}")
+        sys.exit(1)
+    if not summary["candidates"]:
+        print("[LỖI] Không đo được ứng viên nào")
+        sys.exit(1)
+    if args.publish_budget_ms:
+        publish_selected(args.output, args.publish_budget_ms, args.backend, args.publish_dir)
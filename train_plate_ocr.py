@@ -0,0 +1,309 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from dataset_tools import IMAGE_EXTENSIONS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from anpr_core import PLATE_ALLOWLIST, ANPRSystem  # noqa: E402
+from plate_layout import order_text_boxes  # noqa: E402
+from plate_normalizer import match_plate  # noqa: E402
+from plate_recognizer import (PLATE_ALPHABET, GrammarDecoder, build_crnn, config_path_for,  # noqa: E402
+                              decode_plate, model_config, prepare_plate_image)
+
+# ==============================================================================
+# PHẦN 1: CẤU HÌNH
+# ==============================================================================
+
+# 1. Dataset của YOLO (images/ + labels/): vùng biển số được cắt theo box trong file nhãn
+SOURCE_DATASET_DIR = "dataset"
+CROP_PADDING = 0.05     # Nới box mỗi cạnh một tỉ lệ, như sai lệch thường gặp của box YOLO
+
+# 2. Chuỗi biển số của từng vùng cắt: file CSV (crop,text,source), crop = "<tên ảnh>#<thứ tự box>",
+#    text là biển số đã định dạng (51A-123.45, 59-X2 123.45). Dòng có source=manual do người gán nhãn và luôn
+#    được giữ; các vùng chưa có nhãn được EasyOCR gán tự động (source=easyocr) nếu kết quả khớp ngữ pháp biển số
+#    với độ tin cậy >= PSEUDO_LABEL_MIN_CONF. Sửa text và đổi source thành manual để sửa nhãn sai.
+TEXT_LABELS_PATH = os.path.join(SOURCE_DATASET_DIR, "plate_texts.csv")
+PSEUDO_LABEL_MIN_CONF = 0.5
+
+# 3. Chia tập kiểm tra theo hash của tên vùng cắt (cố định giữa các lần chạy)
+VALIDATION_SPLIT = 0.1
+
+# 4. Huấn luyện
+EPOCHS = 60
+BATCH_SIZE = 64
+LEARNING_RATE = 1e-3
+SEED = 0
+
+# 5. Kết quả: plate_ocr.pt (torch), plate_ocr.onnx + plate_ocr.json (ONNX Runtime, dùng trong web app)
+OUTPUT_DIR = os.path.join("runs", "plate_ocr")
+
+# ==============================================================================
+# PHẦN 2: DỮ LIỆU, HUẤN LUYỆN VÀ XUẤT MÔ HÌNH
+# ==============================================================================
+
+
+def plate_crops(dataset_dir, padding=CROP_PADDING):
+    """Các vùng biển số (crop_id, ảnh BGR) cắt theo box YOLO trong labels/ của dataset, theo thứ tự tên ảnh."""
+    images_dir, labels_dir = os.path.join(dataset_dir, "images"), os.path.join(dataset_dir, "labels")
+    for name in sorted(os.listdir(images_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stem = os.path.splitext(name)[0]
+        label_path = os.path.join(labels_dir, stem + ".txt")
+        if not os.path.exists(label_path):
+            continue
+        image = cv2.imread(os.path.join(images_dir, name))
+        if image is None:
+            print(f"[CẢNH BÁO] Không đọc được ảnh: {name}")
+            continue
+        height, width = image.shape[:2]
+        with open(label_path, encoding="utf-8") as f:
+            boxes = [line.split() for line in f if len(line.split()) == 5]
+        for index, (_, cx, cy, w, h) in enumerate(boxes):
+            cx, cy = float(cx) * width, float(cy) * height
+            w, h = float(w) * width * (1 + 2 * padding), float(h) * height * (1 + 2 * padding)
+            x1, y1 = max(0, int(cx - w / 2)), max(0, int(cy - h / 2))
+            x2, y2 = min(width, int(round(cx + w / 2))), min(height, int(round(cy + h / 2)))
+            if x2 - x1 >= 8 and y2 - y1 >= 8:
+                yield f"{stem}#{index}", image[y1:y2, x1:x2]
+
+
+def is_validation(crop_id, val_split=VALIDATION_SPLIT):
+    """Vùng cắt thuộc tập kiểm tra: theo hash của tên ảnh (mọi box của một ảnh cùng một tập)."""
+    digest = hashlib.sha1(crop_id.split("#")[0].encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < val_split
+
+
+def load_text_labels(path):
+    """{crop_id: (text, source)} từ file CSV nhãn (rỗng nếu chưa có file)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8", newline="") as f:
+        return {row["crop"]: (row["text"], row.get("source") or "manual") for row in csv.DictReader(f)}
+
+
+def save_text_labels(path, labels):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["crop", "text", "source"])
+        for crop_id in sorted(labels):
+            writer.writerow([crop_id, *labels[crop_id]])
+    os.replace(tmp_path, path)
+
+
+def pseudo_label(crops, labels, min_conf=PSEUDO_LABEL_MIN_CONF):
+    """
+    Gán nhãn tự động cho các vùng cắt chưa có nhãn bằng EasyOCR như bậc 'fast' của ANPRSystem (mạng nhận dạng
+    trên từng dòng chữ), chỉ nhận kết quả khớp ngữ pháp biển số. Trả về số nhãn mới.
+    """
+    missing = [crop_id for crop_id in crops if crop_id not in labels]
+    if not missing:
+        return 0
+    import easyocr
+
+    print(f"[INFO] Gán nhãn tự động {len(missing)} vùng biển số bằng EasyOCR...")
+    reader = easyocr.Reader(['vi', 'en'])
+    added = 0
+    for count, crop_id in enumerate(missing, 1):
+        gray, rows = ANPRSystem._fast_plate_image(crops[crop_id])
+        result = reader.recognize(gray, horizontal_list=[[0, gray.shape[1], y0, y1] for y0, y1 in rows],
+                                  free_list=[], detail=1, paragraph=False, allowlist=PLATE_ALLOWLIST)
+        ordered, num_lines = order_text_boxes(result)
+        plate = match_plate(''.join(item[1] for item in ordered), two_line=num_lines > 1)
+        if plate is not None and ordered and min(item[2] for item in ordered) >= min_conf:
+            labels[crop_id] = (plate, "easyocr")
+            added += 1
+        if count % 200 == 0:
+            print(f"  - {count}/{len(missing)} vùng, {added} nhãn được nhận")
+    return added
+
+
+def training_text(plate):
+    """Chuỗi mục tiêu của CTC: biển số đã định dạng, các dòng nối liền (59-X2 123.45 -> 59-X2123.45)."""
+    return plate.replace(" ", "")
+
+
+def augment(image, rng):
+    """Biến đổi ngẫu nhiên ảnh biển số (BGR): xoay/cắt lệch nhẹ, độ sáng/tương phản, mờ, nhiễu."""
+    height, width = image.shape[:2]
+    angle, shear = rng.uniform(-5, 5), rng.uniform(-0.15, 0.15)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, rng.uniform(0.9, 1.05))
+    matrix[0, 1] += shear
+    matrix[0, 2] -= shear * height / 2
+    image = cv2.warpAffine(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    image = cv2.convertScaleAbs(image, alpha=rng.uniform(0.6, 1.4), beta=rng.uniform(-40, 40))
+    if rng.random() < 0.3:
+        image = cv2.GaussianBlur(image, (3, 3), 0)
+    if rng.random() < 0.3:
+        noise = rng.normal(0, 8, image.shape).astype(np.float32)
+        image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return image
+
+
+def model_input(image):
+    """Đầu vào của CRNN từ ảnh biển số, qua đúng các bước của bậc 'fast' lúc suy luận."""
+    gray, rows = ANPRSystem._fast_plate_image(image)
+    return prepare_plate_image(gray, rows), len(rows) > 1
+
+
+class PlateDataset:
+    """Dataset (kiểu map của torch) các mẫu (ảnh BGR, biển số); tăng cường ngẫu nhiên khi train=True."""
+
+    def __init__(self, samples, train):
+        self.samples = samples
+        self.train = train
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        import torch
+
+        image, plate = self.samples[index]
+        if self.train:
+            image = augment(image, np.random.default_rng())
+        tensor, _ = model_input(image)
+        target = [PLATE_ALPHABET.index(c) + 1 for c in training_text(plate)]
+        return torch.from_numpy(tensor)[None], torch.tensor(target, dtype=torch.long)
+
+
+def collate(batch):
+    import torch
+
+    images = torch.stack([item[0] for item in batch])
+    targets = torch.cat([item[1] for item in batch])
+    lengths = torch.tensor([len(item[1]) for item in batch], dtype=torch.long)
+    return images, targets, lengths
+
+
+def evaluate(model, samples):
+    """Tỉ lệ biển số đọc đúng hoàn toàn (giải mã theo ngữ pháp) trên các mẫu (ảnh BGR, biển số)."""
+    import torch
+
+    decoder = GrammarDecoder()
+    model.eval()
+    correct = 0
+    with torch.inference_mode():
+        for start in range(0, len(samples), BATCH_SIZE):
+            chunk = samples[start:start + BATCH_SIZE]
+            inputs = [model_input(image) for image, _ in chunk]
+            log_probs = model(torch.from_numpy(np.stack([tensor for tensor, _ in inputs]))[:, None]).numpy()
+            for (_, plate), (_, two_line), probs in zip(chunk, inputs, log_probs):
+                texts, _ = decode_plate(probs, decoder, two_line)
+                correct += match_plate(''.join(texts), two_line=len(texts) > 1) == plate
+    return correct / len(samples) if samples else 0.0
+
+
+def export_model(model, output_dir, config):
+    """Ghi plate_ocr.pt (torch), plate_ocr.onnx và plate_ocr.json (cấu hình cho ONNX Runtime)."""
+    import torch
+
+    pt_path = os.path.join(output_dir, "plate_ocr.pt")
+    onnx_path = os.path.join(output_dir, "plate_ocr.onnx")
+    torch.save({"state_dict": model.state_dict(), "config": config}, pt_path)
+    model.eval()
+    dummy = torch.zeros(1, 1, config["input_height"], config["input_width"])
+    torch.onnx.export(model, dummy, onnx_path, input_names=["image"], output_names=["log_probs"],
+                      dynamic_axes={"image": {0: "batch"}, "log_probs": {0: "batch"}}, opset_version=17)
+    with open(config_path_for(onnx_path), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return pt_path, onnx_path
+
+
+def train(train_samples, val_samples, output_dir, epochs, batch_size, learning_rate, workers):
+    import torch
+
+    torch.manual_seed(SEED)
+    model = build_crnn(len(PLATE_ALPHABET) + 1)
+    config = model_config()
+    loader = torch.utils.data.DataLoader(PlateDataset(train_samples, train=True), batch_size=batch_size,
+                                         shuffle=True, num_workers=workers, collate_fn=collate, drop_last=True)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=learning_rate, epochs=epochs,
+                                                    steps_per_epoch=max(1, len(loader)))
+    ctc_loss = torch.nn.CTCLoss(blank=0, zero_infinity=True)
+
+    best_accuracy, best_state = -1.0, None
+    for epoch in range(1, epochs + 1):
+        model.train()
+        started, total_loss = time.perf_counter(), 0.0
+        for images, targets, target_lengths in loader:
+            log_probs = model(images).permute(1, 0, 2)  # (T, N, C) cho CTCLoss
+            input_lengths = torch.full((images.shape[0],), log_probs.shape[0], dtype=torch.long)
+            loss = ctc_loss(log_probs, targets, input_lengths, target_lengths)
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), 5.0)
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item()
+
+        accuracy = evaluate(model, val_samples)
+        print(f"Epoch {epoch}/{epochs}: loss {total_loss / max(1, len(loader)):.4f}, "
+              f"độ chính xác (val) {accuracy:.3f} ({time.perf_counter() - started:.1f}s)")
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            best_state = {name: value.detach().clone() for name, value in model.state_dict().items()}
+
+    model.load_state_dict(best_state)
+    os.makedirs(output_dir, exist_ok=True)
+    pt_path, onnx_path = export_model(model, output_dir, config)
+    return best_accuracy, pt_path, onnx_path
+
+# ==============================================================================
+# PHẦN 3: THỰC THI CHƯƠNG TRÌNH
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Huấn luyện bộ nhận dạng biển số CRNN/CTC nhỏ trên các vùng biển số của dataset YOLO.")
+    parser.add_argument("--dataset", default=SOURCE_DATASET_DIR)
+    parser.add_argument("--labels", default=TEXT_LABELS_PATH, help="File CSV chuỗi biển số của từng vùng cắt")
+    parser.add_argument("--no-pseudo-labels", action="store_true",
+                        help="Chỉ dùng nhãn có sẵn trong file CSV, không gán nhãn bằng EasyOCR")
+    parser.add_argument("--manual-only", action="store_true", help="Chỉ huấn luyện trên nhãn source=manual")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--workers", type=int, default=2, help="Số tiến trình DataLoader")
+    args = parser.parse_args()
+
+    print(">>> BƯỚC 1: CẮT VÙNG BIỂN SỐ TỪ DATASET <<<")
+    crops = dict(plate_crops(args.dataset))
+    print(f"[INFO] {len(crops)} vùng biển số")
+
+    print("\n>>> BƯỚC 2: NHÃN CHUỖI BIỂN SỐ <<<")
+    labels = load_text_labels(args.labels)
+    if not args.no_pseudo_labels:
+        added = pseudo_label(crops, labels)
+        if added:
+            save_text_labels(args.labels, labels)
+            print(f"[INFO] Đã thêm {added} nhãn tự động vào {args.labels}")
+    samples = {crop_id: (crops[crop_id], text) for crop_id, (text, source) in labels.items()
+               if crop_id in crops and (source == "manual" or not args.manual_only)
+               and match_plate(text, two_line=" " in text) == text}
+    train_samples = [samples[c] for c in sorted(samples) if not is_validation(c)]
+    val_samples = [samples[c] for c in sorted(samples) if is_validation(c)]
+    print(f"[INFO] {len(train_samples)} mẫu huấn luyện, {len(val_samples)} mẫu kiểm tra")
+    if not train_samples or not val_samples:
+        print("[LỖI] Không đủ nhãn để huấn luyện; hãy gán nhãn trong file CSV hoặc bật gán nhãn tự động")
+        sys.exit(1)
+
+    print("\n>>> BƯỚC 3: HUẤN LUYỆN CRNN <<<")
+    accuracy, pt_path, onnx_path = train(train_samples, val_samples, args.output_dir, args.epochs,
+                                         args.batch_size, args.lr, args.workers)
+    print(f"\n[THÀNH CÔNG] Độ chính xác tốt nhất trên tập kiểm tra: {accuracy:.3f}")
+    print(f"  - torch: {pt_path}")
+    print(f"  - ONNX:  {onnx_path} (dùng với ocr_backend='crnn' của ANPRSystem)")
+    print("So sánh với EasyOCR: python benchmark_plate_ocr.py --crnn " + onnx_path)
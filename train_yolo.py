@@ -1,9 +1,15 @@
 import os
-import random
-import shutil
+import sys
 import yaml
 from ultralytics import YOLO
 
+from dataset_tools import print_split_summary, split_dataset
+from model_sweep import SUMMARY_PATH, SWEEP_IMAGE_SIZES, SWEEP_MODELS, publish_selected, sweep
+from train_cache import EpochTimer, cached_trainer_class
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "anpr_web_app"))
+from model_registry import publish_model  # noqa: E402
+
 # ==============================================================================
 # PHẦN 1: CẤU HÌNH (BẠN CHỈ CẦN THAY ĐỔI CÁC THÔNG SỐ Ở ĐÂY)
 # ==============================================================================
@@ -20,6 +26,11 @@ SPLIT_DATASET_DIR = "dataset_split"
 #    0.2 nghĩa là 80% cho training, 20% cho validation.
 VALIDATION_SPLIT = 0.2
 
+#    Seed của việc chia dữ liệu (chia theo hash nội dung ảnh nên cùng seed luôn cho cùng kết quả),
+#    và cách đưa file vào thư mục đã chia: 'hardlink' (mặc định), 'symlink' hoặc 'copy'.
+VALIDATION_SEED = 0
+SPLIT_LINK_MODE = 'hardlink'
+
 # 4. Tên các lớp đối tượng của bạn.
 #    Thứ tự phải khớp với class_id trong các file nhãn .txt.
 #    Nếu bạn chỉ có một lớp là "biển số xe" (class_id = 0), hãy để như sau:
@@ -29,7 +40,29 @@ CLASS_NAMES = ["lisence_plate"]
 EPOCHS = 50          # Số chu kỳ huấn luyện. Bắt đầu với 2, có thể tăng nếu cần.
 IMAGE_SIZE = 640     # Kích thước ảnh đầu vào cho mô hình. 640 là giá trị phổ biến.
 BATCH_SIZE = 16      # -1 để YOLO tự động điều chỉnh batch size cho phù hợp với VRAM của GPU.
-YOLO_MODEL = 'yolov8x.pt' # Model để bắt đầu. 'n' (nano) là nhỏ nhất, 's' (small), 'm' (medium).
+YOLO_MODEL = 'yolov8n.pt' # Model để bắt đầu. 'n' (nano) là nhỏ nhất, 's' (small), 'm' (medium).
+                          # Dùng chế độ sweep (mục 8) để chọn kích thước mô hình/ảnh theo độ trễ CPU.
+
+# 6. Thư mục mô hình của web app (MODELS_DIR trong anpr_web_app/app.py). Sau khi huấn luyện, best.pt được
+#    đưa vào đây với tên theo thời điểm; server đang chạy tự nạp phiên bản mới mà không cần khởi động lại.
+#    Đặt None để không đưa vào.
+PUBLISH_MODELS_DIR = os.path.join("anpr_web_app", "models")
+
+# 7. Cache ảnh đã tiền xử lý (train_cache.py): lần huấn luyện đầu giải mã và resize mọi ảnh một lần vào
+#    dataset_split/.train_cache (memmap), các epoch sau đọc thẳng từ đó, không giải mã JPEG. Cache được
+#    tạo lại khi nội dung dataset hoặc IMAGE_SIZE đổi. Đặt False để đọc ảnh từ file như cũ (để so sánh
+#    thời gian mỗi epoch); chạy "python train_cache.py dataset_split/train/images" để đo riêng bộ nạp dữ liệu.
+USE_TRAIN_CACHE = True
+TRAIN_CACHE_WORKERS = 8   # Số luồng giải mã ảnh khi tạo cache
+
+# 8. Chế độ sweep (model_sweep.py): thay vì huấn luyện một mô hình YOLO_MODEL ở IMAGE_SIZE, huấn luyện mọi tổ hợp
+#    SWEEP_MODEL_SIZES x SWEEP_INPUT_SIZES (runs/sweep/<mô hình>-<imgsz>), đo mAP, độ trễ CPU và bộ nhớ đỉnh trên
+#    tập val, in biên Pareto và ghi runs/model_sweep.json (web app đọc file này khi đặt LATENCY_BUDGET_MS).
+#    SWEEP_LATENCY_BUDGET_MS (ms/ảnh, p95): đưa ứng viên chính xác nhất đủ nhanh vào PUBLISH_MODELS_DIR.
+SWEEP = False
+SWEEP_MODEL_SIZES = SWEEP_MODELS
+SWEEP_INPUT_SIZES = SWEEP_IMAGE_SIZES
+SWEEP_LATENCY_BUDGET_MS = None
 
 # ==============================================================================
 # PHẦN 2: CÁC HÀM TIỆN ÍCH (KHÔNG CẦN THAY ĐỔI)
@@ -38,62 +71,23 @@ YOLO_MODEL = 'yolov8x.pt' # Model để bắt đầu. 'n' (nano) là nhỏ nhấ
 def split_data(source_dir, output_dir, val_split):
     """
     Chia dữ liệu từ thư mục nguồn thành các tập train và validation.
+    Dùng dataset_tools.split_dataset: kiểm tra song song, chia theo hash nội dung (tất định theo
+    VALIDATION_SEED) và dùng hardlink thay vì sao chép; chạy lại chỉ xử lý các file mới hoặc đã thay đổi.
     """
     print(">>> BƯỚC 1: BẮT ĐẦU QUÁ TRÌNH CHIA DỮ LIỆU <<<")
     
-    source_images_dir = os.path.join(source_dir, "images")
-    source_labels_dir = os.path.join(source_dir, "labels")
-
-    if not os.path.isdir(source_images_dir) or not os.path.isdir(source_labels_dir):
-        print(f"[LỖI] Không tìm thấy thư mục 'images' hoặc 'labels' bên trong '{source_dir}'.")
+    try:
+        summary = split_dataset(source_dir, output_dir, val_split, seed=VALIDATION_SEED,
+                                link_mode=SPLIT_LINK_MODE, num_classes=len(CLASS_NAMES))
+    except FileNotFoundError as e:
+        print(f"[LỖI] {e}")
         print("Vui lòng kiểm tra lại cấu trúc thư mục của bạn.")
         return False
-
-    train_images_dir = os.path.join(output_dir, "train", "images")
-    train_labels_dir = os.path.join(output_dir, "train", "labels")
-    val_images_dir = os.path.join(output_dir, "val", "images")
-    val_labels_dir = os.path.join(output_dir, "val", "labels")
-
-    # Tạo các thư mục đích
-    for dir_path in [train_images_dir, train_labels_dir, val_images_dir, val_labels_dir]:
-        os.makedirs(dir_path, exist_ok=True)
-
-    # Lấy danh sách tất cả các file ảnh và xáo trộn chúng để đảm bảo tính ngẫu nhiên
-    image_files = [f for f in os.listdir(source_images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    random.shuffle(image_files)
-
-    # Tính toán điểm chia dữ liệu
-    split_index = int(len(image_files) * (1 - val_split))
-    train_files = image_files[:split_index]
-    val_files = image_files[split_index:]
-
-    # Hàm trợ giúp để sao chép các cặp file (ảnh và nhãn)
-    def copy_files(files, dest_img_dir, dest_lbl_dir):
-        count = 0
-        for img_file in files:
-            base_name = os.path.splitext(img_file)[0]
-            lbl_file = f"{base_name}.txt"
-            
-            source_img_path = os.path.join(source_images_dir, img_file)
-            source_lbl_path = os.path.join(source_labels_dir, lbl_file)
-
-            if os.path.exists(source_lbl_path):
-                shutil.copy(source_img_path, dest_img_dir)
-                shutil.copy(source_lbl_path, dest_lbl_dir)
-                count += 1
-        return count
-
-    print(f"[INFO] Đang sao chép {len(train_files)} file vào tập train...")
-    num_train = copy_files(train_files, train_images_dir, train_labels_dir)
-    
-    print(f"[INFO] Đang sao chép {len(val_files)} file vào tập validation...")
-    num_val = copy_files(val_files, val_images_dir, val_labels_dir)
     
     print("\n[THÀNH CÔNG] Chia dữ liệu hoàn tất!")
-    print(f"  - Tổng số cặp ảnh/nhãn hợp lệ: {num_train + num_val}")
-    print(f"  - Tập Train: {num_train} ảnh")
-    print(f"  - Tập Validation: {num_val} ảnh")
-    return True
+    print(f"  - Tổng số cặp ảnh/nhãn hợp lệ: {summary['train'] + summary['val']}")
+    print_split_summary(summary)
+    return summary['train'] + summary['val'] > 0
 
 def create_yaml_file(output_dir, class_names):
     """
@@ -126,6 +120,7 @@ def evaluate_model(model, yaml_path, output_dir):
     """
     print("\n>>> BƯỚC 4: ĐÁNH GIÁ MÔ HÌNH <<<")
     results = model.val(data=yaml_path)
+    speed = getattr(results, "speed", None) or {}
 
     # Extract metrics
     metrics = {
@@ -133,7 +128,9 @@ def evaluate_model(model, yaml_path, output_dir):
         'mAP@0.5:0.95': results.box.map,
         'Precision': results.box.p[0] if results.box.p else 0,
         'Recall': results.box.r[0] if results.box.r else 0,
-        'F1-Score': results.box.f1[0] if results.box.f1 else 0
+        'F1-Score': results.box.f1[0] if results.box.f1 else 0,
+        # Thời gian suy luận trung bình (ms/ảnh) trên thiết bị đánh giá; độ trễ CPU khi phục vụ: chế độ sweep
+        'Inference ms/image': speed.get('inference', 0.0)
     }
 
     # Save metrics to file
@@ -162,12 +159,20 @@ if __name__ == "__main__":
     # Bước 2: Tạo file YAML
     yaml_file_path = create_yaml_file(SPLIT_DATASET_DIR, CLASS_NAMES)
 
+    if SWEEP:
+        print("\n>>> BƯỚC 3: SWEEP KÍCH THƯỚC MÔ HÌNH x KÍCH THƯỚC ẢNH <<<")
+        summary = sweep(yaml_file_path, SWEEP_MODEL_SIZES, SWEEP_INPUT_SIZES, epochs=EPOCHS, batch=BATCH_SIZE)
+        if summary["candidates"] and PUBLISH_MODELS_DIR and SWEEP_LATENCY_BUDGET_MS:
+            publish_selected(SUMMARY_PATH, SWEEP_LATENCY_BUDGET_MS, "ultralytics", PUBLISH_MODELS_DIR)
+        exit()
+
     # Bước 3: Huấn luyện YOLOv8
     print("\n>>> BƯỚC 3: BẮT ĐẦU QUÁ TRÌNH HUẤN LUYỆN YOLOv8 <<<")
     print("="*2)
 
     # Tải một mô hình YOLOv8 đã được huấn luyện trước (pre-trained)
     model = YOLO(YOLO_MODEL)
+    epoch_timer = EpochTimer("có cache" if USE_TRAIN_CACHE else "không cache").register(model)
 
     # Bắt đầu huấn luyện (fine-tuning) trên bộ dữ liệu của bạn
     results = model.train(
@@ -175,11 +180,23 @@ if __name__ == "__main__":
         epochs=EPOCHS,
         imgsz=IMAGE_SIZE,
         batch=BATCH_SIZE,
-        name='yolo_bien_so_xe_detector' # Tên của thư mục kết quả huấn luyện
+        name='yolo_bien_so_xe_detector', # Tên của thư mục kết quả huấn luyện
+        trainer=cached_trainer_class(TRAIN_CACHE_WORKERS) if USE_TRAIN_CACHE else None
     )
 
+    timing = epoch_timer.summary()
+    if timing["epochs"]:
+        mean = f"{timing['mean_epoch_seconds']:.1f}s" if timing["mean_epoch_seconds"] is not None else "-"
+        print(f"\n[INFO] Thời gian mỗi epoch ({timing['label']}): epoch đầu {timing['first_epoch_seconds']:.1f}s, "
+              f"trung bình các epoch sau {mean}")
+
     metrics = evaluate_model(model, yaml_file_path, SPLIT_DATASET_DIR)
 
+    best_weights = getattr(getattr(model, "trainer", None), "best", None)
+    if PUBLISH_MODELS_DIR and best_weights and os.path.exists(best_weights):
+        published = publish_model(str(best_weights), PUBLISH_MODELS_DIR)
+        print(f"\n[INFO] Đã đưa mô hình vào thư mục của web app: {published}")
+
     print("\n" + "="*2)
     print(">>> HUẤN LUYỆN HOÀN TẤT! <<<")
     print("Kết quả được lưu trong thư mục 'runs/detect/yolo_bien_so_xe_detector'")